@@ -0,0 +1,192 @@
+
+
+const int sensor4x = A0;
+const int sensor4y = A1;
+const int sensor4z = A2;
+const int sensor1x = A3;
+const int sensor1y = A4;
+const int sensor1z = A5;
+const int sensor3x = A7;
+const int sensor3y = A8;
+const int sensor3z = A9;
+const int sensor5x = A10;
+const int sensor5y = A11;
+const int sensor5z = A12;
+const int sensor2x = A13;
+const int sensor2y = A14;
+const int sensor2z = A15;
+
+// Variables
+const int NO_OF_SENSORS = 5;
+const int NO_OF_SAMPLES = 250;
+const int sensorInfo[5][3] = { {sensor1x,sensor1y,sensor1z},
+                               {sensor2x,sensor2y,sensor2z},
+                               {sensor3x,sensor3y,sensor3z},
+                               {sensor4x,sensor4y,sensor4z},
+                               {sensor5x,sensor5y,sensor5z} };
+
+// Binary frame layout (little-endian), decoded by Serial_Protocol.py
+// Sync word 0xA5 0x5A | Sequence (2) | Sensors (1) | Rows (1) | Time start us (4) | Time end us (4) |
+// 10-bit samples packed 4 to every 5 bytes |
+// for every row: us since the previous row started (2), then for every sensor after the first the time since
+// the previous sensor was read in 4us ticks (1) |
+// CRC-16/CCITT-FALSE of everything after the sync word (2)
+const int ROWS_PER_FRAME = 10;
+const int NO_OF_FRAMES = NO_OF_SAMPLES / ROWS_PER_FRAME;
+const int NO_OF_VALUES = ROWS_PER_FRAME * NO_OF_SENSORS * 3;
+const int PACKED_BYTES = ((NO_OF_VALUES + 3) / 4) * 5;
+const int TIME_BYTES = ROWS_PER_FRAME * (NO_OF_SENSORS + 1);
+const int FRAME_SIZE = 14 + PACKED_BYTES + TIME_BYTES + 2;
+
+bool start = false;
+int serialRX;
+unsigned int sequence = 0;
+// Readings are packed into their frames as they are taken. There is not enough RAM to hold
+// the readings as ints and their times as well.
+byte frames[NO_OF_FRAMES][FRAME_SIZE];
+
+void setup() {
+  
+  Serial.begin(115200);
+  analogReference(EXTERNAL);
+  
+}
+
+unsigned int crc16(const byte *data, int length){
+  unsigned int crc = 0xFFFF;
+  for(int i=0; i<length; i++){
+    crc ^= (unsigned int)data[i] << 8;
+    for(int j=0; j<8; j++){
+      if (crc & 0x8000){
+        crc = (crc << 1) ^ 0x1021;
+      }
+      else{
+        crc = crc << 1;
+      }
+    }
+  }
+  return crc;
+}
+
+void putLong(byte *dest, unsigned long value){
+  dest[0] = value & 0xFF;
+  dest[1] = (value >> 8) & 0xFF;
+  dest[2] = (value >> 16) & 0xFF;
+  dest[3] = (value >> 24) & 0xFF;
+}
+
+void putInt(byte *dest, unsigned int value){
+  dest[0] = value & 0xFF;
+  dest[1] = (value >> 8) & 0xFF;
+}
+
+// Packs the 10-bit reading v into position k of the packed samples of frame, which must start at zero
+void putValue(byte *frame, int k, unsigned int v){
+  byte *group = &frame[14 + ((k / 4) * 5)];
+  switch (k % 4){
+    case 0:
+      group[0] |= v & 0xFF;
+      group[1] |= v >> 8;
+      break;
+    case 1:
+      group[1] |= (v & 0x3F) << 2;
+      group[2] |= v >> 6;
+      break;
+    case 2:
+      group[2] |= (v & 0x0F) << 4;
+      group[3] |= v >> 4;
+      break;
+    case 3:
+      group[3] |= (v & 0x03) << 6;
+      group[4] |= v >> 2;
+      break;
+  }
+}
+
+// Fills in the header and CRC of frame f and sends it
+void sendFrame(int f){
+  byte *frame = frames[f];
+  frame[0] = 0xA5;
+  frame[1] = 0x5A;
+  frame[2] = sequence & 0xFF;
+  frame[3] = (sequence >> 8) & 0xFF;
+  frame[4] = NO_OF_SENSORS;
+  frame[5] = ROWS_PER_FRAME;
+
+  unsigned int crc = crc16(&frame[2], FRAME_SIZE - 4);
+  frame[FRAME_SIZE - 2] = crc & 0xFF;
+  frame[FRAME_SIZE - 1] = (crc >> 8) & 0xFF;
+
+  Serial.write(frame, FRAME_SIZE);
+  sequence++;
+}
+
+void loop() {
+  while(!start){
+     if (Serial.available() > 0){
+        serialRX = Serial.read();
+        if (serialRX == 'S'){
+          start = true;
+        }
+     }
+  }
+
+  
+  while(start){
+
+    memset(frames, 0, sizeof(frames));
+    unsigned long rowStart = 0;
+
+    for(int i=0; i<NO_OF_SAMPLES; i++){
+      byte *frame = frames[i / ROWS_PER_FRAME];
+      int row = i % ROWS_PER_FRAME;
+      byte *rowTimes = &frame[14 + PACKED_BYTES + (row * (NO_OF_SENSORS + 1))];
+
+      // The row delta is the time since the previous row of the frame started, 0 for the first row
+      unsigned long now = micros();
+      if (row == 0){
+        putLong(&frame[6], now);
+      }
+      else{
+        putInt(rowTimes, now - rowStart);
+      }
+      rowStart = now;
+
+      unsigned long sensorTime = now;
+      for(int j=0; j<NO_OF_SENSORS; j++){
+        if (j > 0){
+          // Time since the previous sensor was read, in the 4us steps of micros()
+          now = micros();
+          unsigned long ticks = (now - sensorTime) / 4;
+          rowTimes[1 + j] = (ticks > 255) ? 255 : ticks;
+          sensorTime = now;
+        }
+        
+        // Takes 100 microseconds per analogue read plus added delay
+        int k = (row * NO_OF_SENSORS * 3) + (j * 3);
+        putValue(frame, k, analogRead(sensorInfo[j][0]));
+        delayMicroseconds(100);
+        putValue(frame, k + 1, analogRead(sensorInfo[j][1]));
+        delayMicroseconds(100);
+        putValue(frame, k + 2, analogRead(sensorInfo[j][2]));
+        delayMicroseconds(100);
+      }
+      if (row == ROWS_PER_FRAME - 1){
+        putLong(&frame[10], micros());
+      }
+    }
+
+    // Frames are written back to back. Serial.write blocks while the transmit buffer is full
+    // so no delay is needed between sensors.
+    for(int f=0; f<NO_OF_FRAMES; f++){
+      sendFrame(f);
+    }
+    
+    if (Serial.available() > 0){
+        serialRX = Serial.read();
+        if (serialRX == 'S'){
+          start = false;
+        }
+    }
+  } 
+}
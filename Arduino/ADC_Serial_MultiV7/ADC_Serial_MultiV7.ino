@@ -0,0 +1,267 @@
+
+
+const int sensor4x = A0;
+const int sensor4y = A1;
+const int sensor4z = A2;
+const int sensor1x = A3;
+const int sensor1y = A4;
+const int sensor1z = A5;
+const int sensor3x = A7;
+const int sensor3y = A8;
+const int sensor3z = A9;
+const int sensor5x = A10;
+const int sensor5y = A11;
+const int sensor5z = A12;
+const int sensor2x = A13;
+const int sensor2y = A14;
+const int sensor2z = A15;
+
+// Variables
+const int NO_OF_SENSORS = 5;
+const int sensorInfo[5][3] = { {sensor1x,sensor1y,sensor1z},
+                               {sensor2x,sensor2y,sensor2z},
+                               {sensor3x,sensor3y,sensor3z},
+                               {sensor4x,sensor4y,sensor4z},
+                               {sensor5x,sensor5y,sensor5z} };
+
+// Time between the start of each row of readings. Every row takes 30 conversions of 104us (each channel is
+// converted twice and the first result thrown away to let the input settle, as the delay did in V5) so the
+// period must be above 3.2ms.
+const unsigned int SAMPLE_PERIOD_US = 4000;
+
+// Binary frame layout, the same as ADC_Serial_MultiV6 and decoded by Serial_Protocol.py (little-endian)
+// Sync word 0xA5 0x5A | Sequence (2) | Sensors (1) | Rows (1) | Time start us (4) | Time end us (4) |
+// 10-bit samples packed 4 to every 5 bytes |
+// for every row: us since the previous row started (2), then for every sensor after the first the time since
+// the previous sensor was read in 4us ticks (1) |
+// CRC-16/CCITT-FALSE of everything after the sync word (2)
+const int ROWS_PER_FRAME = 10;
+const int NO_OF_VALUES = ROWS_PER_FRAME * NO_OF_SENSORS * 3;
+const int PACKED_BYTES = ((NO_OF_VALUES + 3) / 4) * 5;
+const int TIME_BYTES = ROWS_PER_FRAME * (NO_OF_SENSORS + 1);
+const int FRAME_SIZE = 14 + PACKED_BYTES + TIME_BYTES + 2;
+
+// Frames are filled by the ADC interrupt while loop() sends the ones already full. With 4 buffers the
+// transmitter can fall up to 3 frames behind before a frame is lost. A lost frame still uses up its
+// sequence number so the gap is seen by the receiver.
+const int NO_OF_BUFFERS = 4;
+byte frames[NO_OF_BUFFERS][FRAME_SIZE];
+volatile byte fillBuffer = 0;       // Frame being filled by the interrupts
+volatile byte sendBuffer = 0;       // Next frame to be sent by loop()
+volatile byte framesReady = 0;      // Frames full and waiting to be sent
+volatile unsigned int sequence = 0;
+volatile unsigned int overruns = 0; // Frames lost because every buffer was full
+
+volatile bool sampling = false;
+volatile int row = 0;               // Row of the frame being filled
+volatile int conversion = 0;        // Conversion within the row, two for each reading
+volatile unsigned long rowStart;
+volatile unsigned long sensorTime;
+volatile bool skipFrame = false;    // Set while a frame is being dropped
+
+int serialRX;
+
+void setup() {
+
+  Serial.begin(115200);
+  analogReference(EXTERNAL);
+  analogRead(sensorInfo[0][0]);     // Sets up the ADC clock and reference as analogRead does
+
+  // Timer1 in CTC mode with a /8 prescaler counts in 0.5us steps and interrupts every SAMPLE_PERIOD_US
+  noInterrupts();
+  TCCR1A = 0;
+  TCCR1B = (1 << WGM12) | (1 << CS11);
+  OCR1A = (SAMPLE_PERIOD_US * 2) - 1;
+  interrupts();
+
+}
+
+unsigned int crc16(const byte *data, int length){
+  unsigned int crc = 0xFFFF;
+  for(int i=0; i<length; i++){
+    crc ^= (unsigned int)data[i] << 8;
+    for(int j=0; j<8; j++){
+      if (crc & 0x8000){
+        crc = (crc << 1) ^ 0x1021;
+      }
+      else{
+        crc = crc << 1;
+      }
+    }
+  }
+  return crc;
+}
+
+void putLong(byte *dest, unsigned long value){
+  dest[0] = value & 0xFF;
+  dest[1] = (value >> 8) & 0xFF;
+  dest[2] = (value >> 16) & 0xFF;
+  dest[3] = (value >> 24) & 0xFF;
+}
+
+void putInt(byte *dest, unsigned int value){
+  dest[0] = value & 0xFF;
+  dest[1] = (value >> 8) & 0xFF;
+}
+
+// Packs the 10-bit reading v into position k of the packed samples of frame, which must start at zero
+void putValue(byte *frame, int k, unsigned int v){
+  byte *group = &frame[14 + ((k / 4) * 5)];
+  switch (k % 4){
+    case 0:
+      group[0] |= v & 0xFF;
+      group[1] |= v >> 8;
+      break;
+    case 1:
+      group[1] |= (v & 0x3F) << 2;
+      group[2] |= v >> 6;
+      break;
+    case 2:
+      group[2] |= (v & 0x0F) << 4;
+      group[3] |= v >> 4;
+      break;
+    case 3:
+      group[3] |= (v & 0x03) << 6;
+      group[4] |= v >> 2;
+      break;
+  }
+}
+
+// Selects the analogue pin of reading k of a row (X1,Y1,Z1...XN,YN,ZN) and starts a conversion
+void startConversion(int k){
+  byte channel = sensorInfo[k / 3][k % 3] - A0;
+  ADMUX = (ADMUX & 0xE0) | (channel & 0x07);
+  if (channel & 0x08){
+    ADCSRB |= (1 << MUX5);
+  }
+  else{
+    ADCSRB &= ~(1 << MUX5);
+  }
+  ADCSRA |= (1 << ADSC) | (1 << ADIE);
+}
+
+// Starts a fresh frame in the fill buffer, or marks it to be dropped if loop() has not sent it yet
+void startFrame(){
+  skipFrame = (framesReady >= NO_OF_BUFFERS);
+  if (skipFrame){
+    overruns++;
+    return;
+  }
+  memset(frames[fillBuffer], 0, FRAME_SIZE);
+  putLong(&frames[fillBuffer][6], rowStart);
+}
+
+// Starts a row of readings every SAMPLE_PERIOD_US
+ISR(TIMER1_COMPA_vect){
+  unsigned long now = micros();
+  if (row == 0){
+    rowStart = now;
+    startFrame();
+  }
+  else if (!skipFrame){
+    putInt(&frames[fillBuffer][14 + PACKED_BYTES + (row * (NO_OF_SENSORS + 1))], now - rowStart);
+  }
+  rowStart = now;
+  sensorTime = now;
+  conversion = 0;
+  startConversion(0);
+}
+
+// Stores each conversion and starts the next until the row is complete
+ISR(ADC_vect){
+  unsigned int value = ADC;
+  int k = conversion / 2;
+  byte *frame = frames[fillBuffer];
+
+  // The first conversion of each channel lets the input settle and is thrown away
+  if ((conversion % 2 == 1) && !skipFrame){
+    putValue(frame, (row * NO_OF_SENSORS * 3) + k, value);
+  }
+  conversion++;
+
+  if (conversion < NO_OF_SENSORS * 6){
+    k = conversion / 2;
+    if ((conversion % 6 == 0) && !skipFrame){
+      // Time since the previous sensor was read, in the 4us steps of micros()
+      unsigned long now = micros();
+      unsigned long ticks = (now - sensorTime) / 4;
+      frame[14 + PACKED_BYTES + (row * (NO_OF_SENSORS + 1)) + 1 + (k / 3)] = (ticks > 255) ? 255 : ticks;
+      sensorTime = now;
+    }
+    startConversion(k);
+    return;
+  }
+
+  // The row is complete
+  row++;
+  if (row == ROWS_PER_FRAME){
+    row = 0;
+    if (!skipFrame){
+      putLong(&frame[10], micros());
+      frame[2] = sequence & 0xFF;
+      frame[3] = (sequence >> 8) & 0xFF;
+      fillBuffer = (fillBuffer + 1) % NO_OF_BUFFERS;
+      framesReady++;
+    }
+    sequence++;
+  }
+}
+
+void startSampling(){
+  noInterrupts();
+  row = 0;
+  fillBuffer = 0;
+  sendBuffer = 0;
+  framesReady = 0;
+  TCNT1 = 0;
+  TIMSK1 |= (1 << OCIE1A);
+  sampling = true;
+  interrupts();
+}
+
+void stopSampling(){
+  noInterrupts();
+  TIMSK1 &= ~(1 << OCIE1A);
+  ADCSRA &= ~(1 << ADIE);
+  sampling = false;
+  interrupts();
+}
+
+// Fills in the header and CRC of the next full frame and sends it. The interrupts carry on sampling into
+// the other buffers while Serial.write waits for room in the transmit buffer.
+void sendFrame(){
+  byte *frame = frames[sendBuffer];
+  frame[0] = 0xA5;
+  frame[1] = 0x5A;
+  frame[4] = NO_OF_SENSORS;
+  frame[5] = ROWS_PER_FRAME;
+
+  unsigned int crc = crc16(&frame[2], FRAME_SIZE - 4);
+  frame[FRAME_SIZE - 2] = crc & 0xFF;
+  frame[FRAME_SIZE - 1] = (crc >> 8) & 0xFF;
+
+  Serial.write(frame, FRAME_SIZE);
+  sendBuffer = (sendBuffer + 1) % NO_OF_BUFFERS;
+  noInterrupts();
+  framesReady--;
+  interrupts();
+}
+
+void loop() {
+  // 'S' starts and stops sampling as with the earlier versions
+  if (Serial.available() > 0){
+    serialRX = Serial.read();
+    if (serialRX == 'S'){
+      if (sampling){
+        stopSampling();
+      }
+      else{
+        startSampling();
+      }
+    }
+  }
+
+  if (framesReady > 0){
+    sendFrame();
+  }
+}
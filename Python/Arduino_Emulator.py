@@ -0,0 +1,149 @@
+import os
+import pty
+import select
+import time
+import tty
+import threading
+import numpy as np
+from Serial_Protocol import ROWS_PER_FRAME, encode_frame, frame_size
+
+
+# Time taken by one analogRead plus the delayMicroseconds(100) that follows it
+READ_TIME_US = 212
+
+# Time taken by ADC_Serial_MultiV7 to read one sensor, two 104us conversions for each of the 3 axes
+CONVERSION_TIME_US = 624
+
+
+def synthetic_readings(NO_SENSORS,NO_SAMPLES,cycle,samplingPeriod=READ_TIME_US * 3):
+    """ Generates NO_SAMPLES(int) rows of deterministic ADC readings for NO_SENSORS(int) sensors as an int numpy array of dimension [NO_SAMPLES][NO_SENSORS * 3]. Each axis is a sine wave of a different frequency around the 1g ADC level so consecutive cycles, given by cycle(int), join up smoothly.
+    """
+    t = (np.arange(NO_SAMPLES) + (cycle * NO_SAMPLES)) * (samplingPeriod * NO_SENSORS) / 1e6
+    frequency = 5.0 * (1 + np.arange(NO_SENSORS * 3))
+    readings = 512 + (100 * np.sin(2 * np.pi * t[:,None] * frequency))
+    return(np.clip(np.rint(readings),0,1023).astype(int))
+
+
+class ArduinoEmulator:
+    """ A pure Python stand in for the accelerometer Arduino that runs on one end of a pseudo terminal. The other end, given by the port attribute, can be opened with serial.Serial exactly like the real board.
+        The emulator waits for 'S', then sends cycles of NO_SAMPLES(int) samples from NO_SENSORS(int) sensors until a second 'S' is received. The protocol(string) parameter selects the output of the firmware to copy: 'binary' for the frames of ADC_Serial_MultiV6, 'ascii' for the text lines of ADC_Serial_MultiV5 or 'continuous' for ADC_Serial_MultiV7.
+        In 'continuous' mode frames are sent in real time as ADC_Serial_MultiV7 samples them, one row every samplePeriod(int) us, with no pause between cycles. If the reader falls so far behind that NO_BUFFERS(int) frames are waiting, further frames are dropped and counted in overruns but still use up their sequence numbers, as the firmware does.
+        If baudrate(int) is given the output is paced to that line rate, otherwise it is written as fast as the pseudo terminal accepts it.
+    """
+
+    def __init__(self,NO_SENSORS=5,NO_SAMPLES=250,protocol='binary',baudrate=None,samplePeriod=4000,NO_BUFFERS=4):
+        self.NO_SENSORS = NO_SENSORS
+        self.NO_SAMPLES = NO_SAMPLES
+        self.protocol = protocol
+        self.baudrate = baudrate
+        self.samplePeriod = samplePeriod
+        self.NO_BUFFERS = NO_BUFFERS
+        self.master,self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = False
+        self.sequence = 0
+        self.cycles = 0
+        self.overruns = 0
+        self.thread = threading.Thread(target=self._run,daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return(self)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def cycle_bytes(self,cycle):
+        """ Returns the bytes the firmware would send for one sampling cycle, given by cycle(int).
+        """
+        readings = synthetic_readings(self.NO_SENSORS,self.NO_SAMPLES,cycle)
+        rowTime = READ_TIME_US * 3 * self.NO_SENSORS
+        cycleStart = cycle * self.NO_SAMPLES * rowTime
+
+        if (self.protocol == 'ascii'):
+            lines = [''.join(str(v) + ' ' for v in row) + '\r\n' for row in readings.tolist()]
+            lines.append(str((self.NO_SAMPLES * rowTime) // 1000) + ' \r\n')
+            return(''.join(lines).encode())
+
+        # ADC_Serial_MultiV6 stops sampling while it sends each cycle at 115200 baud. Each sensor is read
+        # READ_TIME_US * 3 after the one before it.
+        sendTime = (self.NO_SAMPLES // ROWS_PER_FRAME) * frame_size(self.NO_SENSORS) * 10 * 1000000 // 115200
+        cycleStart = cycle * ((self.NO_SAMPLES * rowTime) + sendTime)
+        times = cycleStart + (np.arange(self.NO_SAMPLES)[:,None] * rowTime) + (np.arange(self.NO_SENSORS) * READ_TIME_US * 3)
+        frames = []
+        for i in range(0,self.NO_SAMPLES,ROWS_PER_FRAME):
+            timeEnd = int(times[i + ROWS_PER_FRAME - 1,-1]) + (READ_TIME_US * 3)
+            frames.append(encode_frame(self.sequence,readings[i:i + ROWS_PER_FRAME].tolist(),times[i:i + ROWS_PER_FRAME].tolist(),timeEnd))
+            self.sequence += 1
+        return(b''.join(frames))
+
+    def frame_bytes(self,frame):
+        """ Returns the frame ADC_Serial_MultiV7 would send as its frame(int)th frame, which starts frame * ROWS_PER_FRAME rows after sampling started.
+        """
+        first = frame * ROWS_PER_FRAME
+        readings = synthetic_readings(self.NO_SENSORS,ROWS_PER_FRAME,frame,self.samplePeriod / self.NO_SENSORS)
+        times = ((first + np.arange(ROWS_PER_FRAME)[:,None]) * self.samplePeriod) + (np.arange(self.NO_SENSORS) * CONVERSION_TIME_US)
+        timeEnd = int(times[-1,-1]) + CONVERSION_TIME_US
+        return(encode_frame(frame,readings.tolist(),times.tolist(),timeEnd))
+
+    def _write(self,data):
+        view = memoryview(data)
+        while (view and self.running):
+            # Wait until the pseudo terminal can take more data so stop() is never blocked
+            _,writable,_ = select.select([],[self.master],[],0.05)
+            if (not writable):
+                continue
+            written = os.write(self.master,view[:1024])
+            view = view[written:]
+            if (self.baudrate):
+                # 10 bits are sent on the line for every byte
+                time.sleep(written * 10 / self.baudrate)
+
+    def _start_received(self,wait):
+        readable,_,_ = select.select([self.master],[],[],wait)
+        if (readable):
+            return(b'S' in os.read(self.master,64))
+        return(False)
+
+    def _run_continuous(self):
+        # Frames become ready in real time. Those waiting are sent as fast as the port takes them and any that
+        # find every buffer full are dropped. The sequence number carries on from the last run, as in the firmware.
+        started = time.monotonic()
+        frame = self.sequence
+        waiting = []
+        while (self.running):
+            ready = self.sequence + int((time.monotonic() - started) * 1e6 / (self.samplePeriod * ROWS_PER_FRAME))
+            while (frame < ready):
+                if (len(waiting) < self.NO_BUFFERS):
+                    waiting.append(self.frame_bytes(frame))
+                else:
+                    self.overruns += 1
+                frame += 1
+
+            _,writable,_ = select.select([],[self.master],[],0) if (waiting) else ([],[],[])
+            if (writable):
+                self._write(waiting.pop(0))
+            if (self._start_received(0 if (waiting) else 0.001)):
+                self.sequence = frame
+                return
+
+    def _run(self):
+        sampling = False
+        while (self.running):
+            if (not sampling):
+                sampling = self._start_received(0.05)
+                continue
+            if (self.protocol == 'continuous'):
+                self._run_continuous()
+                sampling = False
+                continue
+            self._write(self.cycle_bytes(self.cycles))
+            self.cycles += 1
+            if (self._start_received(0)):
+                sampling = False
@@ -0,0 +1,240 @@
+import argparse
+import os
+import sys
+import time
+import serial
+import numpy as np
+import matplotlib
+# Figures are only ever saved to files, so no display is needed
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from Calibration import load_calibration, RIG_SENSORS
+from Capture_File import CSVWriter, CapturePyramid, save_capture, open_capture, read_csv_array, pyramid_path, csv_header, time_columns
+from Capture_Store import CaptureStore
+from Live_Plot import subplot_grid
+from Pipeline_Metrics import PipelineMetrics
+from Serial_Acquisition import AcquisitionThread, ConsumerThread
+from Signal_Processing import fft_magnitude, welch_psd, resample
+from Serial_Test_MultiV5 import ADC_to_g, save_as_csv, plot_sensor
+
+# Command line tool that does the same jobs as the prompts of Serial_Test_MultiV5 without any input, so captures
+# can be taken and processed by scripts. Every command other than capture takes any number of files, so a batch
+# job starts Python and imports numpy, scipy and matplotlib once rather than once for every file. For example:
+#   python Batch_CLI.py capture Run1.cap Run2.cap --port /dev/ttyUSB0 --cycles 100
+#   python Batch_CLI.py fft Results/*.cap --rows 0 250 --psd
+#   python Batch_CLI.py plot Results/*.cap --output-dir Figures
+
+# Rows written to a CSV file at a time when converting a capture
+CSV_BLOCK = 65536
+
+
+def load_data(path,NO_SENSORS):
+    """ Opens a capture file or reads a CSV file saved by save_as_csv, given by path(string), and returns a tuple (data, NO_SENSORS, header). A capture file is opened as a memory map and gives its own sensor count and header. For a CSV file NO_SENSORS(int) is returned unchanged with an empty header.
+    """
+    if (path.endswith('.cap')):
+        data,header = open_capture(path)
+        return(data,header['sensors'],header)
+    return(read_csv_array(path),NO_SENSORS,{})
+
+
+def output_path(path,outputDir,suffix,extension):
+    """ Returns the path of an output file for the input path(string), with suffix(string) added to its name and extension(string) in place of its own. The file goes in outputDir(string), or next to the input if outputDir is None.
+    """
+    name = os.path.splitext(os.path.basename(path))[0] + suffix + extension
+    return(os.path.join(outputDir if (outputDir is not None) else os.path.dirname(path),name))
+
+
+def capture(path,args):
+    """ Takes one capture of args.cycles cycles from args.port and saves it in g, using the calibration of the sensors named by args.sensor_ids, to the capture file given by path(string), with a CSV copy if args.csv is set. The pipeline metrics are saved as a (Metrics) JSON file next to the capture if args.metrics is set, and served on args.metrics_port while the capture runs if that is given.
+    """
+    profile = load_calibration().profile(args.sensor_ids)
+    # Checked before sampling so a missing calibration is not found only after the capture
+    if (len(profile) < args.sensors):
+        raise ValueError('--sensor-ids names ' + str(len(profile)) + ' sensors but --sensors is ' + str(args.sensors))
+    # Readings kept as NaN need a float store
+    data_log = CaptureStore(args.sensors,args.samples,args.cycles,dtype=(np.float32 if (args.fill == 'nan') else np.int16))
+    metrics = PipelineMetrics()
+    arduinoSerial = serial.Serial(args.port,baudrate=args.baudrate,timeout=5.0)
+    acquisition = None
+    try:
+        # Clear anything left in the buffers and give the XBee's time to initialise, as Serial_Test_MultiV5 does
+        time.sleep(2)
+        arduinoSerial.reset_input_buffer()
+        arduinoSerial.reset_output_buffer()
+        time.sleep(args.wait)
+
+        if (args.metrics_port is not None):
+            metrics.serve(args.metrics_port)
+        acquisition = AcquisitionThread(arduinoSerial,args.sensors,args.samples,args.binary,args.cycles,args.fill,metrics)
+        storage = ConsumerThread(acquisition.subscribe(drop=False,name='storage'),data_log.append,metrics,'storage')
+        storage.start()
+        acquisition.start()
+        acquisition.join()
+        storage.join()
+    finally:
+        metrics.stop_serving()
+        # Once started the acquisition thread closes the port itself
+        if (acquisition is None or not acquisition.is_alive()):
+            arduinoSerial.close()
+
+    np_data_g = data_log.as_columns(np.float32)
+    ADC_to_g(np_data_g,args.sensors,out=np_data_g,profile=profile)
+    np_data_g[:,time_columns(args.sensors)] /= 1000
+    save_capture(path,np_data_g,args.sensors,calibration=profile.name,timeStamps=np.rint(data_log.times() * 1000))
+    if (args.csv):
+        save_as_csv(os.path.splitext(path)[0] + '.csv',np_data_g,args.sensors)
+
+    stats = acquisition.stats()
+    print(path + ': ' + str(len(data_log)) + ' samples, lost readings per sensor ' + str(stats['loss']['lost']))
+    if (args.metrics):
+        metrics.dump(output_path(path,None,'(Metrics)','.json'))
+        print(metrics.report())
+
+
+def convert(path,args):
+    """ Converts a capture file, given by path(string), to a CSV file or a CSV file to a capture file, or to the format given by args.to.
+    """
+    data,NO_SENSORS,header = load_data(path,args.sensors)
+    to = args.to or ('csv' if (path.endswith('.cap')) else 'cap')
+    newPath = output_path(path,args.output_dir,'','.' + to)
+    # Writing over the input would truncate it while it is still being read
+    if (os.path.realpath(newPath) == os.path.realpath(path)):
+        raise ValueError('already a ' + to + ' file, give --output-dir to write a copy elsewhere')
+    if (to == 'cap'):
+        save_capture(newPath,data,NO_SENSORS,calibration=header.get('calibration',''),units=header.get('units','g'))
+    else:
+        # A memory mapped capture is written out a block at a time
+        with CSVWriter(newPath,csv_header(NO_SENSORS)) as csv_write:
+            for start in range(0,data.shape[0],CSV_BLOCK):
+                csv_write.write(data[start:start + CSV_BLOCK])
+    print(newPath)
+
+
+def fft(path,args):
+    """ Saves the FFT magnitude of the rows selected by args.rows of the file given by path(string) as a (FFT) CSV file, and the PSD of the whole file as a (PSD) CSV file if args.psd is set.
+    """
+    data,NO_SENSORS,header = load_data(path,args.sensors)
+    start,stop = args.rows if (args.rows is not None) else (0,data.shape[0])
+    if (start < 0 or stop > data.shape[0] or stop - start < 2):
+        raise ValueError('rows ' + str(start) + ' to ' + str(stop) + ' do not select at least 2 of the ' + str(data.shape[0]) + ' rows')
+    np_ffthalf_data = fft_magnitude(np.array(data[start:stop],dtype=np.float32),NO_SENSORS)
+    newPath = output_path(path,args.output_dir,'(FFT)','.csv')
+    save_as_csv(newPath,np_ffthalf_data,NO_SENSORS)
+    print(newPath)
+    if (args.psd):
+        np_psd_data = welch_psd(data,NO_SENSORS,segmentSize=args.segment,overlap=0.5)
+        newPath = output_path(path,args.output_dir,'(PSD)','.csv')
+        save_as_csv(newPath,np_psd_data,NO_SENSORS)
+        print(newPath)
+
+
+def resample_file(path,args):
+    """ Resamples the file given by path(string) to args.rate Hz with args.method and saves it as a (Resampled) capture file.
+    """
+    data,NO_SENSORS,header = load_data(path,args.sensors)
+    np_resampled_data = resample(data,NO_SENSORS,args.rate,args.method)
+    newPath = output_path(path,args.output_dir,'(Resampled)','.cap')
+    save_capture(newPath,np_resampled_data,NO_SENSORS,calibration=header.get('calibration',''),
+                 samplingPeriod=1 / args.rate,units=header.get('units','g'))
+    print(newPath)
+
+
+def plot(path,args):
+    """ Saves a figure of the file given by path(string) with a graph for every sensor, in the layout of plot_singlefig, as an image of type args.format. A capture file is drawn through its min/max pyramid when one has been saved, so long captures are as quick to plot as short ones.
+    """
+    pyramid = None
+    if (path.endswith('.cap') and os.path.exists(pyramid_path(path))):
+        pyramid = CapturePyramid(path)
+        data,NO_SENSORS,header = pyramid.data,pyramid.header['sensors'],pyramid.header
+    else:
+        data,NO_SENSORS,header = load_data(path,args.sensors)
+
+    figure = plt.figure(figsize=(args.width / 100,args.height / 100),dpi=100)
+    gridRows,gridColumns = subplot_grid(NO_SENSORS)
+    for i in range(0,NO_SENSORS):
+        plt.subplot(gridRows,gridColumns,i + 1)
+        plt.title('Sensor ' + str(i + 1))
+        plot_sensor(data,NO_SENSORS,i,pyramid)
+        if (args.range is not None):
+            plt.xlim(args.range[0],args.range[1])
+        plt.ylim(*((0,1024) if (header.get('units') == 'ADC') else (-3,3)))
+        plt.xlabel('Time/s')
+        plt.ylabel('Acceleration/g')
+        plt.legend()
+    figure.tight_layout()
+    newPath = output_path(path,args.output_dir,'','.' + args.format)
+    figure.savefig(newPath)
+    plt.close(figure)
+    print(newPath)
+
+
+def build_parser():
+    """ Returns the argparse parser for the command line, with a subcommand for each job.
+    """
+    parser = argparse.ArgumentParser(description='Capture and process 3-Axis accelerometer data without any prompts.')
+    commands = parser.add_subparsers(dest='command',required=True)
+
+    # Options shared by the commands that process files
+    files = argparse.ArgumentParser(add_help=False)
+    files.add_argument('paths',nargs='+',metavar='inputs',help='capture (.cap) or CSV files to process')
+    files.add_argument('--sensors',type=int,default=5,help='number of sensors in CSV files, capture files give their own (default 5)')
+    files.add_argument('--output-dir',help='folder for the output files (default next to each input)')
+
+    command = commands.add_parser('capture',help='take captures from the Arduino')
+    command.add_argument('paths',nargs='+',metavar='outputs',help='capture file to save for each capture taken')
+    command.add_argument('--port',required=True,help='serial port of the Arduino')
+    command.add_argument('--sensors',type=int,default=5,help='number of sensors (default 5)')
+    command.add_argument('--sensor-ids',nargs='+',default=RIG_SENSORS,metavar='ID',help='IDs of the sensors fitted, in order, to find their calibration (default ' + ' '.join(RIG_SENSORS) + ')')
+    command.add_argument('--samples',type=int,default=250,help='samples in each cycle, which must match the Arduino (default 250)')
+    command.add_argument('--cycles',type=int,default=2,help='cycles in each capture (default 2)')
+    command.add_argument('--binary',action='store_true',help='the Arduino runs ADC_Serial_MultiV6 or V7 and sends binary frames')
+    command.add_argument('--fill',choices=['drop','nan','interpolate'],default='interpolate',help='what to do with lost readings (default interpolate)')
+    command.add_argument('--baudrate',type=int,default=115200)
+    command.add_argument('--wait',type=float,default=6.0,help='seconds to wait for the XBee\'s to initialise (default 6)')
+    command.add_argument('--csv',action='store_true',help='save a CSV copy of each capture as well')
+    command.add_argument('--metrics',action='store_true',help='save the pipeline metrics of each capture as a (Metrics) JSON file and print a summary')
+    command.add_argument('--metrics-port',type=int,help='serve the pipeline metrics as JSON on this localhost port during each capture')
+    command.set_defaults(function=capture)
+
+    command = commands.add_parser('convert',parents=[files],help='convert capture files to CSV and CSV files to captures')
+    command.add_argument('--to',choices=['cap','csv'],help='format to convert every file to (default the other format)')
+    command.set_defaults(function=convert)
+
+    command = commands.add_parser('fft',parents=[files],help='save the FFT, and optionally the PSD, of each file')
+    command.add_argument('--rows',type=int,nargs=2,metavar=('START','STOP'),help='samples to take the FFT of (default all)')
+    command.add_argument('--psd',action='store_true',help='save the PSD of the whole file as well')
+    command.add_argument('--segment',type=int,default=256,help='samples in each PSD segment (default 256)')
+    command.set_defaults(function=fft)
+
+    command = commands.add_parser('resample',parents=[files],help='resample each file to a uniform rate')
+    command.add_argument('--rate',type=float,required=True,help='new sampling rate in Hz')
+    command.add_argument('--method',choices=['linear','antialias'],default='linear',help='resampling method (default linear)')
+    command.set_defaults(function=resample_file)
+
+    command = commands.add_parser('plot',parents=[files],help='save a figure of each file')
+    command.add_argument('--format',default='png',help='image format (default png)')
+    command.add_argument('--range',type=float,nargs=2,metavar=('START','END'),help='time range to plot in s (default all)')
+    command.add_argument('--width',type=int,default=1600,help='figure width in pixels (default 1600)')
+    command.add_argument('--height',type=int,default=900,help='figure height in pixels (default 900)')
+    command.set_defaults(function=plot)
+
+    return(parser)
+
+
+def main(argv=None):
+    """ Runs the command given by argv(list), or the command line, on every file. A file that fails is reported and the rest are still processed. Returns 0 if every file succeeded, otherwise 1.
+    """
+    args = build_parser().parse_args(argv)
+    if (getattr(args,'output_dir',None) is not None):
+        os.makedirs(args.output_dir,exist_ok=True)
+    failed = 0
+    for path in args.paths:
+        try:
+            args.function(path,args)
+        except Exception as error:
+            print(path + ': ' + str(error),file=sys.stderr)
+            failed += 1
+    return(1 if (failed) else 0)
+
+if __name__ == '__main__':
+    sys.exit(main())
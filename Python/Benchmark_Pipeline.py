@@ -0,0 +1,297 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import serial
+from Arduino_Emulator import ArduinoEmulator, synthetic_readings
+from Calibration import CalibrationProfile
+from Capture_File import save_capture, open_capture, read_csv_array
+from Capture_Store import CaptureStore
+from Pipeline_Metrics import PipelineMetrics
+from Serial_Acquisition import AcquisitionThread, ConsumerThread
+from Serial_Protocol import parse_sample_lines
+from Serial_Test_MultiV4 import equalise_sample_numbers, sort_samples
+from Serial_Test_MultiV5 import ADC_to_g, read_csv, save_as_csv
+from Signal_Processing import fft_magnitude, welch_psd, resample
+
+# Rows and sensor counts of the synthetic captures used by the full suite
+BENCH_SIZES = (10000,100000,1000000)
+BENCH_SENSORS = (1,5,16)
+
+
+def synthetic_log(NO_SENSORS,NO_ROWS,lossRate=0.01,seed=0):
+    """ Generates a deterministic log of NO_ROWS(int) samples in the form [ID,X,Y,Z,Time] as received from ADC_Serial_MultiV4, with the IDs of NO_SENSORS(int) sensors taking turns. A fraction lossRate(float) of samples are removed at random to copy samples lost on the way, which leaves the sensors with different numbers of samples.
+    """
+    rng = np.random.default_rng(seed)
+    ids = (np.arange(NO_ROWS) % NO_SENSORS) + 1
+    t = np.arange(NO_ROWS) * 0.6
+    xyz = 512 + (100 * np.sin(2 * np.pi * t[:,None] * np.array([1.0,2.0,3.0]) / 1000)).astype(int)
+    log = np.column_stack((ids,xyz,t.astype(int)))
+    return(log[rng.random(NO_ROWS) >= lossRate])
+
+
+def equalise_sample_numbers_legacy(np_samples,NO_SENSORS):
+    # The original implementation, kept to time against the current one. tests/test_sample_sorting.py checks their output is identical.
+    length = []
+    for i in range(1,NO_SENSORS+1):
+        length.append((np_samples[:,0] == i).sum())
+    np_difference = np.array(length) - min(length)
+    for i in range(0,NO_SENSORS):
+        if (np_difference[i] != 0):
+            equal = 0;
+            j = -1;
+            while(equal < np_difference[i]):
+                if (np_samples[j][0] == (i + 1)):
+                    np_samples = np.delete(np_samples,j,0)
+                    equal += 1
+                j -= 1
+    return (np_samples)
+
+
+def timed(function,*args):
+    """ Runs function(function) with args and returns a tuple (result, seconds taken).
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return(result,time.perf_counter() - start)
+
+
+def bench_equalise(NO_SENSORS=5,sizes=(10000,100000,1000000,5000000),legacyLimit=100000):
+    """ Times equalise_sample_numbers on synthetic logs of each size in sizes(list). Logs up to legacyLimit(int) rows are also run through the original implementation to compare the times.
+    """
+    print('equalise_sample_numbers, ' + str(NO_SENSORS) + ' sensors')
+    for size in sizes:
+        log = synthetic_log(NO_SENSORS,size,seed=size)
+        result,seconds = timed(equalise_sample_numbers,log,NO_SENSORS)
+        line = '  {:>9} rows: {:9.4f} s'.format(size,seconds)
+        if (size <= legacyLimit):
+            legacy,legacySeconds = timed(equalise_sample_numbers_legacy,log,NO_SENSORS)
+            line += '   original: {:9.4f} s'.format(legacySeconds)
+        print(line)
+
+
+def synthetic_capture(NO_SENSORS,NO_ROWS,samplingRate=800.0,frequency=50.0,seed=0):
+    """ Generates a deterministic capture of NO_ROWS(int) samples from NO_SENSORS(int) sensors in g, as a float32 numpy array of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with the time in s.
+        As in the test signal left in Serial_Test_MultiV4 each axis is a sine wave sampled at samplingRate(float) Hz, the first at frequency(float) Hz and the rest at whole multiples of it below the Nyquist frequency, with a little noise from the seed(int) added.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.empty((NO_ROWS,NO_SENSORS,4),dtype=np.float32)
+    harmonics = 1 + (np.arange(NO_SENSORS * 3).reshape(NO_SENSORS,3) % int((samplingRate / 2) // frequency - 1))
+    for i in range(0,NO_SENSORS):
+        # Sensors are read one after another through each sample period
+        t = (np.arange(NO_ROWS) + (i / NO_SENSORS)) / samplingRate
+        data[:,i,:3] = np.sin(2 * np.pi * frequency * t[:,None] * harmonics[i]) + (0.05 * rng.standard_normal((NO_ROWS,3)))
+        data[:,i,3] = t
+    return(data.reshape(NO_ROWS,NO_SENSORS * 4))
+
+
+def synthetic_adc(NO_SENSORS,NO_ROWS,seed=0):
+    """ Returns a synthetic_capture in ADC values around the 1g level, with the time in ms, as received before ADC_to_g.
+    """
+    data = synthetic_capture(NO_SENSORS,NO_ROWS,seed=seed).reshape(NO_ROWS,NO_SENSORS,4)
+    data[:,:,:3] = np.rint(512 + (100 * data[:,:,:3]))
+    data[:,:,3] *= 1000
+    return(data.reshape(NO_ROWS,NO_SENSORS * 4))
+
+
+def synthetic_profile(NO_SENSORS):
+    """ Returns a CalibrationProfile for any number of sensors, given by NO_SENSORS(int), so ADC_to_g can be timed without the calibration file.
+    """
+    m = np.full((NO_SENSORS,3),102.3)
+    b = np.full((NO_SENSORS,3),-5.0)
+    return(CalibrationProfile([str(i + 1) for i in range(0,NO_SENSORS)],m,b,[None] * NO_SENSORS))
+
+
+def synthetic_lines(NO_SENSORS,NO_ROWS,blockRows=1000):
+    """ Returns NO_ROWS(int) lines of readings from NO_SENSORS(int) sensors as sent by ADC_Serial_MultiV5. A block of blockRows(int) lines is formatted once and repeated, so long inputs are quick to make.
+    """
+    readings = synthetic_readings(NO_SENSORS,min(blockRows,NO_ROWS),0)
+    lines = [''.join(str(v) + ' ' for v in row) + '\r\n' for row in readings.tolist()]
+    repeats,remainder = divmod(NO_ROWS,len(lines))
+    return(((''.join(lines) * repeats) + ''.join(lines[:remainder])).encode())
+
+
+def measure(function,*args,repeat=3):
+    """ Runs function(function) with args and returns a tuple (result, seconds, peakBytes). The time is the best of up to repeat(int) runs, stopping early once a run takes more than a second. The most memory allocated at once is then traced with tracemalloc in one more run, as tracing would slow the timed runs.
+    """
+    seconds = None
+    for i in range(0,repeat):
+        result,runSeconds = timed(function,*args)
+        seconds = runSeconds if (seconds is None) else min(seconds,runSeconds)
+        if (runSeconds > 1.0):
+            break
+    tracemalloc.start()
+    try:
+        function(*args)
+        peakBytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return(result,seconds,peakBytes)
+
+
+def serial_session(NO_SENSORS,NO_SAMPLES,cycles,protocol='ascii',metrics=None):
+    """ Collects cycles(int) cycles of NO_SAMPLES(int) samples from NO_SENSORS(int) sensors through a pseudo terminal from an ArduinoEmulator copying ADC_Serial_MultiV5, or ADC_Serial_MultiV6 if protocol(string) is 'binary'. The samples are read by an AcquisitionThread and stored in a CaptureStore by a ConsumerThread, as Serial_Test_MultiV5 does. The output is not paced, so the time is set by the reading and parsing. If metrics(PipelineMetrics) is given every stage records into it. Returns the number of samples collected.
+    """
+    emulator = ArduinoEmulator(NO_SENSORS,NO_SAMPLES,protocol).start()
+    serialPort = serial.Serial(emulator.port,timeout=5.0)
+    log = CaptureStore(NO_SENSORS,NO_SAMPLES,cycles)
+    try:
+        acquisition = AcquisitionThread(serialPort,NO_SENSORS,NO_SAMPLES,(protocol == 'binary'),cycles,metrics=metrics)
+        storage = ConsumerThread(acquisition.subscribe(drop=False,name='storage'),log.append,metrics,'storage')
+        storage.start()
+        acquisition.start()
+        acquisition.join()
+        storage.join()
+    finally:
+        # The acquisition thread closes the port itself unless it failed to start
+        serialPort.close()
+        emulator.stop()
+    return(len(log))
+
+
+def bench_stages(NO_SENSORS,NO_ROWS,directory,repeat=3,legacyLimit=100000,NO_SAMPLES=250):
+    """ Times and traces the memory of each stage of the pipeline on synthetic data of NO_ROWS(int) samples from NO_SENSORS(int) sensors, writing any files to directory(string). Text lines are parsed in cycles of NO_SAMPLES(int). The original read_csv, which builds a list of strings, is only run on captures up to legacyLimit(int) rows.
+        Returns a list with a dictionary for each stage holding the stage name, sensors, rows, seconds, rows per second and peak bytes allocated.
+    """
+    results = []
+
+    def record(stage,function,*args,rows=NO_ROWS):
+        result,seconds,peakBytes = measure(function,*args,repeat=repeat)
+        results.append({ 'stage': stage,
+                         'sensors': NO_SENSORS,
+                         'rows': rows,
+                         'seconds': seconds,
+                         'rowsPerSecond': (rows / seconds) if (seconds > 0) else None,
+                         'peakBytes': peakBytes })
+        print('  {:<24} {:>3} sensors {:>9} rows: {:9.4f} s {:10.1f} MB'.format(stage,NO_SENSORS,rows,seconds,peakBytes / 1e6))
+        return(result)
+
+    # Samples in the form [ID,X,Y,Z,Time] taking turns, as received from ADC_Serial_MultiV4 and put in order by
+    # Serial_Test_MultiV4
+    log = synthetic_log(NO_SENSORS,NO_ROWS,seed=NO_ROWS)
+    equalised = record('equalise_sample_numbers',equalise_sample_numbers,log,NO_SENSORS)
+    record('sort_samples',sort_samples,equalised,NO_SENSORS,rows=equalised.shape[0])
+
+    # Lines are parsed a cycle at a time as read_cycle does
+    lines = synthetic_lines(NO_SENSORS,NO_ROWS).splitlines(True)
+    cycles = [b''.join(lines[i:i + NO_SAMPLES]) for i in range(0,NO_ROWS,NO_SAMPLES)]
+    record('parse_sample_lines',lambda cycles: [parse_sample_lines(cycle,NO_SENSORS) for cycle in cycles],cycles)
+    del lines,cycles
+    adc = synthetic_adc(NO_SENSORS,NO_ROWS)
+    record('ADC_to_g',ADC_to_g,adc,NO_SENSORS,None,synthetic_profile(NO_SENSORS))
+    del adc
+
+    data = synthetic_capture(NO_SENSORS,NO_ROWS)
+    csvPath = os.path.join(directory,'bench.csv')
+    capturePath = os.path.join(directory,'bench.cap')
+    record('save_as_csv',save_as_csv,csvPath,data,NO_SENSORS)
+    record('read_csv_array',read_csv_array,csvPath)
+    if (NO_ROWS <= legacyLimit):
+        record('read_csv',read_csv,csvPath)
+    record('save_capture',save_capture,capturePath,data,NO_SENSORS)
+    record('open_capture',lambda path: np.array(open_capture(path)[0]),capturePath)
+
+    record('fft_magnitude',fft_magnitude,data,NO_SENSORS)
+    record('welch_psd',welch_psd,data,NO_SENSORS)
+    record('resample',resample,data,NO_SENSORS,1000.0)
+    return(results)
+
+
+def bench_serial(NO_SENSORS,cycles,NO_SAMPLES=250,protocols=('ascii','binary'),repeat=3):
+    """ Times collecting cycles(int) cycles of NO_SAMPLES(int) samples from NO_SENSORS(int) sensors from the emulator through the acquisition thread with serial_session for each of protocols(list), once without and once with PipelineMetrics recording every stage. The best of repeat(int) runs is kept as for the other stages. The runs with and without metrics take turns so both see the same machine load, and the overhead of the metrics is printed from the median runs, as a single lucky run can make a difference of several percent either way. The peak memory includes the emulator, which runs in the same process. Returns a list of results in the same form as bench_stages.
+    """
+    results = []
+    for protocol in protocols:
+        runs = {}
+        for i in range(0,repeat):
+            for stage,metrics in (('serial_' + protocol,None),('serial_' + protocol + '_metrics',PipelineMetrics())):
+                rows,runSeconds = timed(serial_session,NO_SENSORS,NO_SAMPLES,cycles,protocol,metrics)
+                runs.setdefault(stage,[]).append(runSeconds)
+        seconds = {stage: min(times) for stage,times in runs.items()}
+        for stage in seconds:
+            metrics = PipelineMetrics() if (stage.endswith('_metrics')) else None
+            tracemalloc.start()
+            try:
+                serial_session(NO_SENSORS,NO_SAMPLES,cycles,protocol,metrics)
+                peakBytes = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results.append({ 'stage': stage,
+                             'sensors': NO_SENSORS,
+                             'rows': rows,
+                             'seconds': seconds[stage],
+                             'rowsPerSecond': rows / seconds[stage],
+                             'peakBytes': peakBytes })
+            print('  {:<24} {:>3} sensors {:>9} rows: {:9.4f} s {:10.1f} MB'.format(stage,NO_SENSORS,rows,seconds[stage],peakBytes / 1e6))
+        overhead = (np.median(runs['serial_' + protocol + '_metrics']) / np.median(runs['serial_' + protocol])) - 1
+        print('  {:<24} {:>3} sensors: metrics overhead {:+.2%} over {} runs'.format('serial_' + protocol,NO_SENSORS,overhead,repeat))
+    return(results)
+
+
+def run_suite(sizes=BENCH_SIZES,sensorCounts=BENCH_SENSORS,repeat=3,serialCycles=40):
+    """ Runs bench_stages for every size in sizes(list) and sensor count in sensorCounts(list), and bench_serial for each sensor count with serialCycles(int) cycles. Returns a dictionary holding details of the machine and software and the list of results, ready to be saved as JSON.
+    """
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for NO_SENSORS in sensorCounts:
+            for size in sizes:
+                results += bench_stages(NO_SENSORS,size,directory,repeat)
+            if (serialCycles > 0):
+                results += bench_serial(NO_SENSORS,serialCycles,repeat=repeat)
+    return({ 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+             'commit': commit,
+             'python': platform.python_version(),
+             'numpy': np.__version__,
+             'platform': platform.platform(),
+             'processor': platform.processor(),
+             'results': results })
+
+
+def compare_results(old,new):
+    """ Prints the time of every stage in new(dictionary), as returned by run_suite, against the same stage, sensor count and size in old(dictionary). A ratio above 1 means the stage has become slower.
+    """
+    previous = {(r['stage'],r['sensors'],r['rows']): r for r in old['results']}
+    print('Compared with ' + old.get('commit','')[:10] + ' from ' + old.get('date',''))
+    for r in new['results']:
+        match = previous.get((r['stage'],r['sensors'],r['rows']))
+        if (match is None or not match['seconds']):
+            continue
+        print('  {:<24} {:>3} sensors {:>9} rows: {:6.2f}x time {:6.2f}x memory'.format(
+              r['stage'],r['sensors'],r['rows'],r['seconds'] / match['seconds'],r['peakBytes'] / max(match['peakBytes'],1)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the capture and analysis pipeline on synthetic captures.')
+    parser.add_argument('--sizes',type=int,nargs='+',default=BENCH_SIZES,help='capture lengths in samples')
+    parser.add_argument('--sensors',type=int,nargs='+',default=BENCH_SENSORS,help='sensor counts')
+    parser.add_argument('--repeat',type=int,default=3,help='timed runs of each stage, the best is kept')
+    parser.add_argument('--serial-cycles',type=int,default=40,help='cycles read from the emulator, 0 to skip')
+    parser.add_argument('--output',default='benchmark_results.json',help='JSON file for the results')
+    parser.add_argument('--compare',help='JSON file of an earlier run to compare against')
+    parser.add_argument('--equalise',action='store_true',help='time equalise_sample_numbers against the original as well')
+    args = parser.parse_args(argv)
+
+    if (args.equalise):
+        bench_equalise()
+    suite = run_suite(args.sizes,args.sensors,args.repeat,args.serial_cycles)
+    with open(args.output,'w') as results_file:
+        json.dump(suite,results_file,indent=1)
+    print('Results saved to ' + args.output)
+    if (args.compare):
+        with open(args.compare,'r') as results_file:
+            compare_results(json.load(results_file),suite)
+
+
+if __name__ == '__main__':
+    main()
+
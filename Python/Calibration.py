@@ -0,0 +1,237 @@
+import csv
+import datetime
+import os
+import re
+import numpy as np
+from scipy import stats
+
+
+# Calibration files are CSV files with one row per calibration of one sensor. The Date column is the
+# day the calibration was made (YYYY-MM-DD) and may be left blank for old calibrations of unknown date.
+CALIBRATION_HEADER = ['Sensor','Date','mX','mY','mZ','bX','bY','bZ']
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),'Calibration.csv')
+
+# The sensors fitted to the rig in the order of their ID, as used by ADC_Serial_MultiV5
+RIG_SENSORS = ['1B','2','3B','4','5']
+
+# Rows converted at a time by apply_calibration
+CONVERSION_BLOCK = 65536
+
+
+class CalibrationProfile:
+    """ The calibration of a set of sensors, given in rig order by the sensors(list) parameter, ready to be applied to a whole capture at once. m(numpy array) and b(numpy array) hold the m and b values of the X, Y and Z axes of each sensor with dimension [NO_SENSORS][3], and dates(list) the date of each sensor's calibration.
+        scale (1/m) and offset (b) are precomputed so that g = ADC*scale + offset broadcasts across every sample. name identifies the profile, and so the exact coefficients used, in saved captures.
+    """
+
+    def __init__(self,sensors,m,b,dates):
+        self.sensors = list(sensors)
+        self.m = np.asarray(m,dtype=np.float64).reshape(-1,3)
+        self.b = np.asarray(b,dtype=np.float64).reshape(-1,3)
+        self.dates = list(dates)
+        self.scale = 1 / self.m
+        self.offset = self.b
+        self.name = ';'.join(str(s) + '@' + (d.isoformat() if d else '-') for s,d in zip(self.sensors,self.dates))
+
+    def __len__(self):
+        return(len(self.sensors))
+
+
+class CalibrationStore:
+    """ Every calibration held in the calibration file given by the path(string) parameter. The file is read once and each profile is built once and then cached, so converting many captures does not touch the disk again.
+    """
+
+    def __init__(self,path=CALIBRATION_FILE):
+        self.path = path
+        self.calibrations = {}  # Sensor ID -> list of (date, m, b) sorted oldest first
+        self.profiles = {}
+        if (os.path.exists(path)):
+            with open(path,'r') as csv_file:
+                for row in csv.DictReader(csv_file):
+                    m = [float(row['mX']),float(row['mY']),float(row['mZ'])]
+                    b = [float(row['bX']),float(row['bY']),float(row['bZ'])]
+                    self._insert(row['Sensor'],_parse_date(row['Date']),m,b)
+
+    def _insert(self,sensor,date,m,b):
+        entries = self.calibrations.setdefault(str(sensor),[])
+        entries.append((date,m,b))
+        entries.sort(key=lambda entry: entry[0] or datetime.date.min)
+        self.profiles = {}
+
+    def add(self,sensor,m,b,date=None):
+        """ Adds a calibration of the sensor with ID sensor(string) made on date(datetime.date, default today). m(list) and b(list) hold the X, Y and Z values. The file is not changed until save() is called.
+        """
+        self._insert(sensor,date or datetime.date.today(),list(m),list(b))
+
+    def save(self):
+        """ Writes every calibration back to the calibration file.
+        """
+        with open(self.path,'w',newline='') as csv_file:
+            csv_write = csv.writer(csv_file,dialect='excel')
+            csv_write.writerow(CALIBRATION_HEADER)
+            for sensor,entries in self.calibrations.items():
+                for date,m,b in entries:
+                    csv_write.writerow([sensor,date.isoformat() if date else ''] + list(m) + list(b))
+        _stores[self.path] = (os.path.getmtime(self.path),self)
+
+    def profile(self,sensors=RIG_SENSORS,date=None):
+        """ Returns the CalibrationProfile for the sensors(list) fitted to the rig, in order of their ID. For each sensor the newest calibration made on or before date(datetime.date) is used, or the newest of all if date is None, so archived captures are converted with the calibration that was current when they were recorded.
+        """
+        if (isinstance(date,datetime.datetime)):
+            date = date.date()
+        key = (tuple(sensors),date)
+        if (key not in self.profiles):
+            m = []
+            b = []
+            dates = []
+            for sensor in sensors:
+                entries = self.calibrations.get(str(sensor),[])
+                if (date is not None):
+                    entries = [e for e in entries if (e[0] is None or e[0] <= date)]
+                if (not entries):
+                    raise KeyError('No calibration for sensor ' + str(sensor) + ' in ' + self.path)
+                dates.append(entries[-1][0])
+                m.append(entries[-1][1])
+                b.append(entries[-1][2])
+            self.profiles[key] = CalibrationProfile(sensors,m,b,dates)
+        return(self.profiles[key])
+
+
+def _parse_date(text):
+    text = text.strip()
+    return(datetime.date.fromisoformat(text) if text else None)
+
+
+_stores = {}    # Calibration file path -> (modification time, CalibrationStore)
+
+def load_calibration(path=CALIBRATION_FILE):
+    """ Returns the CalibrationStore for the calibration file given by path(string). Stores are cached and the file is only read again if it has changed since it was last loaded.
+    """
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if (path not in _stores or _stores[path][0] != mtime):
+        _stores[path] = (mtime,CalibrationStore(path))
+    return(_stores[path][1])
+
+
+def recalibration(oldProfile,newProfile):
+    """ Returns the scale and offset, each of dimension [NO_SENSORS][3], that convert g values made with oldProfile(CalibrationProfile) into g values made with newProfile(CalibrationProfile) without going back to ADC values:
+            g_new = (g_old - b_old)*m_old/m_new + b_new
+    """
+    scale = oldProfile.m / newProfile.m
+    offset = newProfile.b - (oldProfile.b * scale)
+    return(scale,offset)
+
+
+def apply_calibration(np_data,NO_SENSORS,scale,offset,out=None):
+    """ Applies data*scale + offset to the X, Y and Z values of a numpy array, np_data(numpy array), of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] or [n][NO_SENSORS][3], leaving any time columns unchanged. scale(numpy array) and offset(numpy array) should have dimension [NO_SENSORS][3].
+        A new array is returned, float32 for ADC readings, unless out(numpy array) is given, in which case the result is written into it and it is returned. out may be np_data itself to convert a float array in place.
+        A ValueError naming the sensors without a calibration is raised if scale and offset cover fewer than NO_SENSORS sensors.
+    """
+    if (scale.shape[0] < NO_SENSORS or offset.shape[0] < NO_SENSORS):
+        missing = range(min(scale.shape[0],offset.shape[0]) + 1,NO_SENSORS + 1)
+        raise ValueError('No calibration for sensors ' + ', '.join(str(i) for i in missing) + ' of ' + str(NO_SENSORS) + ', give a calibration profile of every sensor fitted')
+    if (out is None):
+        out = np.empty(np_data.shape,dtype=(np_data.dtype if (np_data.dtype.kind == 'f') else np.float32))
+
+    # View both arrays as [n][N][3] readings so the calibration arrays broadcast across every sample
+    if (np_data.ndim == 3):
+        adc = np_data
+        g = out
+    else:
+        adc = np_data.reshape(-1,NO_SENSORS,4)[:,:,:3]
+        g = out.reshape(-1,NO_SENSORS,4)[:,:,:3]
+        if (out is not np_data):
+            out.reshape(-1,NO_SENSORS,4)[:,:,3] = np_data.reshape(-1,NO_SENSORS,4)[:,:,3]
+
+    # Convert in blocks of rows that fit in cache so the multiply and add are done in one pass over memory
+    scale = scale[:NO_SENSORS]
+    offset = offset[:NO_SENSORS]
+    for i in range(0,adc.shape[0],CONVERSION_BLOCK):
+        block = g[i:i + CONVERSION_BLOCK]
+        np.multiply(adc[i:i + CONVERSION_BLOCK],scale,out=block)
+        block += offset
+
+    return(out)
+
+
+# Orientation captures from Serial_Test_MultiCal are named after the sensor and the g on each axis,
+# for example Sensor6(X-1g,Y-0g,Z-0g). The dash after the axis is a separator, so -1g is written X--1g.
+ORIENTATION_NAME = re.compile(r'Sensor(\w+)\(X[-=:]?([+-]?[\d.]+)g,Y[-=:]?([+-]?[\d.]+)g,Z[-=:]?([+-]?[\d.]+)g\)')
+
+
+def parse_orientation(path):
+    """ Returns the sensor ID and the g on the X, Y and Z axes given in the name of an orientation capture, given by path(string), as a tuple (sensor, [gX,gY,gZ]). None is returned if the name does not match.
+    """
+    match = ORIENTATION_NAME.search(os.path.basename(path))
+    if (match is None):
+        return(None)
+    return(match.group(1),[float(match.group(i)) for i in range(2,5)])
+
+
+def orientation_means(path,position=None,width=3,trim=0.1):
+    """ Reads an orientation capture saved by Serial_Test_MultiCal, given by path(string), and returns a robust mean of the X, Y and Z ADC values of one sensor. The top and bottom trim(float) fraction of readings on each axis are discarded so spikes and knocks do not move the mean.
+        width(int) gives the columns held for each sensor: 3 (X,Y,Z) as Serial_Test_MultiCal saves them, or 4 (X,Y,Z,Time) as Serial_Test_MultiV5 does. position(int) is the sensor's place in the file counting from 1, and may only be left as None if the file holds a single sensor.
+        A ValueError is raised if the columns do not match width or the file holds no sensor at position.
+    """
+    data = np.loadtxt(path,delimiter=',',skiprows=2,ndmin=2)
+    if (data.shape[1] % width != 0):
+        raise ValueError(path + ' has ' + str(data.shape[1]) + ' columns, which is not ' + str(width) + ' for each sensor')
+    NO_SENSORS = data.shape[1] // width
+    if (position is None):
+        if (NO_SENSORS != 1):
+            raise ValueError(path + ' holds ' + str(NO_SENSORS) + ' sensors, give the position of the one to use')
+        position = 1
+    if (position < 1 or position > NO_SENSORS):
+        raise ValueError(path + ' holds ' + str(NO_SENSORS) + ' sensors, there is no sensor ' + str(position))
+    start = (position - 1) * width
+    return(stats.trim_mean(data[:,start:start + 3],trim,axis=0))
+
+
+def fit_calibration(paths,store=None,date=None,trim=0.1,positions=None,width=3):
+    """ Works out m and b for every sensor and axis from a batch of orientation captures, given by paths(list), whose names follow ORIENTATION_NAME. Each capture is reduced to a robust mean per axis with orientation_means and then g = ADC/m + b is fitted by least squares for all sensors and axes at once.
+        Each capture should hold only the sensor named in it, unless positions(dict) maps the sensor ID to its place in the file counting from 1. width(int) is the number of columns of each sensor, as for orientation_means.
+        Returns a dictionary of sensor ID -> (m, b, residual) where each is a list of the X, Y and Z values and residual is the RMS fit error in g. If store(CalibrationStore) is given the results are added to it with date(datetime.date, default today) and saved, so ADC_to_g uses them straight away.
+        Every axis of every sensor needs captures at two or more different g values.
+    """
+    sensors = []
+    adc = []
+    g = []
+    for path in paths:
+        orientation = parse_orientation(path)
+        if (orientation is None):
+            continue
+        sensor,gValues = orientation
+        if (sensor not in sensors):
+            sensors.append(sensor)
+        adc.append(orientation_means(path,(positions or {}).get(sensor),width,trim))
+        g.append([gValues,sensors.index(sensor)])
+
+    # One observation (ADC mean, g) per capture and axis, grouped by sensor and axis
+    x = np.array(adc).ravel()
+    y = np.array([values for values,index in g]).ravel()
+    group = np.array([(index * 3) + axis for values,index in g for axis in range(0,3)])
+    NO_GROUPS = len(sensors) * 3
+
+    # Least squares fit of y = slope*x + b for every group at once from the group sums
+    n = np.bincount(group,minlength=NO_GROUPS)
+    sx = np.bincount(group,weights=x,minlength=NO_GROUPS)
+    sy = np.bincount(group,weights=y,minlength=NO_GROUPS)
+    sxx = np.bincount(group,weights=x * x,minlength=NO_GROUPS)
+    sxy = np.bincount(group,weights=x * y,minlength=NO_GROUPS)
+    denominator = (n * sxx) - (sx * sx)
+    if (np.any(n < 2) or np.any(np.isclose(denominator,0))):
+        missing = sorted(set(sensors[i // 3] for i in np.flatnonzero((n < 2) | np.isclose(denominator,0))))
+        raise ValueError('Captures at two different g values are needed on every axis of sensors ' + ', '.join(missing))
+    slope = ((n * sxy) - (sx * sy)) / denominator
+    b = (sy - (slope * sx)) / n
+    m = 1 / slope
+    residual = np.sqrt(np.bincount(group,weights=(y - ((slope[group] * x) + b[group])) ** 2,minlength=NO_GROUPS) / n)
+
+    results = {}
+    for i,sensor in enumerate(sensors):
+        results[sensor] = (m[i * 3:(i * 3) + 3].tolist(),b[i * 3:(i * 3) + 3].tolist(),residual[i * 3:(i * 3) + 3].tolist())
+        if (store is not None):
+            store.add(sensor,results[sensor][0],results[sensor][1],date)
+    if (store is not None):
+        store.save()
+
+    return(results)
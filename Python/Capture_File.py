@@ -0,0 +1,326 @@
+import io
+import json
+import os
+import time
+import numpy as np
+
+
+# A capture file starts with CAPTURE_MAGIC, then the length of the header as a 4 byte little-endian
+# unsigned int, then the header itself as JSON. The body starts at the next multiple of 64 bytes and
+# holds the samples as little-endian values stored column by column, so each sensor axis is one
+# contiguous run of the file. If the exact reading times are saved they follow from the next multiple of
+# 64 bytes as the difference between consecutive readings of each sensor, one sensor after another.
+CAPTURE_MAGIC = b'ACCCAP01'
+CAPTURE_ALIGN = 64
+
+# A pyramid file, saved next to each capture file, holds the minimum and maximum of every column over bins of
+# PYRAMID_FACTOR rows, then bins of PYRAMID_FACTOR times as many rows, and so on until a level has no more than
+# PYRAMID_MIN_BINS bins. It starts in the same way as a capture file, with PYRAMID_MAGIC, and each level is stored
+# from the next multiple of 64 bytes as rows of [bins][columns][min, max].
+PYRAMID_MAGIC = b'ACCPYR01'
+PYRAMID_FACTOR = 8
+PYRAMID_MIN_BINS = 1024
+
+# CSV files are written with Excel line endings, as csv.writer does, and enough digits to read float32 values back exactly
+CSV_NEWLINE = '\r\n'
+CSV_FORMAT = '%.9g'
+
+
+def save_capture(path,data,NO_SENSORS,calibration='',samplingPeriod=None,units='g',timeUnits='s',dtype='<f4',timeStamps=None,pyramid=True):
+    """ Saves a numpy array of 3-Axis Accelerometer data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time], given by data(numpy array) with N defined by the NO_SENSORS(int) parameter, to a capture file of path defined by the path(string) parameter.
+        The header records the sensor count, the name of the calibration profile used (calibration(string)), the sampling period of each sensor (samplingPeriod(float), in timeUnits) and the units of the acceleration (units(string), 'g' or 'ADC') and time (timeUnits(string)) columns. If samplingPeriod is not given it is worked out from the first sensor's time column.
+        The data is written as dtype(string), little-endian float32 by default, and can be opened again without reading it all with open_capture.
+        float32 time columns only hold times to the us for the first 16s of a capture, so the exact time of each reading in us can be given with timeStamps(numpy array) of dimension [n][NO_SENSORS]. These are stored after the data as the difference from the previous reading of the same sensor, in the smallest integer type that holds them, and are read back with read_capture_times.
+        Unless pyramid(bool) is False the min/max pyramid used to plot the capture is saved next to it with save_pyramid.
+    """
+    rows = data.shape[0]
+    if (samplingPeriod is None and rows > 1):
+        samplingPeriod = float(data[-1,3] - data[0,3]) / (rows - 1)
+
+    header = { 'sensors': NO_SENSORS,
+               'rows': rows,
+               'columns': data.shape[1],
+               'dtype': np.dtype(dtype).str,
+               'order': 'columns',
+               'calibration': calibration,
+               'samplingPeriod': samplingPeriod,
+               'units': units,
+               'timeUnits': timeUnits }
+    if (timeStamps is not None):
+        timeStamps = np.asarray(timeStamps,dtype=np.int64).reshape(rows,NO_SENSORS)
+        deltas = np.diff(timeStamps,axis=0).T
+        timeDtype = np.result_type(np.min_scalar_type(deltas.min()),np.min_scalar_type(deltas.max())) if (deltas.size) else np.dtype(np.uint8)
+        header['timeOrigin'] = timeStamps[0].tolist() if (rows) else []
+        header['timeDtype'] = timeDtype.newbyteorder('<').str
+    headerBytes = json.dumps(header).encode()
+    offset = len(CAPTURE_MAGIC) + 4 + len(headerBytes)
+    padding = -offset % CAPTURE_ALIGN
+
+    with open(path,'wb') as capture_file:
+        capture_file.write(CAPTURE_MAGIC)
+        capture_file.write(len(headerBytes).to_bytes(4,'little'))
+        capture_file.write(headerBytes + (b' ' * padding))
+        # The transpose of the data is written in row order, which stores the data column by column
+        np.ascontiguousarray(data.T,dtype=dtype).tofile(capture_file)
+        if (timeStamps is not None):
+            capture_file.write(b'\0' * (-capture_file.tell() % CAPTURE_ALIGN))
+            deltas.astype(header['timeDtype']).tofile(capture_file)
+    if (pyramid):
+        save_pyramid(pyramid_path(path),data,dtype)
+
+
+def read_capture_header(path):
+    """ Returns a tuple (header, offset) holding the header dictionary of the capture file given by path(string) and the position of the first byte of data.
+    """
+    with open(path,'rb') as capture_file:
+        if (capture_file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC):
+            raise ValueError(path + ' is not a capture file')
+        length = int.from_bytes(capture_file.read(4),'little')
+        header = json.loads(capture_file.read(length).decode())
+    offset = len(CAPTURE_MAGIC) + 4 + length
+    return(header,offset + (-offset % CAPTURE_ALIGN))
+
+
+def open_capture(path,mode='r'):
+    """ Opens the capture file given by path(string) as a memory map without reading the data and returns a tuple (data, header). data behaves as a numpy array of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] but only the parts that are used are read from disk, so a few columns or rows of a long capture load almost instantly.
+        mode(string) is passed to np.memmap, 'r' for read only or 'r+' to change the data in place.
+    """
+    header,offset = read_capture_header(path)
+    columns = np.memmap(path,dtype=header['dtype'],mode=mode,offset=offset,shape=(header['columns'],header['rows']))
+    return(columns.T,header)
+
+
+def read_capture_times(path):
+    """ Returns the exact time in us of every reading in the capture file given by path(string), as an int64 numpy array of dimension [n][NO_SENSORS], or None if the file was saved without them.
+    """
+    header,offset = read_capture_header(path)
+    if ('timeDtype' not in header):
+        return(None)
+    rows = header['rows']
+    offset += rows * header['columns'] * np.dtype(header['dtype']).itemsize
+    offset += -offset % CAPTURE_ALIGN
+    timeStamps = np.empty((header['sensors'],rows),dtype=np.int64)
+    if (rows > 0):
+        timeStamps[:,0] = header['timeOrigin']
+        deltas = np.fromfile(path,dtype=header['timeDtype'],count=(rows - 1) * header['sensors'],offset=offset)
+        np.cumsum(deltas.reshape(header['sensors'],rows - 1),axis=1,out=timeStamps[:,1:])
+        timeStamps[:,1:] += timeStamps[:,:1]
+    return(timeStamps.T)
+
+
+def pyramid_path(path):
+    """ Returns the pyramid file path that goes with a capture or CSV path, given by path(string), by replacing its extension with .pyr.
+    """
+    return(os.path.splitext(path)[0] + '.pyr')
+
+
+def _bin_min_max(minimum,maximum,binSize):
+    # Returns the min and max of every bin of binSize rows, the last bin holding whatever rows are left.
+    # fmin and fmax skip the NaN of lost readings.
+    starts = np.arange(0,minimum.shape[0],binSize)
+    return(np.stack((np.fmin.reduceat(minimum,starts,axis=0),np.fmax.reduceat(maximum,starts,axis=0)),axis=2))
+
+
+def save_pyramid(path,data,dtype='<f4',factor=PYRAMID_FACTOR,minBins=PYRAMID_MIN_BINS,blockSize=1 << 16):
+    """ Saves the min/max pyramid of data(numpy array), a capture of any number of columns, to the file given by path(string) as values of type dtype(string). Level 0 holds the min and max of every column over bins of factor(int) rows and each level after it bins the one before by factor again, until a level has no more than minBins(int) bins.
+        data is read blockSize(int) bins at a time, so a memory mapped capture of any length can be given. Open the file with CapturePyramid.
+    """
+    rows,columns = data.shape
+    binSizes = [factor]
+    while (-(-rows // binSizes[-1]) > minBins):
+        binSizes.append(binSizes[-1] * factor)
+
+    # Every level starts at a multiple of 64 bytes after the header. The header is padded to a fixed length
+    # so the offsets written in it can be worked out first.
+    itemSize = np.dtype(dtype).itemsize
+    levels = [{ 'binSize': b, 'bins': -(-rows // b), 'offset': 0 } for b in binSizes]
+    headerLength = len(json.dumps({ 'levels': levels })) + 256
+    offset = len(PYRAMID_MAGIC) + 4 + headerLength
+    for level in levels:
+        offset += -offset % CAPTURE_ALIGN
+        level['offset'] = offset
+        offset += level['bins'] * columns * 2 * itemSize
+    header = { 'rows': rows, 'columns': columns, 'dtype': np.dtype(dtype).str, 'factor': factor, 'levels': levels }
+    headerBytes = json.dumps(header).encode().ljust(headerLength)
+
+    with open(path,'wb') as pyramid_file:
+        pyramid_file.write(PYRAMID_MAGIC)
+        pyramid_file.write(len(headerBytes).to_bytes(4,'little'))
+        pyramid_file.write(headerBytes)
+        # Level 0 is built from the data a block at a time and each level after it from the one before,
+        # which is at most 1/factor of the size
+        previous = None
+        for level in levels:
+            pyramid_file.write(b'\0' * (level['offset'] - pyramid_file.tell()))
+            if (previous is None):
+                step = blockSize * factor
+                for start in range(0,rows,step):
+                    block = np.asarray(data[start:start + step],dtype=dtype)
+                    _bin_min_max(block,block,factor).tofile(pyramid_file)
+                pyramid_file.flush()
+                previous = np.memmap(path,dtype=dtype,mode='r',offset=level['offset'],shape=(level['bins'],columns,2)) if (rows) else np.zeros((0,columns,2),dtype=dtype)
+                continue
+            previous = _bin_min_max(previous[:,:,0],previous[:,:,1],factor)
+            previous.tofile(pyramid_file)
+
+
+class CapturePyramid:
+    """ Opens the capture file given by path(string) together with the min/max pyramid saved next to it, both as memory maps, so any part of a capture of any length can be plotted by reading little more than one point for each pixel.
+    """
+
+    def __init__(self,path):
+        self.data,self.header = open_capture(path)
+        pyramidPath = pyramid_path(path)
+        with open(pyramidPath,'rb') as pyramid_file:
+            if (pyramid_file.read(len(PYRAMID_MAGIC)) != PYRAMID_MAGIC):
+                raise ValueError(pyramidPath + ' is not a pyramid file')
+            length = int.from_bytes(pyramid_file.read(4),'little')
+            pyramid = json.loads(pyramid_file.read(length).decode())
+        if (pyramid['rows'] != self.header['rows'] or pyramid['columns'] != self.header['columns']):
+            raise ValueError(pyramidPath + ' does not match ' + path)
+        # Empty levels of an empty capture cannot be memory mapped and are never needed
+        self.binSizes = [level['binSize'] for level in pyramid['levels'] if level['bins'] > 0]
+        self.levels = [np.memmap(pyramidPath,dtype=pyramid['dtype'],mode='r',offset=level['offset'],shape=(level['bins'],pyramid['columns'],2))
+                       for level in pyramid['levels'] if level['bins'] > 0]
+
+    def time_range(self,timeColumn=3):
+        """ Returns a tuple (start, end) of the first and last time in the column given by timeColumn(int).
+        """
+        return(float(self.data[0,timeColumn]),float(self.data[-1,timeColumn]))
+
+    def envelope(self,start,stop,pixels,columns,timeColumn=None):
+        """ Returns the columns(list) of the capture between the times start(float) and stop(float) with at least pixels(int) points, and no more than about 2 * PYRAMID_FACTOR times as many however long the capture is. The time is taken from timeColumn(int), by default the last of columns.
+            The coarsest level with a bin for every pixel is used, giving two rows for each bin that hold the minimum and then the maximum of every column, so no peak is lost however far the capture is zoomed out. If no level is fine enough the samples themselves are returned. Either way the columns are returned in the order given, in the same form as the capture.
+        """
+        timeColumn = columns[-1] if (timeColumn is None) else timeColumn
+        # Only the rows either side of the range are read from the sorted time column
+        times = self.data[:,timeColumn]
+        first = max(int(np.searchsorted(times,start)) - 1,0)
+        last = min(int(np.searchsorted(times,stop,side='right')) + 1,times.shape[0])
+        level = None
+        for k,binSize in enumerate(self.binSizes):
+            if ((last - first) // binSize >= pixels):
+                level = k
+        if (level is None):
+            return(np.array(self.data[first:last,columns]))
+        binSize = self.binSizes[level]
+        bins = self.levels[level][first // binSize:-(-last // binSize)][:,columns,:]
+        return(np.ascontiguousarray(bins.transpose(0,2,1)).reshape(-1,len(columns)))
+
+
+def csv_header(NO_SENSORS):
+    """ Returns the two header rows used for a CSV file of N sensors, with N defined by the NO_SENSORS(int) parameter. The first row names each sensor above its X column and the second row names the columns [X,Y,Z,Time/ms] of every sensor.
+    """
+    sensorRow = []
+    for i in range(0,NO_SENSORS):
+        sensorRow += ['Sensor ' + str(i + 1),' ',' ',' ']
+    # The original headers stopped at the last sensor name
+    return([ sensorRow[:-3],
+             ['X','Y','Z','Time/ms'] * NO_SENSORS ])
+
+
+def time_columns(NO_SENSORS):
+    """ Returns the index of the time column of each sensor in data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time], with N defined by the NO_SENSORS(int) parameter.
+    """
+    return(np.arange(3,4 * NO_SENSORS,4))
+
+
+def capture_path(path):
+    """ Returns the capture file path that goes with a CSV path, given by path(string), by replacing its extension with .cap.
+    """
+    return(os.path.splitext(path)[0] + '.cap')
+
+
+def _skip_lines(binary_file,NO_LINES,blockSize=1 << 20):
+    # Moves binary_file to the start of line NO_LINES by counting newlines in large blocks without parsing them
+    position = binary_file.tell()
+    while (NO_LINES > 0):
+        block = binary_file.read(blockSize)
+        if (not block):
+            break
+        found = block.count(b'\n')
+        if (found < NO_LINES):
+            NO_LINES -= found
+            position += len(block)
+            continue
+        end = -1
+        for i in range(0,NO_LINES):
+            end = block.find(b'\n',end + 1)
+        position += end + 1
+        NO_LINES = 0
+    binary_file.seek(position)
+
+
+def read_csv_array(path,rows=None,sensors=None,dtype=np.float32,NO_HEADER=2,width=4):
+    """ Reads a CSV file saved by save_as_csv, given by path(string), straight into a numpy array of type dtype without building a list of strings first. The NO_HEADER(int) header rows are skipped.
+        rows(tuple) selects the samples (start, stop) to read, counted from the first sample after the header, and sensors(list) selects the sensors to read by number, starting from 1. Rows before the selection are skipped without being parsed and reading stops at the end of the selection, so the time and memory used depend on the size of the selection rather than the size of the file.
+        width(int) is the number of columns for each sensor, 4 for [X,Y,Z,Time] or 3 for captures from Serial_Test_MultiCal. The array returned has the columns of the selected sensors in the same form as the file.
+    """
+    start,stop = rows if (rows is not None) else (0,None)
+    usecols = None
+    if (sensors is not None):
+        usecols = [(width * (sensor - 1)) + k for sensor in sensors for k in range(0,width)]
+
+    with open(path,'rb') as csv_file:
+        _skip_lines(csv_file,NO_HEADER + start)
+        text = io.TextIOWrapper(csv_file,newline='')
+        data = np.loadtxt(text,delimiter=',',dtype=dtype,usecols=usecols,ndmin=2,
+                          max_rows=(None if stop is None else stop - start))
+    return(data)
+
+
+class CSVWriter:
+    """ Writes a CSV file, given by path(string), a block at a time while samples are still being collected, so a long run never has to be held in memory and little is lost if the program stops part way through.
+        The header(list) rows are written once when the file is opened. Each block is formatted in one go with np.savetxt into a buffer of bufferSize(int) bytes, and the file is flushed to disk at most every flushInterval(float) seconds. Use close(), or "with CSVWriter(...) as writer", to write out the end of the file.
+        If metrics(PipelineMetrics) is given each block written is recorded as the csv_write stage and each flush as csv_flush.
+    """
+
+    def __init__(self,path,header,flushInterval=1.0,bufferSize=1 << 20,metrics=None):
+        self.path = path
+        self.metrics = metrics
+        self.flushInterval = flushInterval
+        self.csv_file = open(path,'w',newline='',buffering=bufferSize)
+        self.csv_file.write(''.join([','.join(row) + CSV_NEWLINE for row in header]))
+        self.rows = 0
+        self.lastFlush = time.monotonic()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,*exc):
+        self.close()
+
+    def write(self,data):
+        """ Appends the rows of data(numpy array), in the same column layout as the header, to the file.
+        """
+        start = time.perf_counter()
+        np.savetxt(self.csv_file,data,fmt=CSV_FORMAT,delimiter=',',newline=CSV_NEWLINE)
+        self.rows += data.shape[0]
+        if (self.metrics is not None):
+            self.metrics.record('csv_write',time.perf_counter() - start,items=data.shape[0])
+        if (time.monotonic() - self.lastFlush >= self.flushInterval):
+            self.flush()
+
+    def append(self,readings,timeStamps):
+        """ Appends a block of samples in the form given by the acquisition threads, readings(numpy array) of dimension [n][NO_SENSORS][3] and timeStamps(numpy array) of dimension [n][NO_SENSORS], as rows of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time].
+        """
+        n,NO_SENSORS = timeStamps.shape
+        rows = np.empty((n,NO_SENSORS,4))
+        rows[:,:,:3] = readings.reshape(n,NO_SENSORS,3)
+        rows[:,:,3] = timeStamps
+        self.write(rows.reshape(n,NO_SENSORS * 4))
+
+    def flush(self):
+        """ Writes everything buffered so far to disk.
+        """
+        start = time.perf_counter()
+        self.csv_file.flush()
+        os.fsync(self.csv_file.fileno())
+        self.lastFlush = time.monotonic()
+        if (self.metrics is not None):
+            self.metrics.record('csv_flush',time.perf_counter() - start)
+
+    def close(self):
+        if (not self.csv_file.closed):
+            self.flush()
+            self.csv_file.close()
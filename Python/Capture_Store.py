@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class CaptureStore:
+    """ Preallocated storage for samples collected from N 3-Axis Accelerometers. ADC readings are held as int16, or the type given by dtype(numpy dtype) such as float32 for converted g values, in an array of dimension [capacity][NO_SENSORS][3] and the time of each reading in ms is held in an array of dimension [capacity][NO_SENSORS].
+        For a fixed length run the capacity should be set to SAMPLING_CYCLES * NO_SAMPLES using the NO_CYCLES(int) and NO_SAMPLES(int) parameters. If ring(bool) is True the store instead keeps only the most recent capacity samples and overwrites the oldest ones, which allows open ended runs with a fixed amount of memory.
+        Samples are copied straight into the preallocated arrays as they are parsed so the capture never has to be converted from Python lists.
+        If columns(bool) is True the readings and times share one array of type dtype already in the column layout of as_columns, so as_columns can return a view of it rather than a copy. The times are then held as dtype too, so this suits a float32 store of g values whose exact times are kept elsewhere.
+    """
+
+    def __init__(self,NO_SENSORS,NO_SAMPLES,NO_CYCLES,ring=False,dtype=np.int16,columns=False):
+        self.NO_SENSORS = NO_SENSORS
+        self.capacity = NO_SAMPLES * NO_CYCLES
+        self.ring = ring
+        if (columns):
+            self.data = np.zeros((self.capacity,NO_SENSORS,4),dtype=dtype)
+            self.adc = self.data[:,:,:3]
+            self.time = self.data[:,:,3]
+        else:
+            self.data = None
+            self.adc = np.zeros((self.capacity,NO_SENSORS,3),dtype=dtype)
+            self.time = np.zeros((self.capacity,NO_SENSORS),dtype=np.float64)
+        self.written = 0    # Total number of samples given to the store
+        self.dropped = 0    # Samples that did not fit in a fixed length store
+
+    def __len__(self):
+        return(min(self.written,self.capacity))
+
+    def append(self,readings,timeStamps):
+        """ Copies a block of samples into the store. readings(numpy array) should have dimension [n][NO_SENSORS * 3] or [n][NO_SENSORS][3] and timeStamps(numpy array) dimension [n][NO_SENSORS].
+        """
+        readings = readings.reshape(-1,self.NO_SENSORS,3)
+        timeStamps = timeStamps.reshape(-1,self.NO_SENSORS)
+        n = readings.shape[0]
+
+        if (not self.ring):
+            # A fixed length store keeps the first capacity samples and counts the rest as dropped
+            free = self.capacity - self.written
+            if (n > free):
+                self.dropped += n - free
+                n = free
+            self.adc[self.written:self.written + n] = readings[:n]
+            self.time[self.written:self.written + n] = timeStamps[:n]
+            self.written += n
+            return
+
+        # Only the newest capacity samples of a large block can survive in a ring buffer
+        if (n > self.capacity):
+            self.written += n - self.capacity
+            readings = readings[-self.capacity:]
+            timeStamps = timeStamps[-self.capacity:]
+            n = self.capacity
+
+        # Copy the block in at most two parts, wrapping round to the start of the buffer
+        start = self.written % self.capacity
+        first = min(n,self.capacity - start)
+        self.adc[start:start + first] = readings[:first]
+        self.time[start:start + first] = timeStamps[:first]
+        self.adc[:n - first] = readings[first:]
+        self.time[:n - first] = timeStamps[first:]
+        self.written += n
+
+    def _ordered(self,array):
+        # Returns the filled part of array oldest sample first. This is a view unless a ring buffer has wrapped.
+        if (self.ring and self.written > self.capacity):
+            start = self.written % self.capacity
+            return(np.concatenate((array[start:],array[:start])))
+        return(array[:len(self)])
+
+    def readings(self):
+        """ Returns the stored readings as a numpy array of dimension [n][NO_SENSORS][3].
+        """
+        return(self._ordered(self.adc))
+
+    def times(self):
+        """ Returns the time in ms of each stored reading as a numpy array of dimension [n][NO_SENSORS].
+        """
+        return(self._ordered(self.time))
+
+    def as_columns(self,dtype=np.float32):
+        """ Returns the stored samples as a single numpy array of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] and type dtype, as used by save_as_csv and the plotting functions.
+            A store made with columns=True returns a view of its own array when dtype matches and a ring buffer has not wrapped, so changes to the array change the store. Otherwise the readings and times are held separately, usually as int16 and float64, and are copied into a new array with a single allocation.
+        """
+        n = len(self)
+        if (self.data is not None and self.data.dtype == dtype and not (self.ring and self.written > self.capacity)):
+            return(self.data[:n].reshape(n,self.NO_SENSORS * 4))
+        data = np.empty((n,self.NO_SENSORS,4),dtype=dtype)
+        data[:,:,:3] = self.readings()
+        data[:,:,3] = self.times()
+        return(data.reshape(n,self.NO_SENSORS * 4))
@@ -0,0 +1,111 @@
+import queue
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from Capture_Store import CaptureStore
+
+
+def subplot_grid(NO_SENSORS):
+    """ Returns a tuple (rows, columns) for a grid of subplots that fits one graph for each of N sensors, with N defined by the NO_SENSORS(int) parameter. The grid is kept close to square, so 5 sensors give 2 rows of 3 and 16 sensors give 4 rows of 4.
+    """
+    columns = int(np.ceil(np.sqrt(NO_SENSORS)))
+    rows = int(np.ceil(NO_SENSORS / columns))
+    return(rows,columns)
+
+
+class LivePlot:
+    """ Shows the samples from NO_SENSORS(int) sensors while they are being collected, in one figure with a graph for each sensor laid out as plot_singlefig does. The blocks are taken from subscription(Subscription) of an AcquisitionThread, so the plot never reads the serial port and a slow redraw only drops blocks from its own queue.
+        Each graph shows the last window(float) seconds, with the time axis in seconds before the newest sample so the axes never have to be redrawn. Only the lines are redrawn, using blitting, and at most frameRate(float) times a second however fast blocks arrive.
+        convert(function) is applied to the readings of each block before they are stored, such as ADC_to_g, and yLimits(tuple) sets the Y axis. Up to capacity(int) samples are kept, which should cover the window.
+        run() must be called from the main thread as matplotlib requires.
+    """
+
+    def __init__(self,subscription,NO_SENSORS,window=5.0,frameRate=20.0,yLimits=(-3,3),convert=None,capacity=8192):
+        self.subscription = subscription
+        self.NO_SENSORS = NO_SENSORS
+        self.window = window
+        self.framePeriod = 1.0 / frameRate
+        self.convert = convert
+        self.store = CaptureStore(NO_SENSORS,capacity,1,ring=True,dtype=np.float32)
+        self.frames = 0
+        self.finished = False
+
+        self.figure = plt.figure()
+        gridRows,gridColumns = subplot_grid(NO_SENSORS)
+        self.lines = []
+        for i in range(0,NO_SENSORS):
+            axes = self.figure.add_subplot(gridRows,gridColumns,i + 1)
+            axes.set_title('Sensor ' + str(i + 1))
+            for label in ['X Axis','Y Axis','Z Axis']:
+                line, = axes.plot([],[],label=label,animated=True)
+                self.lines.append(line)
+            axes.set_xlim(-window,0)
+            axes.set_ylim(yLimits[0],yLimits[1])
+            axes.set_xlabel('Time/s')
+            axes.set_ylabel('Acceleration/g')
+            axes.legend()
+
+        # The background without the lines is saved whenever the whole figure is drawn, such as after a resize
+        self.background = None
+        self.figure.canvas.mpl_connect('draw_event',self._save_background)
+
+    def _save_background(self,event):
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+
+    def add(self,readings,timeStamps):
+        """ Stores a block of readings(numpy array) of dimension [n][NO_SENSORS][3] and timeStamps(numpy array) in ms of dimension [n][NO_SENSORS].
+        """
+        if (readings.shape[0] == 0):
+            return
+        if (self.convert is not None):
+            readings = self.convert(readings)
+        self.store.append(readings,timeStamps)
+
+    def receive(self,timeout):
+        """ Waits up to timeout(float) seconds for a block, then stores it and every other block waiting without redrawing. Returns False once acquisition has finished.
+        """
+        try:
+            block = self.subscription.queue.get(timeout=max(timeout,0))
+            while (block is not None):
+                self.add(*block)
+                block = self.subscription.queue.get_nowait()
+            self.finished = True
+        except queue.Empty:
+            pass
+        return(not self.finished)
+
+    def draw(self):
+        """ Redraws the lines with the samples in the window.
+        """
+        canvas = self.figure.canvas
+        if (self.background is None):
+            canvas.draw()
+        if (len(self.store) > 0):
+            times = self.store.times()
+            readings = self.store.readings()
+            latest = times[-1].max()
+            start = np.searchsorted(times[:,0],latest - (self.window * 1000))
+            x = (times[start:] - latest) / 1000
+            for k,line in enumerate(self.lines):
+                line.set_data(x[:,k // 3],readings[start:,k // 3,k % 3])
+
+        canvas.restore_region(self.background)
+        for line in self.lines:
+            line.axes.draw_artist(line)
+        canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+        self.frames += 1
+
+    def run(self):
+        """ Shows the figure and keeps it up to date until acquisition finishes or the figure is closed. Returns True if acquisition finished, or False if the figure was closed first, after which the blocks of the subscription are left to overrun without holding up acquisition.
+        """
+        plt.show(block=False)
+        nextFrame = time.monotonic()
+        while (plt.fignum_exists(self.figure.number)):
+            running = self.receive(nextFrame - time.monotonic())
+            if (time.monotonic() >= nextFrame or not running):
+                self.draw()
+                nextFrame = time.monotonic() + self.framePeriod
+            if (not running):
+                return(True)
+        return(False)
@@ -0,0 +1,191 @@
+import http.server
+import json
+import threading
+import time
+
+
+# Latency histograms count times in buckets that double in width: bucket k holds times from 2^(k-1) up to
+# 2^k us, with bucket 0 for times under 1us and the last bucket for anything over about 18 minutes
+HISTOGRAM_BUCKETS = 31
+
+
+class LatencyHistogram:
+    """ Counts how long each run of a stage took in buckets that double in width from 1us, so recording a time is a few integer operations and the histogram never grows.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self,seconds):
+        """ Adds one time given in seconds by seconds(float).
+        """
+        self.buckets[min(int(seconds * 1e6).bit_length(),HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if (seconds > self.maximum):
+            self.maximum = seconds
+
+    def quantile(self,q):
+        """ Returns the time in seconds below which a fraction q(float) of the recorded times fall, to within the width of a bucket.
+        """
+        if (self.count == 0):
+            return(0.0)
+        target = q * self.count
+        seen = 0
+        for k,n in enumerate(self.buckets):
+            seen += n
+            if (seen >= target):
+                return(min((1 << k) / 1e6,self.maximum))
+        return(self.maximum)
+
+    def summary(self):
+        """ Returns a dictionary of the count, mean, median, 99th percentile and maximum time in seconds, with the count in every bucket.
+        """
+        return({ 'count': self.count,
+                 'mean': (self.total / self.count) if (self.count) else 0.0,
+                 'p50': self.quantile(0.5),
+                 'p99': self.quantile(0.99),
+                 'max': self.maximum,
+                 'bucketsUs': { str(1 << k): n for k,n in enumerate(self.buckets) if n } })
+
+
+class StageMetrics:
+    """ The counters of one stage of the pipeline: how many times it ran and how long each run took, the items (lines, frames or rows) and bytes it handled, and the number of failures of each kind.
+    """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.items = 0
+        self.bytes = 0
+        self.failures = {}
+        self.first = None   # time.monotonic() of the first and last runs, used for the rates
+        self.last = None
+
+    def summary(self):
+        """ Returns a dictionary of the counters with the items and bytes per second since the stage first ran.
+        """
+        elapsed = (self.last - self.first) if (self.first is not None) else 0.0
+        return({ 'runs': self.latency.count,
+                 'items': self.items,
+                 'bytes': self.bytes,
+                 'itemsPerSecond': (self.items / elapsed) if (elapsed > 0) else None,
+                 'bytesPerSecond': (self.bytes / elapsed) if (elapsed > 0) else None,
+                 'busy': (self.latency.total / elapsed) if (elapsed > 0) else None,
+                 'failures': dict(self.failures),
+                 'latency': self.latency.summary() })
+
+
+class PipelineMetrics:
+    """ Counters for every stage of capture and processing, kept by the parts of the pipeline that are given one with their metrics parameter. Each stage records one run per block rather than per line or sample, so the cost is a few microseconds for every few hundred samples.
+        Stages record their time, items and bytes with record(), failures with fail() and the deepest any buffer or queue has been with high_water(). snapshot() returns everything as a dictionary, which can also be written to a file with dump() or read from a browser or script while a capture runs with serve().
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.highWater = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def stage(self,name):
+        """ Returns the StageMetrics of the stage called name(string), adding it the first time.
+        """
+        stage = self.stages.get(name)
+        if (stage is None):
+            with self.lock:
+                stage = self.stages.setdefault(name,StageMetrics())
+        return(stage)
+
+    def record(self,name,seconds,items=0,nbytes=0):
+        """ Records one run of the stage name(string) that took seconds(float) and handled items(int) items and nbytes(int) bytes.
+        """
+        stage = self.stage(name)
+        now = time.monotonic()
+        if (stage.first is None):
+            stage.first = now - seconds
+        stage.last = now
+        stage.latency.record(seconds)
+        stage.items += items
+        stage.bytes += nbytes
+
+    def fail(self,name,reason,count=1):
+        """ Counts count(int) failures of the stage name(string) for the reason given by reason(string).
+        """
+        if (count):
+            failures = self.stage(name).failures
+            # Taken so snapshot() never copies the dictionary while a new reason is being added
+            with self.lock:
+                failures[reason] = failures.get(reason,0) + count
+
+    def high_water(self,name,value):
+        """ Keeps the largest value(int) seen for the buffer or queue called name(string).
+        """
+        if (value > self.highWater.get(name,-1)):
+            with self.lock:
+                if (value > self.highWater.get(name,-1)):
+                    self.highWater[name] = value
+
+    def snapshot(self):
+        """ Returns a dictionary of every stage's counters and every high-water mark, with the seconds since the metrics were created.
+        """
+        # The dictionaries are copied under the lock as the acquisition and consumer threads may be adding to them
+        with self.lock:
+            stages = { name: stage.summary() for name,stage in self.stages.items() }
+            highWater = dict(self.highWater)
+        return({ 'uptime': time.monotonic() - self.started,
+                 'stages': stages,
+                 'highWater': highWater })
+
+    def report(self):
+        """ Returns a short readable summary with a line for every stage and high-water mark.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name,stage in snapshot['stages'].items():
+            line = '{:<16} {:>7} runs  p50 {:8.3f} ms  p99 {:8.3f} ms'.format(name,stage['runs'],stage['latency']['p50'] * 1000,stage['latency']['p99'] * 1000)
+            if (stage['itemsPerSecond']):
+                line += '  {:10.0f} items/s'.format(stage['itemsPerSecond'])
+            if (stage['bytesPerSecond']):
+                line += '  {:10.0f} bytes/s'.format(stage['bytesPerSecond'])
+            for reason,count in stage['failures'].items():
+                line += '  ' + reason + ': ' + str(count)
+            lines.append(line)
+        for name,value in snapshot['highWater'].items():
+            lines.append('{:<16} high-water {}'.format(name,value))
+        return('\n'.join(lines))
+
+    def dump(self,path):
+        """ Writes snapshot() as JSON to the file given by path(string).
+        """
+        with open(path,'w') as metrics_file:
+            json.dump(self.snapshot(),metrics_file,indent=1)
+
+    def serve(self,port=8765,host='127.0.0.1'):
+        """ Starts a small HTTP server on host(string) and port(int), localhost by default, that returns snapshot() as JSON for every GET request. The server runs in a daemon thread until stop_serving() is called. Returns the server, whose server_address gives the port used if port was 0.
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,*args):
+                pass    # Requests are not printed over the capture's own output
+
+        self.server = http.server.ThreadingHTTPServer((host,port),Handler)
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+        return(self.server)
+
+    def stop_serving(self):
+        if (self.server is not None):
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,331 @@
+import asyncio
+import heapq
+import io
+import queue
+import threading
+import time
+import serial
+import numpy as np
+from Serial_Protocol import LineReader, FrameReader, FrameDecoder, LossStats, ROWS_PER_FRAME, READ_SIZE, read_cycle
+
+
+class Subscription:
+    """ A queue of decoded blocks given to one consumer of an AcquisitionThread, called name(string). Each block is a tuple (readings, timeStamps) where readings is an int numpy array of dimension [n][NO_SENSORS][3] and timeStamps holds the time of each reading in ms from the start of sampling, carrying on from one cycle to the next, with dimension [n][NO_SENSORS]. None is put on the queue once acquisition has finished.
+        If drop(bool) is True the queue holds up to maxBlocks(int) blocks and, if the consumer falls behind and the queue is full, the newest block is dropped rather than holding up the serial port. This suits a display that only needs the latest samples. Dropped blocks are counted in overruns and droppedSamples.
+        If drop is False the queue grows instead, so no block is ever lost however far the consumer falls behind. This should be used by any consumer that stores the capture. The deepest the queue has been is kept in maxDepth either way.
+    """
+
+    def __init__(self,maxBlocks,drop=True,name=None):
+        self.queue = queue.Queue(maxBlocks if (drop) else 0)
+        self.drop = drop
+        self.name = name
+        self.overruns = 0
+        self.droppedSamples = 0
+        self.maxDepth = 0
+
+    def depth(self):
+        """ Returns the number of blocks waiting to be consumed.
+        """
+        return(self.queue.qsize())
+
+    def put(self,block):
+        try:
+            self.queue.put_nowait(block)
+        except queue.Full:
+            self.overruns += 1
+            self.droppedSamples += block[0].shape[0]
+        self.maxDepth = max(self.maxDepth,self.queue.qsize())
+
+    def close(self):
+        # The end marker must reach the consumer, so the oldest blocks are dropped to make room for it. Waiting for
+        # space instead would never finish if the consumer has stopped reading, such as a closed live plot.
+        while (True):
+            try:
+                self.queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    block = self.queue.get_nowait()
+                    self.overruns += 1
+                    self.droppedSamples += block[0].shape[0]
+                except queue.Empty:
+                    pass
+
+
+class AcquisitionThread(threading.Thread):
+    """ A worker thread that owns the serial port given by the serialPort(serial.Serial) parameter and does nothing but read and decode samples from NO_SENSORS(int) sensors, so the port is always being emptied whatever the rest of the program is doing.
+        Samples are read in cycles of NO_SAMPLES(int) from ADC_Serial_MultiV5, or from ADC_Serial_MultiV6 or the continuous ADC_Serial_MultiV7 if binary(bool) is True, and each cycle is passed to every Subscription as a decoded block. The thread sends 'S' to the Arduino when started and again when it finishes, which is after cycles(int) cycles or when stop() is called, and then closes the port.
+        Lost readings are dropped, set to NaN or interpolated as given by fill(string), as for fill_gaps, and counted for each sensor in loss(LossStats).
+        If metrics(PipelineMetrics) is given it is passed to the reader, and handing each block to the subscriptions is recorded as the publish stage with the high-water mark of every subscription's queue.
+    """
+
+    def __init__(self,serialPort,NO_SENSORS,NO_SAMPLES,binary=False,cycles=None,fill='drop',metrics=None):
+        threading.Thread.__init__(self,daemon=True)
+        self.serialPort = serialPort
+        self.NO_SENSORS = NO_SENSORS
+        self.NO_SAMPLES = NO_SAMPLES
+        self.binary = binary
+        self.cycles = cycles
+        self.fill = fill
+        self.metrics = metrics
+        self.loss = LossStats(NO_SENSORS)
+        self.subscriptions = []
+        self.reader = None
+        self.running = threading.Event()
+        self.running.set()      # Cleared by stop(), which may be called before the thread has started
+        self.blocks = 0
+        self.samples = 0
+        self.badSamples = 0
+        self.invalidSamples = 0
+        self.timeOffset = 0.0   # Start of the current text cycle in ms from the start of sampling
+        self.lostFrames = 0
+        self.pauses = 0         # Times a binary stream stopped sampling, and their total length in ms
+        self.pausedTime = 0.0
+
+    def subscribe(self,maxBlocks=64,drop=True,name=None):
+        """ Returns a new Subscription called name(string) holding up to maxBlocks(int) blocks, or any number of blocks if drop(bool) is False. Subscriptions should be made before the thread is started.
+        """
+        subscription = Subscription(maxBlocks,drop,name)
+        self.subscriptions.append(subscription)
+        return(subscription)
+
+    def stop(self):
+        """ Asks the thread to finish. A read waiting on the port is cancelled, so the thread stops straight away rather than after the port timeout, and the part of the cycle read so far is discarded.
+        """
+        self.running.clear()
+        reader = self.reader
+        if (reader is not None):
+            reader.cancel()
+
+    def stats(self):
+        """ Returns a dictionary of the acquisition counters, the loss statistics of each sensor and, for each subscription, its queue depth and overrun counters.
+        """
+        return({ 'blocks': self.blocks,
+                 'samples': self.samples,
+                 'badSamples': self.badSamples,
+                 'invalidSamples': self.invalidSamples,
+                 'lostFrames': self.lostFrames,
+                 'pauses': self.pauses,
+                 'pausedTime': self.pausedTime,
+                 'loss': self.loss.summary(),
+                 'subscriptions': [ { 'name': s.name,
+                                      'depth': s.depth(),
+                                      'maxDepth': s.maxDepth,
+                                      'overruns': s.overruns,
+                                      'droppedSamples': s.droppedSamples } for s in self.subscriptions ] })
+
+    def run(self):
+        if (self.binary):
+            reader = FrameReader(self.serialPort,self.NO_SENSORS,fill=self.fill,metrics=self.metrics)
+            self.loss = reader.loss
+        else:
+            reader = LineReader(self.serialPort,metrics=self.metrics)
+        self.reader = reader
+
+        self.serialPort.write(b'S')   # Send 'S' to tell the arduino to start taking/sending samples
+        try:
+            while (self.running.is_set() and (self.cycles is None or self.blocks < self.cycles)):
+                if (self.binary):
+                    readings,timeStamps,sequence = reader.read_frames(self.NO_SAMPLES // ROWS_PER_FRAME)
+                    self.lostFrames = reader.lostFrames
+                    self.pauses = reader.pauses
+                    self.pausedTime = reader.pausedTime
+                else:
+                    readings,timeStamps,badSamples,invalidSamples,endTime,timeReceived = read_cycle(reader,self.NO_SENSORS,self.NO_SAMPLES,self.fill,self.loss)
+                    self.badSamples += badSamples
+                    self.invalidSamples += invalidSamples
+                    # Each text cycle is timed from its own start, so it is moved on to follow the cycles before it
+                    timeStamps = timeStamps + self.timeOffset
+                    self.timeOffset += endTime
+
+                self.blocks += 1
+                self.samples += readings.shape[0]
+                start = time.perf_counter()
+                overruns = [subscription.overruns for subscription in self.subscriptions]
+                for subscription in self.subscriptions:
+                    subscription.put((readings,timeStamps))
+                if (self.metrics is not None):
+                    self.metrics.record('publish',time.perf_counter() - start,items=readings.shape[0])
+                    for i,subscription in enumerate(self.subscriptions):
+                        self.metrics.high_water('subscription_' + str(i),subscription.maxDepth)
+                        self.metrics.fail('publish','subscription ' + str(i) + ' full',subscription.overruns - overruns[i])
+        except InterruptedError:
+            pass    # stop() cancelled the read
+        finally:
+            self.serialPort.write(b'S') # Send 2nd 'S' to tell the Arduino to stop
+            self.serialPort.close()
+            for subscription in self.subscriptions:
+                subscription.close()
+
+
+class ConsumerThread(threading.Thread):
+    """ Runs function(function) on every block of the subscription(Subscription) in its own thread, so conversion, saving and display of blocks happen alongside acquisition. The function is called as function(readings, timeStamps).
+        If metrics(PipelineMetrics) is given each call is recorded as a stage called name(string), by default the name of the function.
+    """
+
+    def __init__(self,subscription,function,metrics=None,name=None):
+        threading.Thread.__init__(self,daemon=True)
+        self.subscription = subscription
+        self.function = function
+        self.metrics = metrics
+        self.stageName = name or getattr(function,'__name__','consumer')
+
+    def run(self):
+        while (True):
+            block = self.subscription.queue.get()
+            if (block is None):
+                break
+            start = time.perf_counter()
+            self.function(*block)
+            if (self.metrics is not None):
+                self.metrics.record(self.stageName,time.perf_counter() - start,items=block[0].shape[0])
+
+
+class SerialStream:
+    """ Reads and decodes samples from NO_SENSORS(int) sensors on one serial port, given by the serialPort(serial.Serial) parameter, inside an asyncio event loop. No thread is used: the port is read when the event loop reports it readable, or polled every pollInterval(float) seconds if the port has no file descriptor (such as pyserial's loop:// URL).
+        Use it with "async with stream: async for name, readings, timeStamps in stream". Cycles of NO_SAMPLES(int) are decoded from ADC_Serial_MultiV5, or frames from ADC_Serial_MultiV6 if binary(bool) is True. Times are in ms from the start of sampling and carry on from one cycle to the next so they can be compared between ports.
+        Up to maxBlocks(int) decoded blocks are held for the consumer. Further blocks are dropped and counted in overruns and droppedSamples.
+    """
+
+    def __init__(self,serialPort,NO_SENSORS,NO_SAMPLES,binary=False,name=None,maxBlocks=64,pollInterval=0.01):
+        self.serialPort = serialPort
+        self.NO_SENSORS = NO_SENSORS
+        self.NO_SAMPLES = NO_SAMPLES
+        self.binary = binary
+        self.name = serialPort.name if (name is None) else name
+        self.maxBlocks = maxBlocks
+        self.pollInterval = pollInterval
+        self.lineReader = LineReader(serialPort)
+        self.decoder = FrameDecoder(NO_SENSORS)
+        self.pending = []
+        self.pendingSamples = 0
+        self.timeOffset = 0.0
+        self.blocks = None
+        self.poller = None
+        self.overruns = 0
+        self.droppedSamples = 0
+        self.badSamples = 0
+
+    def start(self):
+        """ Registers the port with the running event loop and sends 'S' to start the Arduino.
+        """
+        loop = asyncio.get_running_loop()
+        self.blocks = asyncio.Queue()
+        self.serialPort.timeout = 0     # Reads must never block the event loop
+        try:
+            loop.add_reader(self.serialPort.fileno(),self._read)
+        except (AttributeError,NotImplementedError,io.UnsupportedOperation,serial.SerialException):
+            self.poller = loop.create_task(self._poll())
+        self.serialPort.write(b'S')
+
+    def close(self):
+        """ Stops the Arduino, closes the port and ends the stream.
+        """
+        if (self.poller is not None):
+            self.poller.cancel()
+        else:
+            asyncio.get_running_loop().remove_reader(self.serialPort.fileno())
+        self.serialPort.write(b'S')
+        self.serialPort.close()
+        self.blocks.put_nowait(None)
+
+    async def __aenter__(self):
+        self.start()
+        return(self)
+
+    async def __aexit__(self,*exc):
+        self.close()
+
+    async def _poll(self):
+        while (True):
+            self._read()
+            await asyncio.sleep(self.pollInterval)
+
+    def _put(self,readings,timeStamps):
+        if (self.blocks.qsize() >= self.maxBlocks):
+            self.overruns += 1
+            self.droppedSamples += readings.shape[0]
+            return
+        self.blocks.put_nowait((self.name,readings,timeStamps))
+
+    def _read(self):
+        rawData = self.serialPort.read(min(max(self.serialPort.in_waiting,1),READ_SIZE))
+        if (self.binary):
+            # Frames are grouped into blocks of NO_SAMPLES, the same size as a text cycle
+            readings,timeStamps,sequence = self.decoder.feed(rawData)
+            if (sequence.size > 0):
+                self.pending.append((readings,timeStamps))
+                self.pendingSamples += readings.shape[0]
+            if (self.pendingSamples >= self.NO_SAMPLES):
+                readings = np.concatenate([p[0] for p in self.pending])
+                timeStamps = np.concatenate([p[1] for p in self.pending])
+                # One read can complete more than a block, the rows left over start the next one
+                blocks = self.pendingSamples // self.NO_SAMPLES
+                for i in range(0,blocks):
+                    self._put(readings[i * self.NO_SAMPLES:(i + 1) * self.NO_SAMPLES],timeStamps[i * self.NO_SAMPLES:(i + 1) * self.NO_SAMPLES])
+                self.pending = [(readings[blocks * self.NO_SAMPLES:],timeStamps[blocks * self.NO_SAMPLES:])]
+                self.pendingSamples -= blocks * self.NO_SAMPLES
+            return
+
+        # Only whole cycles are parsed so read_cycle never has to wait for the port
+        self.lineReader.feed(rawData)
+        while (self.lineReader.lineCount >= self.NO_SAMPLES + 1):
+            readings,timeStamps,badSamples,invalidSamples,endTime,timeReceived = read_cycle(self.lineReader,self.NO_SENSORS,self.NO_SAMPLES)
+            self.badSamples += badSamples
+            self._put(readings,timeStamps + self.timeOffset)
+            self.timeOffset += endTime
+
+    def __aiter__(self):
+        return(self)
+
+    async def __anext__(self):
+        block = await self.blocks.get()
+        if (block is None):
+            raise StopAsyncIteration
+        return(block)
+
+
+class MergedStream:
+    """ Reads a number of SerialStreams, given as a list by the streams(list) parameter, at once in the same event loop and merges their blocks into a single stream ordered by the time of the first reading in each block.
+        To keep the order a block is only given out once every open stream has a block waiting, so a port that stops sending holds up the merge until it is closed. Use it with "async with MergedStream(streams) as merged: async for name, readings, timeStamps in merged".
+    """
+
+    def __init__(self,streams):
+        self.streams = streams
+        self.heads = []
+        self.waiting = list(range(0,len(streams)))   # Streams that need their next block read
+
+    async def __aenter__(self):
+        for stream in self.streams:
+            stream.start()
+        return(self)
+
+    async def __aexit__(self,*exc):
+        for stream in self.streams:
+            stream.close()
+
+    def __aiter__(self):
+        return(self)
+
+    async def __anext__(self):
+        # Fetch the next block of every stream that has none waiting, all at the same time
+        blocks = await asyncio.gather(*[self.streams[i].blocks.get() for i in self.waiting])
+        for i,block in zip(self.waiting,blocks):
+            if (block is not None):
+                heapq.heappush(self.heads,(float(block[2][0,0]) if block[2].size else 0.0,i,block))
+        if (not self.heads):
+            raise StopAsyncIteration
+
+        time,i,block = heapq.heappop(self.heads)
+        self.waiting = [i]
+        return(block)
+
+
+def open_streams(ports,NO_SENSORS,NO_SAMPLES,binary=False,baudrate=115200):
+    """ Opens every port or pyserial URL in the ports(list) parameter and returns a MergedStream that reads them all. NO_SENSORS(int), NO_SAMPLES(int) and binary(bool) are used for every port.
+    """
+    streams = []
+    for port in ports:
+        serialPort = serial.serial_for_url(port,baudrate=baudrate,timeout=0)
+        streams.append(SerialStream(serialPort,NO_SENSORS,NO_SAMPLES,binary,name=port))
+    return(MergedStream(streams))
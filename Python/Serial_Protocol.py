@@ -0,0 +1,585 @@
+import collections
+import time
+import numpy as np
+
+
+# Maximum number of bytes requested from the serial port in one read
+READ_SIZE = 4096
+
+# Byte values used when validating received lines
+SPACE = 32
+NEWLINE = 10
+
+
+class LineReader:
+    """ Wraps a serial port, given by the serialPort(serial.Serial) parameter, and reads from it in blocks rather than one line at a time. Bytes are kept in a rolling buffer so any partial line, or lines belonging to the next sampling cycle, are kept for the next call.
+        Each read blocks until at least one byte arrives (or the port timeout expires) and then takes everything waiting in the input buffer, up to readSize(int) bytes, so no CPU time is spent polling an idle port.
+        If metrics(PipelineMetrics) is given each read is recorded as the serial_read stage, with the high-water marks of the port's input buffer and of the lines waiting here, and read_cycle records its parsing.
+    """
+
+    def __init__(self,serialPort,readSize=READ_SIZE,metrics=None):
+        self.serialPort = serialPort
+        self.readSize = readSize
+        self.metrics = metrics
+        self.buffer = bytearray()
+        self.lineCount = 0  # Number of complete lines held in the buffer
+        self.cycleTime = 780    # Length in ms of the last cycle read, used if a cycle arrives without its end time
+        self.cancelled = False
+
+    def fill(self):
+        """ Reads one block from the serial port into the buffer and returns the number of bytes read (0 if the port timed out).
+        """
+        start = time.perf_counter()
+        waiting = self.serialPort.in_waiting
+        rawData = self.serialPort.read(min(max(waiting,1),self.readSize))
+        self.feed(rawData)
+        if (self.metrics is not None):
+            self.metrics.record('serial_read',time.perf_counter() - start,nbytes=len(rawData))
+            self.metrics.high_water('serial_in_waiting',waiting)
+            self.metrics.high_water('line_buffer',len(self.buffer))
+        return(len(rawData))
+
+    def cancel(self):
+        """ Stops a read waiting on the port from another thread, using cancel_read where the port has it. The read in progress, and any made after it, raise InterruptedError.
+        """
+        self.cancelled = True
+        if (hasattr(self.serialPort,'cancel_read')):
+            self.serialPort.cancel_read()
+
+    def feed(self,rawData):
+        """ Adds bytes received by other means, given by rawData(bytes), to the buffer. This lets an event loop read the port itself and only hand complete cycles to read_cycle.
+        """
+        self.buffer += rawData
+        self.lineCount += rawData.count(b'\n')
+
+    def read_lines(self,NO_LINES):
+        """ Blocks until NO_LINES(int) complete lines have been received and returns them as a single bytes object, each line still ending in its newline character.
+        """
+        while (self.lineCount < NO_LINES):
+            if (self.cancelled):
+                raise InterruptedError('Read cancelled')
+            self.fill()
+
+        # Find the end of the last requested line and cut the block out of the buffer
+        end = -1
+        for i in range(0,NO_LINES):
+            end = self.buffer.find(b'\n',end + 1)
+        block = bytes(self.buffer[:end + 1])
+        del self.buffer[:end + 1]
+        self.lineCount -= NO_LINES
+
+        return(block)
+
+
+def parse_sample_lines(block,NO_SENSORS):
+    """ Parses a block of lines, given by the block(bytes) parameter, each of the form (X1 Y1 Z1 X2 Y2 Z2 ... XN YN ZN /r/n) with a space after every reading and N defined by the NO_SENSORS(int) parameter.
+        All lines are validated and converted in bulk. Returns a tuple (readings, present, badSamples, invalidSamples) with one row for every line received. readings is an int numpy array of dimension [lines][NO_SENSORS][3] and present(numpy array) of dimension [lines][NO_SENSORS] is False for each reading that was lost.
+        badSamples is the number of lines with the wrong number of fields or an empty field, which lose every sensor. invalidSamples is the number of other lines holding a reading that is not a number, which only lose the sensors with bad readings.
+    """
+    NO_READINGS = NO_SENSORS * 3
+
+    buf = np.frombuffer(block,dtype=np.uint8)
+    ends = np.flatnonzero(buf == NEWLINE)
+    if (ends.size == 0):
+        return(np.zeros((0,NO_SENSORS,3),dtype=np.int64),np.zeros((0,NO_SENSORS),dtype=bool),0,0)
+    starts = np.concatenate(([0],ends[:-1] + 1))
+    lengths = ends - starts + 1
+    buf = buf[:ends[-1] + 1]
+    lineId = np.repeat(np.arange(ends.size),lengths)
+
+    isSpace = (buf == SPACE)
+    spaceCount = np.cumsum(isSpace)
+    # Number of spaces found before each byte within its own line
+    lineBase = spaceCount[starts] - isSpace[starts]
+    spacesBefore = spaceCount - isSpace - lineBase[lineId]
+
+    # A valid line splits into exactly NO_READINGS + 1 non-empty fields, so it has NO_READINGS spaces,
+    # no leading space and no two spaces next to each other
+    doubleSpace = np.zeros(buf.size,dtype=bool)
+    doubleSpace[1:] = isSpace[1:] & isSpace[:-1] & (lineId[1:] == lineId[:-1])
+    emptyField = (buf[starts] == SPACE) | (np.bincount(lineId,weights=doubleSpace,minlength=ends.size) > 0)
+    lineSpaces = spaceCount[ends] - lineBase
+    wellFormed = (lineSpaces == NO_READINGS) & ~emptyField
+
+    # Every byte before the last space of a reading must be a digit or a separator. A reading that is not
+    # loses only its own sensor, found from the number of spaces before it.
+    inReadings = (spacesBefore < NO_READINGS)
+    notDigit = inReadings & ~isSpace & ((buf < 48) | (buf > 57))
+    sensor = np.minimum(spacesBefore // 3,NO_SENSORS - 1)
+    badSensor = np.bincount((lineId * NO_SENSORS) + sensor,weights=notDigit,minlength=ends.size * NO_SENSORS).reshape(-1,NO_SENSORS) > 0
+    present = wellFormed[:,None] & ~badSensor
+
+    badSamples = int((~wellFormed).sum())
+    invalidSamples = int((wellFormed & badSensor.any(axis=1)).sum())
+
+    # Blank out everything that is not a reading of a well formed line, zero any reading that is not a number
+    # and convert the rest in one pass
+    keep = inReadings & wellFormed[lineId]
+    text = np.where(keep,np.where(notDigit,48,buf),SPACE).astype(np.uint8).tobytes().decode()
+    readings = np.zeros((ends.size,NO_SENSORS,3),dtype=np.int64)
+    readings[wellFormed] = np.fromstring(text,dtype=np.int64,sep=' ').reshape(-1,NO_SENSORS,3)
+
+    return(readings,present,badSamples,invalidSamples)
+
+
+def parse_end_time(line,default=780):
+    """ Parses the end of cycle line, given by the line(bytes) parameter, of the form (Time /r/n) and returns the time in ms. A tuple (endTime, received) is returned. If the line is missing or corrupt the default(int) value is returned instead with received set to False.
+    """
+    try:
+        endTime_temp = line.decode().split(" ",2)
+        if (len(endTime_temp) == 2 and '' not in endTime_temp):
+            return(int(endTime_temp[0]),True)
+    except (UnicodeDecodeError,ValueError):
+        pass
+    return(default,False)
+
+
+def read_cycle(lineReader,NO_SENSORS,NO_SAMPLES,fill='drop',loss=None):
+    """ Reads one sampling cycle of ADC_Serial_MultiV5 from lineReader(LineReader): NO_SAMPLES(int) lines of readings from NO_SENSORS(int) sensors followed by the end time line. The cycle time is spread evenly over the lines to give each reading a time stamp in ms from the start of the cycle, so lost lines leave a gap rather than moving the readings after them. If the end time line is lost the length of the previous cycle is used.
+        Lost readings are handled as given by fill(string), as for fill_gaps, and counted in loss(LossStats) if given.
+        Returns a tuple (readings, timeStamps, badSamples, invalidSamples, endTime, timeReceived) where readings is a numpy array of dimension [n][NO_SENSORS][3], timeStamps has dimension [n][NO_SENSORS] and endTime is the length of the cycle in ms.
+    """
+    # Read the whole cycle, NO_SAMPLES lines of samples and then the end time line, and parse it in one pass
+    block = lineReader.read_lines(NO_SAMPLES)
+    endLine = lineReader.read_lines(1)
+    start = time.perf_counter()
+    readings,present,badSamples,invalidSamples = parse_sample_lines(block,NO_SENSORS)
+    endTime,timeReceived = parse_end_time(endLine,lineReader.cycleTime)
+    lineReader.cycleTime = endTime
+
+    # Each reading is given a time stamp one sampling period after the previous sensor's reading, counting the
+    # readings of lost lines. cumsum adds the periods one after another so the times match a running total.
+    samplingPeriod = (endTime/NO_SAMPLES)/NO_SENSORS
+    NO_READINGS = readings.shape[0] * NO_SENSORS
+    timeStamps = np.zeros(NO_READINGS)
+    np.cumsum(np.full(max(NO_READINGS - 1,0),samplingPeriod),out=timeStamps[1:])
+    timeStamps = timeStamps.reshape(-1,NO_SENSORS)
+
+    if (loss is not None):
+        loss.add(present,timeStamps)
+    readings,timeStamps = fill_gaps(readings,timeStamps,present,fill)
+
+    metrics = getattr(lineReader,'metrics',None)
+    if (metrics is not None):
+        metrics.record('parse',time.perf_counter() - start,items=NO_SAMPLES + 1,nbytes=len(block) + len(endLine))
+        metrics.fail('parse','malformed line',badSamples)
+        metrics.fail('parse','reading not a number',invalidSamples)
+        metrics.fail('parse','end time missing',int(not timeReceived))
+    return(readings,timeStamps,badSamples,invalidSamples,endTime,timeReceived)
+
+
+class LossStats:
+    """ Counts the readings received and lost for each of NO_SENSORS(int) sensors and keeps a map of where the gaps were. The most recent maxGaps(int) gaps are kept in gaps as tuples (time, rows, sensors) giving the time in ms of the first missing row, the number of rows in the gap and a bool array of the sensors that lost readings in it.
+    """
+
+    def __init__(self,NO_SENSORS,maxGaps=10000):
+        self.NO_SENSORS = NO_SENSORS
+        self.received = np.zeros(NO_SENSORS,dtype=np.int64)
+        self.lost = np.zeros(NO_SENSORS,dtype=np.int64)
+        self.gaps = collections.deque(maxlen=maxGaps)
+
+    def add(self,present,times):
+        """ Adds a block of rows, where present(numpy array) of dimension [n][NO_SENSORS] is False for each lost reading and times(numpy array) holds the time of every row, received or not, in ms.
+        """
+        received = present.sum(axis=0)
+        self.received += received
+        self.lost += present.shape[0] - received
+
+        # Each run of rows with a reading missing is one gap
+        missing = ~present.all(axis=1)
+        if (not missing.any()):
+            return
+        edges = np.diff(np.concatenate(([0],missing.astype(np.int8),[0])))
+        for start,end in zip(np.flatnonzero(edges == 1),np.flatnonzero(edges == -1)):
+            self.gaps.append((float(times[start,0]),int(end - start),~present[start:end].all(axis=0)))
+
+    def add_lost(self,time,rows):
+        """ Adds a gap of rows(int) rows lost from every sensor, starting at time(float) in ms, such as a lost frame.
+        """
+        self.lost += rows
+        self.gaps.append((float(time),int(rows),np.ones(self.NO_SENSORS,dtype=bool)))
+
+    def loss_rate(self):
+        """ Returns the fraction of readings lost by each sensor as a numpy array.
+        """
+        total = self.received + self.lost
+        return(np.divide(self.lost,total,out=np.zeros(self.NO_SENSORS),where=(total > 0)))
+
+    def summary(self):
+        """ Returns a dictionary of the readings received and lost and the loss rate of each sensor, with the number of gaps and the longest gap in rows.
+        """
+        return({ 'received': self.received.tolist(),
+                 'lost': self.lost.tolist(),
+                 'lossRate': self.loss_rate().tolist(),
+                 'gaps': len(self.gaps),
+                 'longestGap': max([g[1] for g in self.gaps],default=0) })
+
+
+def fill_gaps(readings,times,present,method='drop',anchor=None):
+    """ Deals with the lost readings of a block, where readings(numpy array) has dimension [n][NO_SENSORS][3], times(numpy array) holds the time in ms of every row, received or not, with dimension [n][NO_SENSORS] and present(numpy array) of dimension [n][NO_SENSORS] is False for every lost reading. Returns a tuple (readings, times).
+        method(string) is 'drop' to remove only the rows with a lost reading, which keeps the sensors lined up, 'nan' to keep every row and return float readings with NaN for the lost ones, or 'interpolate' to fill each lost reading from the readings either side of it in time. Interpolated integer readings are rounded so the type is kept.
+        anchor(tuple) can give the last (readings, times) row of the previous block so a gap at the start of the block is interpolated from it.
+    """
+    if (method == 'drop'):
+        keep = present.all(axis=1)
+        return(readings[keep],times[keep])
+    if (method == 'nan'):
+        filled = readings.astype(np.result_type(readings.dtype,np.float32))
+        filled[~present] = np.nan
+        return(filled,times)
+    if (method != 'interpolate'):
+        raise ValueError("method must be 'drop', 'nan' or 'interpolate'")
+
+    filled = readings.copy()
+    for i in np.flatnonzero(~present.all(axis=0)):
+        known = present[:,i]
+        knownTimes = times[known,i]
+        knownValues = readings[known,i].astype(np.float64)
+        if (anchor is not None):
+            knownTimes = np.concatenate(([anchor[1][i]],knownTimes))
+            knownValues = np.concatenate((anchor[0][i][None].astype(np.float64),knownValues))
+        if (knownTimes.size == 0):
+            continue    # Nothing to interpolate from, the readings are left as they are
+        for j in range(0,3):
+            values = np.interp(times[~known,i],knownTimes,knownValues[:,j])
+            filled[~known,i,j] = np.rint(values) if (np.issubdtype(filled.dtype,np.integer)) else values
+    return(filled,times)
+
+
+# Binary frames sent by ADC_Serial_MultiV6. All fields are little-endian.
+#   Sync word      2 bytes   0xA5 0x5A
+#   Sequence       2 bytes   Frame counter, wraps at 65536
+#   Sensors        1 byte    Number of sensors in each row
+#   Rows           1 byte    Number of rows (samples of every sensor) in the frame
+#   Time start     4 bytes   micros() at the first reading of the frame
+#   Time end       4 bytes   micros() after the last reading of the frame
+#   Samples        10-bit readings in row order X1,Y1,Z1...XN,YN,ZN packed 4 to every 5 bytes
+#   Times          For every row, 2 bytes giving the us from the start of the previous row (0 for the first row)
+#                  then 1 byte for each sensor after the first giving the time from the previous sensor's reading
+#                  in ticks of TIME_TICK us, the resolution of micros() on a 16MHz Arduino
+#   CRC            2 bytes   CRC-16/CCITT-FALSE of every byte between the sync word and the CRC
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_HEADER = 14
+ROWS_PER_FRAME = 10
+TIME_TICK = 4
+
+
+def frame_size(NO_SENSORS,NO_ROWS=ROWS_PER_FRAME):
+    """ Returns the size in bytes of a binary frame holding NO_ROWS(int) rows of readings from NO_SENSORS(int) sensors.
+    """
+    NO_GROUPS = -(-(NO_ROWS * NO_SENSORS * 3) // 4)
+    return(FRAME_HEADER + (NO_GROUPS * 5) + (NO_ROWS * (NO_SENSORS + 1)) + 2)
+
+
+def _crc16_table():
+    table = np.zeros(256,dtype=np.uint16)
+    for i in range(0,256):
+        crc = i << 8
+        for j in range(0,8):
+            crc = ((crc << 1) ^ 0x1021) if (crc & 0x8000) else (crc << 1)
+        table[i] = crc & 0xFFFF
+    return(table)
+
+CRC_TABLE = _crc16_table()
+
+
+def crc16(data):
+    """ Returns the CRC-16/CCITT-FALSE of data(bytes) as calculated by the Arduino.
+    """
+    crc = 0xFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ int(CRC_TABLE[(crc >> 8) ^ byte])
+    return(crc)
+
+
+def crc16_rows(rows):
+    """ Returns the CRC-16/CCITT-FALSE of every row of the uint8 numpy array rows(numpy array) at once. The loop runs over the bytes of a row so the work for all rows is done together.
+    """
+    crc = np.full(rows.shape[0],0xFFFF,dtype=np.uint16)
+    for k in range(0,rows.shape[1]):
+        crc = (crc << 8) ^ CRC_TABLE[(crc >> 8) ^ rows[:,k]]
+    return(crc)
+
+
+def encode_frame(sequence,readings,times,timeEnd=None):
+    """ Builds a binary frame exactly as ADC_Serial_MultiV6 does. readings(list) is a list of rows, each a list of NO_SENSORS * 3 ADC values, times(list) holds the micros() time of each sensor's reading in every row and sequence(int) is the frame counter. timeEnd(int) is the micros() time after the last reading and is taken as the last reading time if not given.
+        Times are delta encoded as in the firmware, so the time between sensors is rounded to TIME_TICK us and limited to 255 ticks.
+    """
+    NO_ROWS = len(readings)
+    NO_SENSORS = len(readings[0]) // 3
+    values = [v for row in readings for v in row]
+    values += [0] * (-len(values) % 4)
+    timeStart = times[0][0]
+    if (timeEnd is None):
+        timeEnd = times[-1][-1]
+
+    frame = bytearray(FRAME_SYNC)
+    frame += (sequence & 0xFFFF).to_bytes(2,'little')
+    frame += bytes([NO_SENSORS,NO_ROWS])
+    frame += (timeStart & 0xFFFFFFFF).to_bytes(4,'little')
+    frame += (timeEnd & 0xFFFFFFFF).to_bytes(4,'little')
+    for i in range(0,len(values),4):
+        v0,v1,v2,v3 = values[i:i + 4]
+        frame += bytes([v0 & 0xFF,
+                        (v0 >> 8) | ((v1 & 0x3F) << 2),
+                        (v1 >> 6) | ((v2 & 0x0F) << 4),
+                        (v2 >> 4) | ((v3 & 0x03) << 6),
+                        v3 >> 2])
+    previous = timeStart
+    for row in times:
+        frame += ((row[0] - previous) & 0xFFFF).to_bytes(2,'little')
+        frame += bytes([min(((row[j] - row[j - 1]) % (1 << 32)) // TIME_TICK,255) for j in range(1,NO_SENSORS)])
+        previous = row[0]
+    frame += crc16(frame[2:]).to_bytes(2,'little')
+    return(bytes(frame))
+
+
+class FrameDecoder:
+    """ Decodes binary frames from ADC_Serial_MultiV6 with NO_SENSORS(int) sensors and NO_ROWS(int) rows per frame. Bytes are given to feed() in blocks of any size and every complete frame in the block is located, checked and unpacked in one pass using numpy, with any partial frame kept for the next block.
+        Bytes that are not part of a valid frame are skipped and counted in skippedBytes, and frames rejected by the CRC are counted in crcErrors. The time of every reading is rebuilt from the time deltas sent with it.
+    """
+
+    def __init__(self,NO_SENSORS,NO_ROWS=ROWS_PER_FRAME):
+        self.NO_SENSORS = NO_SENSORS
+        self.NO_ROWS = NO_ROWS
+        self.FRAME_SIZE = frame_size(NO_SENSORS,NO_ROWS)
+        self.buffer = bytearray()
+        self.frames = 0
+        self.crcErrors = 0
+        self.skippedBytes = 0
+        self.PACKED_SIZE = -(-(NO_ROWS * NO_SENSORS * 3) // 4) * 5
+        self.lastTime = None    # micros() of the last frame start, used to unwrap the 32 bit counter
+        self.elapsed = 0        # Microseconds from the first frame start to the last frame start
+
+    def feed(self,data):
+        """ Adds data(bytes) to the decoder and returns a tuple (readings, times, sequence) for every frame completed. readings is an int16 numpy array of dimension [n][NO_SENSORS][3], times holds the time of each sensor's reading in ms since the first frame with dimension [n][NO_SENSORS] and sequence holds the sequence number of each frame.
+        """
+        self.buffer += data
+        buf = np.frombuffer(bytes(self.buffer),dtype=np.uint8)
+        FRAME_SIZE = self.FRAME_SIZE
+        last = buf.size - FRAME_SIZE + 1   # Frames can only start before this position
+
+        if (last <= 0):
+            return(self._unpack(np.zeros((0,FRAME_SIZE),dtype=np.uint8)))
+
+        # Candidate frames start with the sync word and the expected sensor and row counts
+        candidates = np.flatnonzero((buf[:last] == FRAME_SYNC[0]) & (buf[1:last + 1] == FRAME_SYNC[1]))
+        candidates = candidates[(buf[candidates + 4] == self.NO_SENSORS) & (buf[candidates + 5] == self.NO_ROWS)]
+        frames = buf[candidates[:,None] + np.arange(FRAME_SIZE)]
+        received = frames[:,-2].astype(np.uint16) | (frames[:,-1].astype(np.uint16) << 8)
+        good = (crc16_rows(frames[:,2:-2]) == received)
+
+        # A valid frame hidden inside another valid frame is almost impossible but is dropped if found
+        starts = candidates[good]
+        if (np.any(np.diff(starts) < FRAME_SIZE)):
+            keep = np.zeros(starts.size,dtype=bool)
+            end = 0
+            for i in range(0,starts.size):
+                if (starts[i] >= end):
+                    keep[i] = True
+                    end = starts[i] + FRAME_SIZE
+            good[np.flatnonzero(good)[~keep]] = False
+            starts = starts[keep]
+
+        # Failed candidates that lie inside good frames are just sync words in the sample data
+        failed = candidates[~good]
+        inside = np.searchsorted(starts,failed,side='right') - 1
+        inFrame = (inside >= 0) & (failed < starts[np.maximum(inside,0)] + FRAME_SIZE) if starts.size else np.zeros(failed.size,dtype=bool)
+        self.crcErrors += int((~inFrame).sum())
+
+        consumed = max(int(starts[-1]) + FRAME_SIZE if starts.size else 0,last)
+        self.skippedBytes += consumed - (starts.size * FRAME_SIZE)
+        self.frames += starts.size
+        del self.buffer[:consumed]
+
+        return(self._unpack(frames[good]))
+
+    def _unpack(self,frames):
+        NO_SENSORS = self.NO_SENSORS
+        NO_READINGS = self.NO_ROWS * NO_SENSORS
+        k = frames.shape[0]
+
+        sequence = frames[:,2].astype(np.uint16) | (frames[:,3].astype(np.uint16) << 8)
+        timeStart = np.ascontiguousarray(frames[:,6:10]).view('<u4').reshape(k).astype(np.int64)
+
+        # Unpack 4 readings from every 5 bytes
+        packed = frames[:,FRAME_HEADER:FRAME_HEADER + self.PACKED_SIZE].reshape(k,self.PACKED_SIZE // 5,5).astype(np.uint16)
+        values = np.empty((k,packed.shape[1],4),dtype=np.int16)
+        values[:,:,0] = packed[:,:,0] | ((packed[:,:,1] & 0x03) << 8)
+        values[:,:,1] = (packed[:,:,1] >> 2) | ((packed[:,:,2] & 0x0F) << 6)
+        values[:,:,2] = (packed[:,:,2] >> 4) | ((packed[:,:,3] & 0x3F) << 4)
+        values[:,:,3] = (packed[:,:,3] >> 6) | (packed[:,:,4] << 2)
+        readings = values.reshape(k,values.shape[1] * 4)[:,:NO_READINGS * 3].reshape(-1,NO_SENSORS,3)
+
+        # Unwrap the micros() counter so times keep increasing past its 70 minute overflow
+        if (k > 0):
+            if (self.lastTime is None):
+                self.lastTime = int(timeStart[0])
+            steps = np.diff(np.concatenate(([self.lastTime],timeStart))) % (1 << 32)
+            start = self.elapsed + np.cumsum(steps)
+            self.elapsed = int(start[-1])
+            self.lastTime = int(timeStart[-1])
+        else:
+            start = np.zeros(0,dtype=np.int64)
+
+        # Rebuild the time of every reading: the rows are a running total of the row deltas from the frame
+        # start and each sensor a running total of the sensor deltas from the start of its row
+        timing = frames[:,FRAME_HEADER + self.PACKED_SIZE:-2].reshape(k,self.NO_ROWS,NO_SENSORS + 1)
+        deltas = np.empty((k,self.NO_ROWS,NO_SENSORS),dtype=np.int64)
+        deltas[:,:,0] = timing[:,:,0] | (timing[:,:,1].astype(np.int64) << 8)
+        deltas[:,:,1:] = timing[:,:,2:].astype(np.int64) * TIME_TICK
+        deltas[:,:,0] = np.cumsum(deltas[:,:,0],axis=1)
+        micros = start[:,None,None] + np.cumsum(deltas,axis=2)
+        return(readings,micros.reshape(-1,NO_SENSORS) / 1000,sequence)
+
+
+class FrameReader:
+    """ Wraps a serial port, given by the serialPort(serial.Serial) parameter, that receives binary frames from ADC_Serial_MultiV6 or ADC_Serial_MultiV7 with NO_SENSORS(int) sensors. The port is read in blocks in the same way as LineReader and decoded frames that are not yet needed are kept for the next call.
+        Frames missing from the sequence are counted in lostFrames and in the LossStats kept in loss. With fill(string) 'drop' only the frames received are returned, while 'nan' or 'interpolate' put back the rows of lost frames, as for fill_gaps, so the rows stay evenly spaced. Gaps of more than maxFill(int) frames, such as sampling being restarted, are never filled.
+        Times when the firmware stopped sampling between frames, as ADC_Serial_MultiV6 does while it transmits, are counted in pauses and their total length in ms is kept in pausedTime. A gapless stream from ADC_Serial_MultiV7 has no pauses.
+        If metrics(PipelineMetrics) is given each read is recorded as the serial_read stage and each decoded block as the decode stage, with CRC failures, skipped bytes and lost frames as its failures.
+    """
+
+    def __init__(self,serialPort,NO_SENSORS,NO_ROWS=ROWS_PER_FRAME,readSize=READ_SIZE,fill='drop',maxFill=100,metrics=None):
+        self.serialPort = serialPort
+        self.readSize = readSize
+        self.metrics = metrics
+        self.fillMethod = fill
+        self.maxFill = maxFill
+        self.decoder = FrameDecoder(NO_SENSORS,NO_ROWS)
+        self.loss = LossStats(NO_SENSORS)
+        self.pending = []
+        self.pendingFrames = 0
+        self.lastSequence = None
+        self.lostFrames = 0
+        self.lastRow = None     # Time of the last row of the last frame returned
+        self.lastReadings = None    # Last row returned and its times, used to fill a gap at the start of the next block
+        self.lastTimes = None
+        self.pauses = 0
+        self.pausedTime = 0.0
+        self.cancelled = False
+
+    def fill(self):
+        """ Reads one block from the serial port and decodes any frames it completes. Returns the number of frames decoded.
+        """
+        start = time.perf_counter()
+        waiting = self.serialPort.in_waiting
+        rawData = self.serialPort.read(min(max(waiting,self.decoder.FRAME_SIZE),self.readSize))
+        if (self.metrics is not None):
+            read = time.perf_counter()
+            self.metrics.record('serial_read',read - start,nbytes=len(rawData))
+            self.metrics.high_water('serial_in_waiting',waiting)
+            crcErrors,skippedBytes = self.decoder.crcErrors,self.decoder.skippedBytes
+
+        decoded = self.decoder.feed(rawData)
+        if (decoded[2].size > 0):
+            self.pending.append(decoded)
+            self.pendingFrames += decoded[2].size
+
+        if (self.metrics is not None):
+            self.metrics.record('decode',time.perf_counter() - read,items=decoded[2].size,nbytes=len(rawData))
+            self.metrics.fail('decode','CRC error',self.decoder.crcErrors - crcErrors)
+            self.metrics.fail('decode','bytes skipped',self.decoder.skippedBytes - skippedBytes)
+            self.metrics.high_water('frames_pending',self.pendingFrames)
+        return(decoded[2].size)
+
+    def cancel(self):
+        """ Stops a read waiting on the port from another thread, using cancel_read where the port has it. The read in progress, and any made after it, raise InterruptedError.
+        """
+        self.cancelled = True
+        if (hasattr(self.serialPort,'cancel_read')):
+            self.serialPort.cancel_read()
+
+    def read_frames(self,NO_FRAMES):
+        """ Blocks until NO_FRAMES(int) frames have been decoded and returns them as a tuple (readings, times, sequence) in the form returned by FrameDecoder.feed. If lost frames are filled, readings and times also hold their rows while sequence holds the frames received.
+        """
+        while (self.pendingFrames < NO_FRAMES):
+            if (self.cancelled):
+                raise InterruptedError('Read cancelled')
+            self.fill()
+
+        readings = np.concatenate([p[0] for p in self.pending])
+        times = np.concatenate([p[1] for p in self.pending])
+        sequence = np.concatenate([p[2] for p in self.pending])
+
+        # Keep any extra frames for the next call
+        NO_ROWS = self.decoder.NO_ROWS
+        self.pending = [(readings[NO_FRAMES * NO_ROWS:],times[NO_FRAMES * NO_ROWS:],sequence[NO_FRAMES:])]
+        self.pendingFrames -= NO_FRAMES
+        readings = readings[:NO_FRAMES * NO_ROWS]
+        times = times[:NO_FRAMES * NO_ROWS]
+        sequence = sequence[:NO_FRAMES]
+        if (sequence.size == 0):
+            return(readings,times,sequence)
+
+        # Any jump in the sequence numbers is a frame lost on the way
+        previous = int(sequence[0]) - 1 if (self.lastSequence is None) else self.lastSequence
+        steps = np.diff(np.concatenate(([previous],sequence.astype(np.int64)))) % 65536
+        lost = int(np.maximum(steps - 1,0).sum())
+        self.lostFrames += lost
+        self.lastSequence = int(sequence[-1])
+        if (self.metrics is not None):
+            self.metrics.fail('decode','frame lost',lost)
+        self._find_pauses(times[:,0].reshape(-1,NO_ROWS),steps)
+        self._count_lost(times,steps)
+
+        if (self.fillMethod != 'drop'):
+            readings,times = self._fill_lost(readings,times,steps)
+        self.lastReadings = readings[-1].copy()
+        self.lastTimes = times[-1].copy()
+        return(readings,times,sequence)
+
+    def _count_lost(self,times,steps):
+        # Each lost frame loses NO_ROWS rows from every sensor. The gap starts one row period after the row
+        # before it, found by sharing out the time between the rows either side of the gap.
+        NO_ROWS = self.decoder.NO_ROWS
+        self.loss.received += times.shape[0]
+        for i in np.flatnonzero(steps > 1):
+            rows = int(steps[i] - 1) * NO_ROWS
+            before = times[(i * NO_ROWS) - 1,0] if (i > 0) else self.lastTimes[0]
+            after = times[i * NO_ROWS,0]
+            self.loss.add_lost(before + ((after - before) / (rows + 1)),rows)
+
+    def _fill_lost(self,readings,times,steps):
+        # Each frame received is placed after the lost frames before it and the missing rows are filled in
+        NO_ROWS = self.decoder.NO_ROWS
+        steps = np.where(steps - 1 <= self.maxFill,steps,1)
+        if (self.lastTimes is None):
+            steps[0] = 1
+        slots = np.cumsum(steps) - 1
+        rows = (slots[:,None] * NO_ROWS + np.arange(NO_ROWS)).ravel()
+        total = (int(slots[-1]) + 1) * NO_ROWS
+        if (total == readings.shape[0]):
+            return(readings,times)
+
+        present = np.zeros((total,readings.shape[1]),dtype=bool)
+        present[rows] = True
+        filled = np.zeros((total,) + readings.shape[1:],dtype=readings.dtype)
+        filled[rows] = readings
+
+        # The times of the missing rows are spaced evenly between the rows either side of them
+        positions = rows
+        allTimes = np.empty((total,times.shape[1]))
+        if (self.lastTimes is not None):
+            positions = np.concatenate(([-1],rows))
+            times = np.concatenate((self.lastTimes[None],times))
+        for i in range(0,times.shape[1]):
+            allTimes[:,i] = np.interp(np.arange(total),positions,times[:,i])
+
+        anchor = None if (self.lastReadings is None) else (self.lastReadings,self.lastTimes)
+        return(fill_gaps(filled,allTimes,present,self.fillMethod,anchor))
+
+    def _find_pauses(self,rowTimes,steps):
+        # A frame that starts later than one row period after the previous frame ended, allowing for any lost
+        # frames in between, means sampling stopped for a while
+        NO_ROWS = rowTimes.shape[1]
+        if (NO_ROWS < 2):
+            return
+        period = np.median(np.diff(rowTimes,axis=1))
+        previous = np.concatenate(([np.nan if (self.lastRow is None) else self.lastRow],rowTimes[:-1,-1]))
+        expected = previous + (period * (((steps - 1) * NO_ROWS) + 1))
+        late = rowTimes[:,0] - expected
+        paused = late > (period / 2)
+        self.pauses += int(paused.sum())
+        self.pausedTime += float(late[paused].sum())
+        self.lastRow = float(rowTimes[-1,-1])
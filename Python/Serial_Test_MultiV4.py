@@ -5,6 +5,10 @@ import csv
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import fftpack
+from Signal_Processing import fft_magnitude, interpolate_columns
+from Capture_File import read_csv_array, csv_header, time_columns
+from Live_Plot import subplot_grid
+from Calibration import load_calibration, apply_calibration
 
 
 def collect_samples(serialPort,NO_SAMPLES,log):
@@ -50,32 +54,42 @@ def collect_samples(serialPort,NO_SAMPLES,log):
 def equalise_sample_numbers(np_samples,NO_SENSORS):
     """ A function that takes a numpy array, given by the np_samples(numpy aray) parameter, of samples collected from 3-Axis Accelerometers in the form [ID,X,Y,Z,Time] and returns a numpy area of samples where each ID value has the same amount of samples. Each unique ID relates to an associated sensor and the total number of sensors should be given with the parameter NO_SENSORS(int).
         The function operates by finding the sensor with the least samples and removing the last obtained samples from any other sensors that exceed this amount. This makes further data manipulation and sorting possible.
+        Samples to remove are marked in a single mask and the array is sliced once at the end, so the time taken grows with the number of samples rather than the number of samples multiplied by the number removed.
     """
-    
-    length = [] # Holds the amount of samples associated with each ID
-            
-    # Finds the number of samples for each sensor by checking ID and saves the amount in list
-    for i in range(1,NO_SENSORS+1):
-        length.append((np_samples[:,0] == i).sum())
-    
+    ids = np_samples[:,0]
+
+    # Finds the number of samples for each sensor by counting each ID
+    length = np.bincount(ids.astype(np.int64),minlength=NO_SENSORS + 1)[1:NO_SENSORS + 1]
+
     # Find the ID with the least samples and then calculate how many more samples each ID has
     # than the minimum, saving the difference in np_difference.
-    np_difference = np.array(length) - min(length)
+    np_difference = length - length.min()
+
+    keep = np.ones(ids.shape[0],dtype=bool)
 
-    # Removes the final values obtained for each sensor so that each sensor has the same
-    # number of samples.
+    # Marks the final values obtained for each sensor for removal so that each sensor has the same
+    # number of samples. Each sensor's samples are searched from the end of the samples still kept.
+    # A sample found directly before one that is removed is passed over, just as it always has been.
     for i in range(0,NO_SENSORS):
         if (np_difference[i] != 0):
-            equal = 0;
-            j = -1;
-            while(equal < np_difference[i]):
-                if (np_samples[j][0] == (i + 1)):
-                    np_samples = np.delete(np_samples,j,0)
+            rows = np.flatnonzero(ids == (i + 1))[::-1]
+            kept = np.cumsum(keep)
+            fromEnd = kept[-1] - kept[rows]   # 0 for the last sample still kept
+            equal = 0
+            nextCheck = 0
+            for row,position in zip(rows.tolist(),fromEnd.tolist()):
+                if (position >= nextCheck):
+                    keep[row] = False
                     equal += 1
-                j -= 1
-    return (np_samples)
+                    if (equal == np_difference[i]):
+                        break
+                    nextCheck = position + 2
+            if (equal < np_difference[i]):
+                raise IndexError('Not enough samples of sensor ' + str(i + 1) + ' to remove')
 
-def sort_samples(np_data,NO_SENSORS):
+    return (np_samples[keep])
+
+def sort_samples(np_data,NO_SENSORS,bySensor=False):
     """ Sorts a numpy array of 3-Axis Accelerometer data in the form [ID,X,Y,Z,Time] into an array of the following form:
         
                 Sensor 1      |Sensor 2      |.............|Sensor N
@@ -90,39 +104,36 @@ def sort_samples(np_data,NO_SENSORS):
     
     A numpy array should be provided to the parameter np_data(numpy array) in the specified form where each ID appears the same number of times. The equalise_sample_numbers can be used to ensure this.
     The number of sensor ID's should also be provided as an int using the NO_SENSORS(int) parameter.
+    If bySensor(bool) is True the same data is returned as a [samples][NO_SENSORS][4] array, so a sensor's X, Y, Z and Time can be indexed as [:,i,j] rather than by working out the column j+(4*i). The 2-D array is a view of this 3-D array so either form costs a single allocation.
     """
 
     # Sorts the data into columns as follows X1,Y1,Z1,Time,X2,Y2,Z2,Time etc.... Each row is then a sample.
-    # Sensor 1's samples are added to np_data_sorted first. The for loop then works through
-    # each sensor and appends its X,Y,Z,Time values in the next 4 columns of np_data_sorted.
-    np_data_sorted = np_data[:,[1,2,3,4]][np_data[:,0] == 1 ]
-    for i in range(2,NO_SENSORS+1):
-        np_temp = np_data[:,[1,2,3,4]][np_data[:,0] == i ]
-        np_data_sorted = np.concatenate((np_data_sorted,np_temp), axis=1)
-    
-    return (np_data_sorted)
-
-def ADC_to_g(np_data,NO_SENSORS):
-    """ A function that takes a numpy array of ADC values that relate to N 3-Axis Accelerometers in the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter. The ADC values are then converted into g values using predefined constants m and b calculated during calibration. The following conversion formula is used:
+    # A stable sort on the ID column groups each sensor's samples together while keeping them in the
+    # order they were received, then every sensor's nth sample is gathered into row n in one step.
+    ids = np_data[:,0].astype(np.int64)
+    order = np.argsort(ids,kind='stable')
+    counts = np.bincount(ids,minlength=NO_SENSORS + 1)
+    if (np.any(counts[1:NO_SENSORS + 1] != counts[1])):
+        raise ValueError('Each sensor must have the same number of samples, use equalise_sample_numbers first')
+    starts = np.cumsum(counts) - counts
+
+    rows = order[starts[1:NO_SENSORS + 1][None,:] + np.arange(counts[1])[:,None]]
+    np_data_sorted = np_data[rows[:,:,None],np.arange(1,5)]
+
+    if (bySensor):
+        return (np_data_sorted)
+    return (np_data_sorted.reshape(-1,NO_SENSORS * 4))
+
+def ADC_to_g(np_data,NO_SENSORS,profile=None):
+    """ A function that takes a numpy array of ADC values that relate to N 3-Axis Accelerometers in the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter. The ADC values are then converted into g values using the constants m and b calculated during calibration. The following conversion formula is used:
             g= ADC/m + b
         A numpy array of dimension [n][(N*4)] should therfore be provided with np_data(numpy array) and a numpy array of the same dimensions is returned.
+        The m and b values are taken from profile(CalibrationProfile), or from the newest calibration of the sensors fitted to the rig if no profile is given, as in Serial_Test_MultiV5.
     """
+    if (profile is None):
+        profile = load_calibration().profile()
 
-    # CONVERSION holds the m and b values calculated during calibration for the X,Y and Z axes of each Sensor.
-    CONVERSION = [ [102.006,101.074,103.061,-4.990,-5.025,-5.171],    # [ [mX1B,mY1B,mZ1B,bX1B,bY1B,bZ1B],
-                   [99.936,101.946,102.793,-5.084,-4.993,-5.001],     #   [mX2,mY2,mZ2,bX2,bY2,bZ2],
-                   [97.758,104.368,103.537,-5.211,-4.788,-5.229],    #   [mX3B,mY3B,mZ3B,bX3B,bY3B,bZ3B],
-                   [99.842,101.169,100.999,-5.062,-5.020,-5.124],     #   [mX4,mY4,mZ4,bX4,bY4,bZ4],
-                   [100.052,102.312,101.709,-5.087,-4.894,-5.126] ]   #   [mX5,mY5,mZ5,bX5,bY5,bZ5] ]
-                   
-    data = np_data.copy()
-
-    # The conversion array is used to transform the samples from ADC to g
-    for i in range(0,NO_SENSORS):
-        for j in range(0,3):
-            data[:,j+(4*i)] = ((data[:,j+(4*i)]/CONVERSION[i][j]) + CONVERSION[i][j+3])
-    
-    return(data)
+    return(apply_calibration(np_data,NO_SENSORS,profile.scale,profile.offset))
 
 def read_csv(path):
     """ Reads the csv file from the given path(string) and returns it as a list
@@ -139,23 +150,10 @@ def read_csv(path):
 def save_as_csv(path,data,NO_SENSORS):
     """ Takes a numpy array of 3-Axis Accelerometer data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter.
         A numpy array of dimension [n][(N*4)] should therfore be provided with np_data(numpy array).
-        The array is saved to a CSV file of path defined by the path(string) parameter and given a header as below. The NO_SENSORS should not exceed 5 due to the addition of the header.
+        The array is saved to a CSV file of path defined by the path(string) parameter and given a header made by csv_header.
     """
 
-    HEADER1 = [ ['Sensor 1'],
-                ['X','Y','Z','Time/ms'] ]
-    HEADER2 = [ ['Sensor 1',' ',' ',' ','Sensor 2'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
-    HEADER3 = [ ['Sensor 1',' ',' ',' ','Sensor 2',' ',' ',' ','Sensor 3'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
-    HEADER4 = [ ['Sensor 1',' ',' ',' ','Sensor 2',' ',' ',' ','Sensor 3',' ',' ',' ','Sensor 4'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
-    HEADER5 = [ ['Sensor 1',' ',' ',' ','Sensor 2',' ',' ',' ','Sensor 3',' ',' ',' ','Sensor 4',' ',' ',' ','Sensor 5'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
-
-    HEADERS = [HEADER1,HEADER2,HEADER3,HEADER4,HEADER5]
-
-    HEADER = HEADERS[NO_SENSORS - 1]
+    HEADER = csv_header(NO_SENSORS)
 
     # The  data is saved as a CSV file using the given path
     with open(path, 'w') as csv_file:
@@ -198,9 +196,10 @@ def plot_singlefig(data,NO_SENSORS,dataSelection):
     
     # Plots graphs for each sensor on 1 figure
     plt.figure(1)
+    gridRows,gridColumns = subplot_grid(NO_SENSORS)
     for i in range(0,NO_SENSORS):
-        # The figure is seperated into subplots using the parameter. 231 means 2 rows, 3 columns, subplot 1
-        plt.subplot(231 + i)
+        # The figure is seperated into a grid of subplots with one for each sensor
+        plt.subplot(gridRows,gridColumns,i + 1)
         plt.title('Sensor ' + str(i + 1))
         plt.plot(data[:,(3 + (4 * i))],data[:,(0 + (4 * i))],label='X Axis')
         plt.plot(data[:,(3 + (4 * i))],data[:,(1 + (4 * i))],label='Y Axis')
@@ -284,8 +283,8 @@ def main():
         np_data_g = ADC_to_g(np_data_ADC,NO_SENSORS)
         
         # Convert the ms to s before saving to the csv
-        np_data_g[:,[3,7,11,15,19]] = np_data_g[:,[3,7,11,15,19]]/1000
-        np_data_ADC[:,[3,7,11,15,19]] = np_data_ADC[:,[3,7,11,15,19]]/1000
+        np_data_g[:,time_columns(NO_SENSORS)] /= 1000
+        np_data_ADC[:,time_columns(NO_SENSORS)] /= 1000
 
         # Save the given data to Excel CSV
         save_as_csv(currentPath,np_data_g,NO_SENSORS)
@@ -317,56 +316,26 @@ def main():
 
     if (modeSelect == '1'):
         
-        # Read out the data from scecified file
-        saved_data = read_csv(currentPath)
+        # Read a portion of data from the specified file, skipping the header, straight into a float32 numpy array for manipulation
+        np_saved_data = read_csv_array(currentPath,rows=(0,1800))
         
-        # Remove the header, select a portion of data and convert the data to a float32 numpy array for manipulation
-        np_saved_data = np.array(saved_data[2:1802]).astype(np.float32)
-        
-        # Create a copy of the data for interpolation
-        np_interpol_data = np_saved_data.copy()
-        
-        # Interpolate the data
-        for i in range(0,NO_SENSORS):
-            # Create a time array fopr each sensor that has the same start and end time as the data but with a constant interval
-            np_temp = np.linspace(0,np_interpol_data[-1][3+(i*4)],np_interpol_data.shape[0])
-            for j in range(0,3):
-                # Use the constant interval time data to interpolate the corresponding x,y and z values from the original data
-                np_interpol_data[:,j+(4*i)] = np.interp(np_temp,np_interpol_data[:,3+(i*4)],np_interpol_data[:,j+(i*4)])
-            # Replace the original sample times with the constant interval sample times for each sensor
-            np_interpol_data[:,3+(i*4)] = np_temp
+        # Interpolate the x,y and z values of every sensor at once onto times with a constant interval, which for
+        # each sensor have the same start and end time as the data
+        np_interpol_data = interpolate_columns(np_saved_data,NO_SENSORS,np.linspace(0,np_saved_data[-1,3::4],np_saved_data.shape[0]))
         
         # Save the interpolated data to CSV
         save_as_csv(pathName+'(Interpolated).csv',np_interpol_data,NO_SENSORS)
         
-        # Create a copy of the interpolated data for FFT
-        np_fft_data = np_interpol_data.copy()
-        
-        # Perform an FFT on the X,Y and Z values for each sensor and save the magnitude
-        for i in range(0,NO_SENSORS):
-            for j in range(0,3):
-                np_fft_data[:,j+(4*i)] = abs(fftpack.fft(np_fft_data[:,j+(4*i)]))
-        
-        # Get number of samples
-        N = np_fft_data.shape[0]
-        # Get the time interval for each sensor
-        dt = np_fft_data[[1],[3,7,11,15,19]] - np_fft_data[[0],[3,7,11,15,19]]
-        print(dt)
-        # Find the smapling frequency for each sensor
-        fs = 1/dt
-
-        # Produce the frequency data corresponding to the FFT
-        for i in range(0,NO_SENSORS):
-            np_fft_data[:,3+(i*4)] = fftpack.fftfreq(N) * fs[i]
-
-        # Remove values above the Nyquist Frequency N/2
-        np_ffthalf_data = np_fft_data[:int(N/2)]
+        # Perform one FFT on the X,Y and Z values of every sensor and keep the magnitude below the Nyquist Frequency,
+        # with the frequency of each row in place of the time column
+        np_ffthalf_data = fft_magnitude(np_interpol_data,NO_SENSORS)
 
         # Plot the FFT values
         plt.figure(1)
+        gridRows,gridColumns = subplot_grid(NO_SENSORS)
         for i in range(0,NO_SENSORS):
-            # The figure is seperated into subplots using the parameter. 231 means 2 rows, 3 columns, subplot 1
-            plt.subplot(231 + i)
+            # The figure is seperated into a grid of subplots with one for each sensor
+            plt.subplot(gridRows,gridColumns,i + 1)
             plt.title('Sensor ' + str(i + 1))
             plt.plot(np_ffthalf_data[:,(3 + (4 * i))],np_ffthalf_data[:,(0 + (4 * i))],label='X Axis')
             plt.plot(np_ffthalf_data[:,(3 + (4 * i))],np_ffthalf_data[:,(1 + (4 * i))],label='Y Axis')
@@ -392,7 +361,8 @@ def main():
             elif (selection == '2'):
                 finish = '1'
 
-main()
+if __name__ == '__main__':
+    main()
 
 if(0):
     # Number of samplepoints
@@ -2,102 +2,58 @@ import serial #Import Serial Library
 import time
 import datetime
 import csv
+import os
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import fftpack
+from Calibration import load_calibration, recalibration, apply_calibration
+from Capture_File import CSVWriter, CapturePyramid, save_capture, open_capture, read_csv_array, csv_header, time_columns
+from Capture_Store import CaptureStore
+from Live_Plot import LivePlot, subplot_grid
+from Pipeline_Metrics import PipelineMetrics
+from Serial_Acquisition import AcquisitionThread, ConsumerThread
+from Signal_Processing import fft_magnitude, welch_psd
+from Serial_Protocol import ROWS_PER_FRAME
 
 
-def collect_samples(serialPort,NO_SENSORS,NO_SAMPLES,log):
-    """ Saves samples collected from 3-Axis Accelerometers. Samples should be recieved in form (ID X Y Z Time /r/n) with a space to seperate the data. Invalid data is rejected and any samples lost this way are recorded and displayed to the user once the function finishes.
-        All samples are collected from the port defined by the serialPort(string) parameter and the function will continue until it saves a number of samples defined by the NO_SAMPLES(int) parameter.
-        All samples will be appended to the list specified by the log(list) parameter. This should either be an empty list or a list with 6 columns.
-    """
-    run = '1'
-    badSamples = 0
-    count = 1
-    log_temp = []
-    temp = [0] * 20
-    NO_FIELDS = (NO_SENSORS * 3) + 1
-    
-    while (run == '1'):
-        # If the input buffer is not empty read the data out into rawData using \n as a delimiter.
-        if (serialPort.inWaiting()>0):
-            rawData = serialPort.readline()
-            print(rawData)
-            
-            # If invalid data is recieved this prevents program crash
-            try:
-                # Decode the bytes into a string
-                data = rawData.decode()
-                
-                # Split x, y, z and newline values into a list
-                if (count >= (NO_SAMPLES + 1)):
-                    endTime_temp = data.split(" ", 2)
-                    if (len(endTime_temp) == 2 and '' not in endTime_temp):
-                        endTime = int(endTime_temp[0])
-                    else:
-                        endTime = 780
-                        print('Time not recieved')
-                    print('Lost Samples: ' + str(badSamples))
-                    run = '0'
-                else:
-                    data_readings = data.split(" ", NO_FIELDS)
-                    print(data_readings)
-                    
-                    # A correct sample should contain 16 values and not include null and so this is used
-                    # to validate the data and record any samples that are discarded in this way
-                    if (len(data_readings) == NO_FIELDS and '' not in data_readings):
-                        # Discard newline characters before saving data
-                        int_data_readings = list(map(int,data_readings[:(NO_FIELDS - 1)]))
-                        log_temp.append(int_data_readings)
-                    else:
-                        badSamples += 1
-            except:
-                print('Invalid data recieved')
-            
-            count += 1
-
-    samplingPeriod = (endTime/NO_SAMPLES)/NO_SENSORS
-    timeStamp = 0.0
-
-    for i in range(0,len(log_temp)):
-        for j in range(0,NO_SENSORS):
-            temp[0+(j*4)] = log_temp[i][0+(j*3)]
-            temp[1+(j*4)] = log_temp[i][1+(j*3)]
-            temp[2+(j*4)] = log_temp[i][2+(j*3)]
-            temp[3+(j*4)] = timeStamp
-            timeStamp += samplingPeriod
-        log.append(temp.copy())
-
 def equalise_sample_numbers(np_samples,NO_SENSORS):
     """ A function that takes a numpy array, given by the np_samples(numpy aray) parameter, of samples collected from 3-Axis Accelerometers in the form [ID,X,Y,Z,Time] and returns a numpy area of samples where each ID value has the same amount of samples. Each unique ID relates to an associated sensor and the total number of sensors should be given with the parameter NO_SENSORS(int).
         The function operates by finding the sensor with the least samples and removing the last obtained samples from any other sensors that exceed this amount. This makes further data manipulation and sorting possible.
+        Samples to remove are marked in a single mask and the array is sliced once at the end, so the time taken grows with the number of samples rather than the number of samples multiplied by the number removed.
     """
-    
-    length = [] # Holds the amount of samples associated with each ID
-            
-    # Finds the number of samples for each sensor by checking ID and saves the amount in list
-    for i in range(1,NO_SENSORS+1):
-        length.append((np_samples[:,0] == i).sum())
-    
+    ids = np_samples[:,0]
+
+    # Finds the number of samples for each sensor by counting each ID
+    length = np.bincount(ids.astype(np.int64),minlength=NO_SENSORS + 1)[1:NO_SENSORS + 1]
+
     # Find the ID with the least samples and then calculate how many more samples each ID has
     # than the minimum, saving the difference in np_difference.
-    np_difference = np.array(length) - min(length)
+    np_difference = length - length.min()
+
+    keep = np.ones(ids.shape[0],dtype=bool)
 
-    # Removes the final values obtained for each sensor so that each sensor has the same
-    # number of samples.
+    # Marks the final values obtained for each sensor for removal so that each sensor has the same
+    # number of samples. Each sensor's samples are searched from the end of the samples still kept.
+    # A sample found directly before one that is removed is passed over, just as it always has been.
     for i in range(0,NO_SENSORS):
         if (np_difference[i] != 0):
-            equal = 0;
-            j = -1;
-            while(equal < np_difference[i]):
-                if (np_samples[j][0] == (i + 1)):
-                    np_samples = np.delete(np_samples,j,0)
+            rows = np.flatnonzero(ids == (i + 1))[::-1]
+            kept = np.cumsum(keep)
+            fromEnd = kept[-1] - kept[rows]   # 0 for the last sample still kept
+            equal = 0
+            nextCheck = 0
+            for row,position in zip(rows.tolist(),fromEnd.tolist()):
+                if (position >= nextCheck):
+                    keep[row] = False
                     equal += 1
-                j -= 1
-    return (np_samples)
+                    if (equal == np_difference[i]):
+                        break
+                    nextCheck = position + 2
+            if (equal < np_difference[i]):
+                raise IndexError('Not enough samples of sensor ' + str(i + 1) + ' to remove')
 
-def sort_samples(np_data,NO_SENSORS):
+    return (np_samples[keep])
+
+def sort_samples(np_data,NO_SENSORS,bySensor=False):
     """ Sorts a numpy array of 3-Axis Accelerometer data in the form [ID,X,Y,Z,Time] into an array of the following form:
         
                 Sensor 1      |Sensor 2      |.............|Sensor N
@@ -112,39 +68,51 @@ def sort_samples(np_data,NO_SENSORS):
     
     A numpy array should be provided to the parameter np_data(numpy array) in the specified form where each ID appears the same number of times. The equalise_sample_numbers can be used to ensure this.
     The number of sensor ID's should also be provided as an int using the NO_SENSORS(int) parameter.
+    If bySensor(bool) is True the same data is returned as a [samples][NO_SENSORS][4] array, so a sensor's X, Y, Z and Time can be indexed as [:,i,j] rather than by working out the column j+(4*i). The 2-D array is a view of this 3-D array so either form costs a single allocation.
     """
 
     # Sorts the data into columns as follows X1,Y1,Z1,Time,X2,Y2,Z2,Time etc.... Each row is then a sample.
-    # Sensor 1's samples are added to np_data_sorted first. The for loop then works through
-    # each sensor and appends its X,Y,Z,Time values in the next 4 columns of np_data_sorted.
-    np_data_sorted = np_data[:,[1,2,3,4]][np_data[:,0] == 1 ]
-    for i in range(2,NO_SENSORS+1):
-        np_temp = np_data[:,[1,2,3,4]][np_data[:,0] == i ]
-        np_data_sorted = np.concatenate((np_data_sorted,np_temp), axis=1)
-    
-    return (np_data_sorted)
-
-def ADC_to_g(np_data,NO_SENSORS):
-    """ A function that takes a numpy array of ADC values that relate to N 3-Axis Accelerometers in the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter. The ADC values are then converted into g values using predefined constants m and b calculated during calibration. The following conversion formula is used:
+    # A stable sort on the ID column groups each sensor's samples together while keeping them in the
+    # order they were received, then every sensor's nth sample is gathered into row n in one step.
+    ids = np_data[:,0].astype(np.int64)
+    order = np.argsort(ids,kind='stable')
+    counts = np.bincount(ids,minlength=NO_SENSORS + 1)
+    if (np.any(counts[1:NO_SENSORS + 1] != counts[1])):
+        raise ValueError('Each sensor must have the same number of samples, use equalise_sample_numbers first')
+    starts = np.cumsum(counts) - counts
+
+    rows = order[starts[1:NO_SENSORS + 1][None,:] + np.arange(counts[1])[:,None]]
+    np_data_sorted = np_data[rows[:,:,None],np.arange(1,5)]
+
+    if (bySensor):
+        return (np_data_sorted)
+    return (np_data_sorted.reshape(-1,NO_SENSORS * 4))
+
+def ADC_to_g(np_data,NO_SENSORS,out=None,profile=None):
+    """ A function that takes a numpy array of ADC values that relate to N 3-Axis Accelerometers in the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter. The ADC values are then converted into g values using the constants m and b calculated during calibration. The following conversion formula is used:
             g= ADC/m + b
         A numpy array of dimension [n][(N*4)] should therfore be provided with np_data(numpy array) and a numpy array of the same dimensions is returned.
+        The readings held by a CaptureStore, a numpy array of dimension [n][N][3] with no time columns, may also be given directly and a float32 array of the same dimensions is returned.
+        If out(numpy array) is given the g values are written into it and it is returned instead of a new array. out should be C-contiguous and may be np_data itself to convert a large float array in place, or a slice of a preallocated array when converting a capture block by block as it streams in.
+        The m and b values are taken from profile(CalibrationProfile), or from the newest calibration of the sensors fitted to the rig, RIG_SENSORS, if no profile is given. Profiles are cached by the Calibration module so the calibration file is only read once. A profile must be given for more sensors than RIG_SENSORS holds, otherwise a ValueError names the sensors without a calibration.
     """
+    if (profile is None):
+        profile = load_calibration().profile()
 
-    # CONVERSION holds the m and b values calculated during calibration for the X,Y and Z axes of each Sensor.
-    CONVERSION = [ [102.006,101.074,103.061,-4.990,-5.025,-5.171],    # [ [mX1B,mY1B,mZ1B,bX1B,bY1B,bZ1B],
-                   [99.936,101.946,102.793,-5.084,-4.993,-5.001],     #   [mX2,mY2,mZ2,bX2,bY2,bZ2],
-                   [97.758,104.368,103.537,-5.211,-4.788,-5.229],    #   [mX3B,mY3B,mZ3B,bX3B,bY3B,bZ3B],
-                   [99.842,101.169,100.999,-5.062,-5.020,-5.124],     #   [mX4,mY4,mZ4,bX4,bY4,bZ4],
-                   [100.052,102.312,101.709,-5.087,-4.894,-5.126] ]   #   [mX5,mY5,mZ5,bX5,bY5,bZ5] ]
-                   
-    data = np_data.copy()
+    return(apply_calibration(np_data,NO_SENSORS,profile.scale,profile.offset,out))
 
-    # The conversion array is used to transform the samples from ADC to g
-    for i in range(0,NO_SENSORS):
-        for j in range(0,3):
-            data[:,j+(4*i)] = ((data[:,j+(4*i)]/CONVERSION[i][j]) + CONVERSION[i][j+3])
-    
-    return(data)
+def recalibrate_csv(paths,NO_SENSORS,oldProfile,newProfile):
+    """ Converts archived captures, saved by save_as_csv in g using oldProfile(CalibrationProfile), to newProfile(CalibrationProfile) in one call. Every file in paths(list) is read, recalibrated and saved next to the original with (Recalibrated) added to its name. The list of new paths is returned.
+    """
+    scale,offset = recalibration(oldProfile,newProfile)
+    newPaths = []
+    for path in paths:
+        np_data = read_csv_array(path)
+        apply_calibration(np_data,NO_SENSORS,scale,offset,out=np_data)
+        newPath = os.path.splitext(path)[0] + '(Recalibrated).csv'
+        save_as_csv(newPath,np_data,NO_SENSORS)
+        newPaths.append(newPath)
+    return(newPaths)
 
 def read_csv(path):
     """ Reads the csv file from the given path(string) and returns it as a list
@@ -161,35 +129,43 @@ def read_csv(path):
 def save_as_csv(path,data,NO_SENSORS):
     """ Takes a numpy array of 3-Axis Accelerometer data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter.
         A numpy array of dimension [n][(N*4)] should therfore be provided with np_data(numpy array).
-        The array is saved to a CSV file of path defined by the path(string) parameter and given a header as below. The NO_SENSORS should not exceed 5 due to the addition of the header.
+        The array is saved to a CSV file of path defined by the path(string) parameter and given a header made by csv_header.
+        To save samples while they are still being collected use a CSVWriter instead.
     """
 
-    HEADER1 = [ ['Sensor 1'],
-                ['X','Y','Z','Time/ms'] ]
-    HEADER2 = [ ['Sensor 1',' ',' ',' ','Sensor 2'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
-    HEADER3 = [ ['Sensor 1',' ',' ',' ','Sensor 2',' ',' ',' ','Sensor 3'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
-    HEADER4 = [ ['Sensor 1',' ',' ',' ','Sensor 2',' ',' ',' ','Sensor 3',' ',' ',' ','Sensor 4'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
-    HEADER5 = [ ['Sensor 1',' ',' ',' ','Sensor 2',' ',' ',' ','Sensor 3',' ',' ',' ','Sensor 4',' ',' ',' ','Sensor 5'],
-                ['X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms','X','Y','Z','Time/ms'] ]
+    # The  data is saved as a CSV file using the given path
+    with CSVWriter(path,csv_header(NO_SENSORS)) as csv_write:
+        csv_write.write(data)
+
+def plot_sensor(data,NO_SENSORS,i,pyramid=None):
+    """ Plots the X, Y and Z axes of sensor i(int), counted from 0, on the current graph, with data(numpy array) of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] and N defined by the NO_SENSORS(int) parameter.
+        If pyramid(CapturePyramid) is given the data is read from its capture instead. Only the min/max envelope that fits the visible range is drawn and it is read again whenever the graph is zoomed or panned, so captures of any length stay quick to explore.
+    """
+    labels = ['X Axis','Y Axis','Z Axis']
+    if (pyramid is None):
+        for j in range(0,3):
+            plt.plot(data[:,(3 + (4 * i))],data[:,(j + (4 * i))],label=labels[j])
+        return
 
-    HEADERS = [HEADER1,HEADER2,HEADER3,HEADER4,HEADER5]
+    axes = plt.gca()
+    lines = [axes.plot([],[],label=labels[j])[0] for j in range(0,3)]
+    columns = [(4 * i),(1 + (4 * i)),(2 + (4 * i)),(3 + (4 * i))]
 
-    HEADER = HEADERS[NO_SENSORS - 1]
+    def update(axes):
+        start,stop = axes.get_xlim()
+        envelope = pyramid.envelope(start,stop,int(axes.bbox.width),columns)
+        for j in range(0,3):
+            lines[j].set_data(envelope[:,3],envelope[:,j])
 
-    # The  data is saved as a CSV file using the given path
-    with open(path, 'w') as csv_file:
-        csv_write = csv.writer(csv_file, dialect='excel')
-        csv_write.writerows(HEADER)
-        csv_write.writerows(data)
+    axes.callbacks.connect('xlim_changed',update)
+    axes.set_xlim(*pyramid.time_range(columns[3]))
 
-def plot_multifig(data,NO_SENSORS,dataSelection):
+def plot_multifig(data,NO_SENSORS,dataSelection,pyramid=None):
     """ Plots 3-Axis accelerometer data on seperate graphs per sensor each in a seperate figure. The next figure will appear once the first figure is closed.
         Takes a numpy array of 3-Axis Accelerometer data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter.
         A numpy array of dimension [n][(N*4)] should therfore be provided with data(numpy array).
         The dataSeelction parameter should be 0 or 1 and sets the Y axis to either 0-1024 ADC or -3-3 g respectively.
+        A CapturePyramid of the same data can be given with pyramid(CapturePyramid) to draw long captures quickly, as for plot_sensor.
         """
         
     # Axis options
@@ -199,20 +175,19 @@ def plot_multifig(data,NO_SENSORS,dataSelection):
     for i in range(0,NO_SENSORS):
         plt.figure(i + 1)
         plt.title('Sensor ' + str(i + 1))
-        plt.plot(data[:,(3 + (4 * i))],data[:,(0 + (4 * i))],label='X Axis')
-        plt.plot(data[:,(3 + (4 * i))],data[:,(1 + (4 * i))],label='Y Axis')
-        plt.plot(data[:,(3 + (4 * i))],data[:,(2 + (4 * i))],label='Z Axis')
+        plot_sensor(data,NO_SENSORS,i,pyramid)
         plt.ylim(yAxisLimits[dataSelection][0],yAxisLimits[dataSelection][1])
         plt.xlabel('Time/s')
         plt.ylabel('Acceleration/g')
         plt.legend()
         plt.show()
     
-def plot_singlefig(data,NO_SENSORS,dataSelection):
+def plot_singlefig(data,NO_SENSORS,dataSelection,pyramid=None):
     """ Plots 3-Axis accelerometer data on seperate graphs per sensor but displays them all in one figure.
         Takes a numpy array of 3-Axis Accelerometer data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with any number of rows that relate to the number of samples for each sensor and N defined by the NO_SENSORS(int) parameter.
         A numpy array of dimension [n][(N*4)] should therfore be provided with data(numpy array).
         The dataSeelction parameter should be 0 or 1 and sets the Y axis to either 0-1024 ADC or -3-3 g respectively.
+        A CapturePyramid of the same data can be given with pyramid(CapturePyramid) to draw long captures quickly, as for plot_sensor.
         """
     
     # Axis options
@@ -220,13 +195,12 @@ def plot_singlefig(data,NO_SENSORS,dataSelection):
     
     # Plots graphs for each sensor on 1 figure
     plt.figure(1)
+    gridRows,gridColumns = subplot_grid(NO_SENSORS)
     for i in range(0,NO_SENSORS):
-        # The figure is seperated into subplots using the parameter. 231 means 2 rows, 3 columns, subplot 1
-        plt.subplot(231 + i)
+        # The figure is seperated into a grid of subplots with one for each sensor
+        plt.subplot(gridRows,gridColumns,i + 1)
         plt.title('Sensor ' + str(i + 1))
-        plt.plot(data[:,(3 + (4 * i))],data[:,(0 + (4 * i))],label='X Axis')
-        plt.plot(data[:,(3 + (4 * i))],data[:,(1 + (4 * i))],label='Y Axis')
-        plt.plot(data[:,(3 + (4 * i))],data[:,(2 + (4 * i))],label='Z Axis')
+        plot_sensor(data,NO_SENSORS,i,pyramid)
         plt.ylim(yAxisLimits[dataSelection][0],yAxisLimits[dataSelection][1])
         plt.xlabel('Time/s')
         plt.ylabel('Acceleration/g')
@@ -240,14 +214,29 @@ def main():
     NO_SENSORS = 5
     # At 250 1 cycle is around 0.78ms
     SAMPLING_CYCLES = 2
+    # Set to True when the Arduino runs ADC_Serial_MultiV6 or V7, which send binary frames instead of text
+    BINARY_FRAMES = False
+    # Captures are saved as .cap files. Set to True to save a CSV copy for Excel as well.
+    SAVE_CSV = True
+    # Lost readings are 'drop'ped, 'interpolate'd from the readings either side or kept as 'nan', which needs
+    # data_log to hold floats
+    GAP_FILL = 'interpolate'
+    # Set to True to watch the samples in a live figure while they are collected
+    LIVE_PLOT = False
+    # Set to True to save the pipeline metrics next to the capture as a (Metrics) JSON file and print a summary.
+    # Set METRICS_PORT to a port number to read them from http://127.0.0.1:<port> while sampling as well.
+    SAVE_METRICS = False
+    METRICS_PORT = None
     
 
-    data_log = []
+    # Samples are parsed straight into preallocated storage for the whole run
+    data_log = CaptureStore(NO_SENSORS,NO_SAMPLES,SAMPLING_CYCLES)
+    # The g values are stored in the column layout so data_g.as_columns needs no copy
+    data_g = CaptureStore(NO_SENSORS,NO_SAMPLES,SAMPLING_CYCLES,dtype=np.float32,columns=True)
     saved_data = []
 
     port = '/dev/tty.usbserial-DN018OOF'
     connected = '0'
-    sample = '1'
     finish = '0'
     modeSelect = '0'
     
@@ -261,6 +250,7 @@ def main():
     
     savePath = pathName
     samplePath = savePath + '.csv'
+    capturePath = savePath + '.cap'
     
 
     modeSelect = input('Please select the mode:\n0:Collect Samples\n1:Manipulate Data\n')
@@ -283,32 +273,71 @@ def main():
         time.sleep(6)   # Required for the XBee's to initialise
         
         input('Please press a button to begin sampling')
-        arduinoSerial.write(b'S')   # Send 'S' to tell the arduino to start taking/sending samples
-
-        # Sampling loop
-        count = 1
-        while (sample == '1'):
-            collect_samples(arduinoSerial,NO_SENSORS,NO_SAMPLES,data_log)
-            if (count >= SAMPLING_CYCLES):
-                sample = '0' # Sampling finishes after NO_SAMPLES have been taken
-            count += 1
-
-        arduinoSerial.write(b'S') # Send 2nd 'S' to tell the Arduino to stop
-        arduinoSerial.close()
-
-        # Converts the samples to float for conversion
-        np_data_ADC = np.array(data_log).astype(np.float32)
+        metrics = PipelineMetrics() if (SAVE_METRICS or METRICS_PORT is not None) else None
+        # The CSV copy is written a cycle at a time during the run, with the time in s
+        csv_log = CSVWriter(samplePath,csv_header(NO_SENSORS),metrics=metrics) if (SAVE_CSV) else None
+
+        def convert(readings,timeStamps):
+            readings_g = ADC_to_g(readings,NO_SENSORS)
+            data_g.append(readings_g,timeStamps)
+            if (csv_log is not None):
+                csv_log.append(readings_g,timeStamps/1000)
+
+        # The acquisition thread owns the port from here on. It sends the start and stop commands and
+        # keeps reading while the storage and conversion threads copy each cycle into data_log and data_g.
+        acquisition = AcquisitionThread(arduinoSerial,NO_SENSORS,NO_SAMPLES,BINARY_FRAMES,SAMPLING_CYCLES,GAP_FILL,metrics)
+        # The capture is never dropped to keep up, only the live plot skips blocks if it falls behind
+        storage = ConsumerThread(acquisition.subscribe(drop=False,name='storage'),data_log.append,metrics,'storage')
+        conversion = ConsumerThread(acquisition.subscribe(drop=False,name='conversion'),convert,metrics,'conversion')
+        live = LivePlot(acquisition.subscribe(name='live plot'),NO_SENSORS,convert=lambda readings: ADC_to_g(readings,NO_SENSORS)) if (LIVE_PLOT) else None
+        try:
+            if (METRICS_PORT is not None):
+                metrics.serve(METRICS_PORT)
+            storage.start()
+            conversion.start()
+            acquisition.start()
+            if (live is not None):
+                live.run()  # The live figure is drawn from the main thread until sampling finishes
+            acquisition.join()
+            storage.join()
+            conversion.join()
+        finally:
+            if (acquisition.is_alive()):
+                acquisition.stop()
+                acquisition.join()
+            if (csv_log is not None):
+                csv_log.close()
+            # The metrics are saved even if sampling failed, which is when they are most needed
+            if (metrics is not None):
+                metrics.stop_serving()
+                metrics.dump(savePath + '(Metrics).json')
+
+        stats = acquisition.stats()
+        print('Lost Samples: ' + str(stats['badSamples'] + (stats['lostFrames'] * ROWS_PER_FRAME)) + ', Invalid data recieved: ' + str(stats['invalidSamples']))
+        print('Lost readings per sensor: ' + str(stats['loss']['lost']) + ' in ' + str(stats['loss']['gaps']) + ' gaps')
+        for subscription in stats['subscriptions']:
+            print(subscription['name'].capitalize() + ' overruns: ' + str(subscription['overruns']) + ', Max queue depth: ' + str(subscription['maxDepth']))
+        if (metrics is not None):
+            print(metrics.report())
+        if (BINARY_FRAMES):
+            print('Sampling paused ' + str(stats['pauses']) + ' times for ' + str(round(stats['pausedTime'])) + 'ms')
+
+        # Converts the ADC samples to float in the column layout, which takes a copy. The g values were converted as
+        # they arrived and are already in the column layout, so np_data_g is a view of data_g.
+        np_data_ADC = data_log.as_columns(np.float32)
         print(np_data_ADC)
-
-        # Converts the samples from ADC to g
-        np_data_g = ADC_to_g(np_data_ADC,NO_SENSORS)
+        np_data_g = data_g.as_columns(np.float32)
         
         # Convert the ms to s before saving to the csv
-        np_data_g[:,[3,7,11,15,19]] = np_data_g[:,[3,7,11,15,19]]/1000
-        np_data_ADC[:,[3,7,11,15,19]] = np_data_ADC[:,[3,7,11,15,19]]/1000
+        np_data_g[:,time_columns(NO_SENSORS)] /= 1000
+        np_data_ADC[:,time_columns(NO_SENSORS)] /= 1000
 
-        # Save the given data to Excel CSV
-        save_as_csv(samplePath,np_data_g,NO_SENSORS)
+        # Save the given data to a capture file. The Excel CSV copy has already been written during the run.
+        # The exact time of each reading is kept in us alongside the float32 columns
+        save_capture(capturePath,np_data_g,NO_SENSORS,calibration=load_calibration().profile().name,
+                     timeStamps=np.rint(data_log.times() * 1000))
+        # The g values are plotted from the capture file through the min/max pyramid saved with it
+        capture_pyramid = CapturePyramid(capturePath)
 
         # This loop allows the user to look at the data in various formats before exiting the program
         while(finish == '0'):
@@ -317,17 +346,20 @@ def main():
             dataSelection = input('Which data do you want to use:\n0:ADC\n1:g\n')
             if (dataSelection == '0'):
                 data = np_data_ADC
+                pyramid = None
             elif(dataSelection == '1'):
                 data = np_data_g
+                pyramid = capture_pyramid
             else:
                 data = np_data_g
+                pyramid = capture_pyramid
 
             # Allows the choice between different display options
             selection = input('Which option:\n0:Single figure.\n1:Seperate figures.\n2:Manipulate Data\n3:Finish\n')
             if (selection == '0'):
-                plot_singlefig(data,NO_SENSORS,int(dataSelection)) # Plots all sensor graphs in one figure
+                plot_singlefig(data,NO_SENSORS,int(dataSelection),pyramid) # Plots all sensor graphs in one figure
             elif (selection == '1'):
-                plot_multifig(data,NO_SENSORS,int(dataSelection)) # Plots each sensor graph in a seperate figure one after the other
+                plot_multifig(data,NO_SENSORS,int(dataSelection),pyramid) # Plots each sensor graph in a seperate figure one after the other
             elif (selection == '2'):
                 modeSelect = '1'
                 finish = '1'
@@ -337,39 +369,26 @@ def main():
 
     if (modeSelect == '1'):
         
-        # Read out the data from scecified file
-        saved_data = read_csv(samplePath)
-        
-        # Remove the header, select a portion of data and convert the data to a float32 numpy array for manipulation
-        np_saved_data = np.array(saved_data[2:252]).astype(np.float32)
-
-        # Create a copy of the data for FFT
-        np_fft_data = np_saved_data.copy()
-        
-        # Perform an FFT on the X,Y and Z values for each sensor and save the magnitude
-        for i in range(0,NO_SENSORS):
-            for j in range(0,3):
-                np_fft_data[:,j+(4*i)] = abs(fftpack.fft(np_fft_data[:,j+(4*i)]))
-        
-        # Get number of samples
-        N = np_fft_data.shape[0]
-        # Get the time interval for each sensor
-        dt = np_fft_data[[1],[3,7,11,15,19]] - np_fft_data[[0],[3,7,11,15,19]]
-        # Find the smapling frequency for each sensor
-        fs = 1/dt
-
-        # Produce the frequency data corresponding to the FFT
-        for i in range(0,NO_SENSORS):
-            np_fft_data[:,3+(i*4)] = fftpack.fftfreq(N) * fs[i]
-
-        # Remove values above the Nyquist Frequency N/2
-        np_ffthalf_data = np_fft_data[:int(N/2)]
+        # Select a portion of data from the specified file as a float32 numpy array for manipulation.
+        # Only the portion of data selected is read from disk. Older captures only have a CSV file.
+        if (os.path.exists(capturePath)):
+            saved_data,header = open_capture(capturePath)
+            np_saved_data = np.array(saved_data[0:250],dtype=np.float32)
+        else:
+            # The whole CSV file is read as the PSD below covers the whole capture
+            saved_data = read_csv_array(samplePath)
+            np_saved_data = saved_data[0:250]
+
+        # Perform one FFT on the X,Y and Z values of every sensor and keep the magnitude below the Nyquist Frequency,
+        # with the frequency of each row in place of the time column
+        np_ffthalf_data = fft_magnitude(np_saved_data,NO_SENSORS)
 
         # Plot the FFT values
         plt.figure(1)
+        gridRows,gridColumns = subplot_grid(NO_SENSORS)
         for i in range(0,NO_SENSORS):
-            # The figure is seperated into subplots using the parameter. 231 means 2 rows, 3 columns, subplot 1
-            plt.subplot(231 + i)
+            # The figure is seperated into a grid of subplots with one for each sensor
+            plt.subplot(gridRows,gridColumns,i + 1)
             plt.title('Sensor ' + str(i + 1))
             plt.plot(np_ffthalf_data[:,(3 + (4 * i))],np_ffthalf_data[:,(0 + (4 * i))],label='X Axis')
             plt.plot(np_ffthalf_data[:,(3 + (4 * i))],np_ffthalf_data[:,(1 + (4 * i))],label='Y Axis')
@@ -381,6 +400,12 @@ def main():
 
         # Save the FFT values to CSV
         save_as_csv(savePath+'(FFT).csv',np_ffthalf_data,NO_SENSORS)
+
+        # Estimate the power spectral density over the whole capture by averaging the spectra of overlapping
+        # 256 sample segments, or one segment of the whole capture if it is shorter. The capture is read in blocks
+        # so its length does not matter.
+        np_psd_data = welch_psd(saved_data,NO_SENSORS,segmentSize=min(256,saved_data.shape[0]),overlap=0.5)
+        save_as_csv(savePath+'(PSD).csv',np_psd_data,NO_SENSORS)
         
         # This loop allows the user to look at the data in various formats before exiting the program
         finish = '0'
@@ -395,7 +420,8 @@ def main():
             elif (selection == '2'):
                 finish = '1'
 
-main()
+if __name__ == '__main__':
+    main()
 
 
 
@@ -0,0 +1,262 @@
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as scipy_fft
+from scipy import signal
+
+
+def sampling_frequencies(data,NO_SENSORS):
+    """ Returns the sampling frequency of each sensor in Hz, found from the interval between the first two times of each sensor in data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] with times in s.
+    """
+    return(1 / (data[1,3::4] - data[0,3::4]))
+
+
+@functools.lru_cache(maxsize=64)
+def fft_frequencies(NO_ROWS,fs):
+    """ Returns the frequencies in Hz of the one-sided spectrum of NO_ROWS(int) samples taken at fs(float) Hz, up to but not including the Nyquist frequency. The array is cached for each (NO_ROWS, fs) so repeated spectra of the same size share it, and is read only for that reason.
+    """
+    frequencies = scipy_fft.rfftfreq(NO_ROWS,1 / fs)[:NO_ROWS // 2]
+    frequencies.flags.writeable = False
+    return(frequencies)
+
+
+def fft_magnitude(data,NO_SENSORS,fs=None,workers=-1):
+    """ Returns the magnitude of the FFT of every X, Y and Z column of data(numpy array) of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time], with N defined by the NO_SENSORS(int) parameter, in the same form with each Time column replaced by the frequency in Hz.
+        All 3N columns are transformed with a single real FFT and only the first n/2 rows, below the Nyquist frequency, are computed and returned. fs(numpy array) gives the sampling frequency of each sensor and is found from the time columns, in s, if not given. workers(int) is the number of threads the FFT may use, with -1 using every CPU.
+    """
+    NO_ROWS = data.shape[0]
+    NO_HALF = NO_ROWS // 2
+    if (fs is None):
+        fs = sampling_frequencies(data,NO_SENSORS)
+
+    signals = np.asarray(data).reshape(NO_ROWS,NO_SENSORS,4)[:,:,:3].reshape(NO_ROWS,NO_SENSORS * 3)
+    spectrum = scipy_fft.rfft(signals,axis=0,workers=workers)[:NO_HALF]
+
+    fft_data = np.empty((NO_HALF,NO_SENSORS,4),dtype=np.result_type(data.dtype,np.float32))
+    fft_data[:,:,:3] = np.abs(spectrum).reshape(NO_HALF,NO_SENSORS,3)
+    for i in range(0,NO_SENSORS):
+        fft_data[:,i,3] = fft_frequencies(NO_ROWS,float(fs[i]))
+    return(fft_data.reshape(NO_HALF,NO_SENSORS * 4))
+
+
+class SpectralStream:
+    """ Splits data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time], with N defined by the NO_SENSORS(int) parameter and times in s, into overlapping segments of segmentSize(int) rows as it is fed a block at a time, and takes the FFT of each X, Y and Z column of every segment.
+        Consecutive segments overlap by the fraction overlap(float) and are multiplied by window(string or tuple), any window known to scipy.signal.get_window. If detrend(bool) is True the mean of each segment is removed first. Only the rows of the last partial segment are kept between blocks, so memory does not grow with the length of the capture.
+        fs(float or numpy array) is the sampling frequency of every sensor, or of each sensor, in Hz. If it is not given it is found from the time columns of the first block.
+    """
+
+    def __init__(self,NO_SENSORS,fs=None,segmentSize=256,overlap=0.5,window='hann',detrend=True):
+        self.NO_SENSORS = NO_SENSORS
+        self.fs = None if (fs is None) else np.broadcast_to(np.asarray(fs,dtype=np.float64),(NO_SENSORS,)).copy()
+        self.segmentSize = segmentSize
+        self.step = segmentSize - int(segmentSize * overlap)
+        if (self.step < 1 or self.step > segmentSize):
+            raise ValueError('overlap must be at least 0 and less than 1')
+        self.window = signal.get_window(window,segmentSize)
+        self.detrend = detrend
+        self.tail = np.empty((0,NO_SENSORS,4))
+        self.segments = 0   # Number of segments transformed so far
+
+    def frequencies(self):
+        """ Returns the frequency in Hz of each row of the one-sided spectrum of a segment, for each sensor, as a numpy array of dimension [segmentSize/2 + 1][NO_SENSORS].
+        """
+        return(scipy_fft.rfftfreq(self.segmentSize)[:,None] * self.fs)
+
+    def _spectra(self,data):
+        # Returns the FFT of each new whole segment, dimension [segments][NO_SENSORS][3][segmentSize/2 + 1], and the time of the middle of each segment
+        data = np.asarray(data,dtype=np.float64).reshape(-1,self.NO_SENSORS,4)
+        if (self.fs is None):
+            self.fs = 1 / (data[1,:,3] - data[0,:,3])
+        data = np.concatenate((self.tail,data))
+        count = max(((data.shape[0] - self.segmentSize) // self.step) + 1,0)
+        self.tail = data[count * self.step:].copy()
+        if (count == 0):
+            return(np.empty((0,self.NO_SENSORS,3,(self.segmentSize // 2) + 1),dtype=complex),np.empty((0,self.NO_SENSORS)))
+
+        segments = sliding_window_view(data,self.segmentSize,axis=0)[::self.step][:count]
+        signals = segments[:,:,:3]
+        if (self.detrend):
+            signals = signals - signals.mean(axis=-1,keepdims=True)
+        self.segments += count
+        return(scipy_fft.rfft(signals * self.window,axis=-1),segments[:,:,3,self.segmentSize // 2])
+
+    def _as_columns(self,values):
+        # Puts values of dimension [...][NO_SENSORS][3][frequencies] into the form [X1,Y1,Z1,Freq.....XN,YN,ZN,Freq] for each frequency
+        frequencies = self.frequencies()
+        columns = np.empty(values.shape[:-3] + (frequencies.shape[0],self.NO_SENSORS,4))
+        columns[...,:3] = np.moveaxis(values,-1,-3)
+        columns[...,3] = frequencies
+        return(columns.reshape(columns.shape[:-2] + (self.NO_SENSORS * 4,)))
+
+
+class WelchPSD(SpectralStream):
+    """ Estimates the power spectral density of each sensor axis by Welch's method while a capture is fed to it a block at a time with feed(). The options are those of SpectralStream.
+        averaging(string) is 'mean' to average the power of every segment, as scipy.signal.welch does, or 'peak' to keep the highest power seen at each frequency.
+    """
+
+    def __init__(self,NO_SENSORS,fs=None,segmentSize=256,overlap=0.5,window='hann',detrend=True,averaging='mean'):
+        SpectralStream.__init__(self,NO_SENSORS,fs,segmentSize,overlap,window,detrend)
+        if (averaging not in ('mean','peak')):
+            raise ValueError("averaging must be 'mean' or 'peak'")
+        self.averaging = averaging
+        self.power = np.zeros((NO_SENSORS,3,(segmentSize // 2) + 1))
+
+    def feed(self,data):
+        """ Adds the rows of data(numpy array) to the estimate.
+        """
+        spectra,times = self._spectra(data)
+        power = np.abs(spectra) ** 2
+        if (self.averaging == 'mean'):
+            self.power += power.sum(axis=0)
+        elif (power.shape[0] > 0):
+            np.maximum(self.power,power.max(axis=0),out=self.power)
+
+    def result(self):
+        """ Returns the power spectral density in units^2/Hz in the form [X1,Y1,Z1,Freq,X2,Y2,Z2,Freq.....XN,YN,ZN,Freq] with one row for each frequency up to the Nyquist frequency.
+        """
+        if (self.segments == 0):
+            raise ValueError('Fewer than segmentSize rows have been fed')
+        psd = self.power / (self.fs[:,None,None] * (self.window ** 2).sum())
+        if (self.averaging == 'mean'):
+            psd /= self.segments
+        # Power at the negative frequencies is added to the positive ones, which have no match at 0 Hz or, for an even segment, the Nyquist frequency
+        psd[:,:,1:(None if self.segmentSize % 2 else -1)] *= 2
+        return(self._as_columns(psd))
+
+
+class STFT(SpectralStream):
+    """ Produces the short-time Fourier transform, or spectrogram, of each sensor axis while a capture is fed to it a block at a time. The options are those of SpectralStream.
+        Each call to feed() returns the segments completed by that block, so a spectrogram of any length can be written out or plotted as it is made.
+    """
+
+    def feed(self,data):
+        """ Adds the rows of data(numpy array) and returns a tuple (times, frames). times holds the time of the middle of each new segment for each sensor, dimension [segments][NO_SENSORS]. frames holds the magnitude spectrum of each new segment, scaled so a sine of amplitude A peaks at about A/2, in the form [X1,Y1,Z1,Freq.....XN,YN,ZN,Freq] with dimension [segments][segmentSize/2 + 1][N*4].
+        """
+        spectra,times = self._spectra(data)
+        return(times,self._as_columns(np.abs(spectra) / self.window.sum()))
+
+
+def welch_psd(data,NO_SENSORS,blockSize=65536,**options):
+    """ Returns the Welch power spectral density of every sensor axis of data(numpy array) of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time], in the form given by WelchPSD.result. The data is read blockSize(int) rows at a time, so a memory mapped capture of any length can be used. options are passed to WelchPSD.
+    """
+    welch = WelchPSD(NO_SENSORS,**options)
+    for start in range(0,data.shape[0],blockSize):
+        welch.feed(data[start:start + blockSize])
+    return(welch.result())
+
+
+def spectrogram(data,NO_SENSORS,blockSize=65536,**options):
+    """ Generates the STFT of data(numpy array) of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] blockSize(int) rows at a time, giving a tuple (times, frames) for each block as returned by STFT.feed. options are passed to STFT.
+    """
+    stft = STFT(NO_SENSORS,**options)
+    for start in range(0,data.shape[0],blockSize):
+        yield(stft.feed(data[start:start + blockSize]))
+
+
+def interpolate_columns(data,NO_SENSORS,times):
+    """ Linearly interpolates every X, Y and Z column of data(numpy array) of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time], with N defined by the NO_SENSORS(int) parameter, at new times given by times(numpy array). times should have dimension [m] to use the same times for every sensor or [m][N] to give each sensor its own. Times outside those of a sensor take its first or last value, as np.interp does.
+        All sensors are interpolated together: the times of each sensor are offset so they can be searched as one sorted array and the values are then found with a single gather. The times of each sensor in data must be increasing and data must have at least 2 rows. The data returned is in the same form with the new times in the time columns.
+    """
+    data = np.asarray(data).reshape(data.shape[0],NO_SENSORS,4)
+    NO_ROWS = data.shape[0]
+    times = np.asarray(times,dtype=np.float64)
+    times = np.broadcast_to(times.reshape(times.shape[0],-1),(times.shape[0],NO_SENSORS))
+    NO_TIMES = times.shape[0]
+    dtype = np.result_type(data.dtype,np.float32)
+
+    # Each sensor's times are moved past the end of the sensor before it so that a single np.interp finds the
+    # fractional row of every new time in every sensor. Times outside a sensor's own times are clipped to its first or last row.
+    sensorTimes = data[:,:,3].T.astype(np.float64)
+    low = min(sensorTimes.min(),times.min())
+    span = max(sensorTimes.max(),times.max()) - low + 1
+    offsets = ((np.arange(NO_SENSORS) * span) - low)[:,None]
+    sensorTimes += offsets
+    first = (np.arange(NO_SENSORS) * NO_ROWS)[:,None]
+    rows = np.interp((times.T + offsets).ravel(),sensorTimes.ravel(),np.arange(NO_SENSORS * NO_ROWS,dtype=np.float64)).reshape(NO_SENSORS,NO_TIMES)
+    np.clip(rows,first,first + NO_ROWS - 1,out=rows)
+    rows -= first
+    lower = np.minimum(rows.astype(np.intp),NO_ROWS - 2).T
+    weight = (rows.T - lower).astype(dtype)[:,:,None]
+
+    # Row r of sensor i is row (r * NO_SENSORS) + i of the flattened data
+    lower = (lower * NO_SENSORS) + np.arange(NO_SENSORS)
+    flat = data.reshape(NO_ROWS * NO_SENSORS,4)
+    v0 = np.take(flat,lower,axis=0)[:,:,:3].astype(dtype)
+    difference = np.take(flat,lower + NO_SENSORS,axis=0)[:,:,:3].astype(dtype)
+    difference -= v0
+    difference *= weight
+    difference += v0
+
+    resampled = np.empty((NO_TIMES,NO_SENSORS,4),dtype=dtype)
+    resampled[:,:,:3] = difference
+    resampled[:,:,3] = times
+    return(resampled.reshape(times.shape[0],NO_SENSORS * 4))
+
+
+class Resampler:
+    """ Resamples data of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time], with N defined by the NO_SENSORS(int) parameter and times in s, to rate(float) Hz as it is fed a block at a time. Every sensor is given the same times, starting from the first time at which all sensors have a sample, so the output can be passed straight to the FFT and spectral functions.
+        method(string) is 'linear' to interpolate the samples as they are, or 'antialias' to first pass each axis through a low-pass FIR filter of numtaps(int) taps with its cut-off just below half the new rate, or half the sampling rate if that is lower, removing content that would alias when the rate is lowered. The filter state is carried from block to block and the filter delay is taken off the times. Only the last few rows of each block are kept for the next one, so memory does not grow with the length of the capture.
+    """
+
+    def __init__(self,NO_SENSORS,rate,method='linear',numtaps=63):
+        if (method not in ('linear','antialias')):
+            raise ValueError("method must be 'linear' or 'antialias'")
+        self.NO_SENSORS = NO_SENSORS
+        self.rate = rate
+        self.method = method
+        self.numtaps = numtaps
+        self.filters = None
+        self.tail = np.empty((0,NO_SENSORS,4))
+        self.start = None
+        self.count = 0  # Number of resampled rows given out so far
+
+    def _filter(self,data):
+        # Low-pass filters the X, Y and Z columns of each sensor and delays the times to match, with the state of each filter kept between blocks
+        if (self.filters is None):
+            period = (data[-1,:,3] - data[0,:,3]) / (data.shape[0] - 1)
+            self.delay = period * (self.numtaps - 1) / 2
+            self.filters = []
+            for i in range(0,self.NO_SENSORS):
+                # The cut-off is kept below the Nyquist frequency of the samples too, as it must be when the rate is raised
+                taps = signal.firwin(self.numtaps,0.9 * min(self.rate,1 / period[i]) / 2,fs=1 / period[i])
+                # Starting from the first values avoids a step from zero at the start of the capture
+                state = signal.lfilter_zi(taps,1.0)[:,None] * data[0,i,:3]
+                self.filters.append([taps,state])
+        for i in range(0,self.NO_SENSORS):
+            taps,state = self.filters[i]
+            data[:,i,:3],self.filters[i][1] = signal.lfilter(taps,1.0,data[:,i,:3],axis=0,zi=state)
+        data[:,:,3] -= self.delay
+        return(data)
+
+    def feed(self,data):
+        """ Adds the rows of data(numpy array) and returns the resampled rows that they complete, in the same form, as a numpy array of dimension [m][N*4].
+        """
+        data = np.array(data,dtype=np.float64).reshape(-1,self.NO_SENSORS,4)
+        if (data.shape[0] == 0):
+            return(np.empty((0,self.NO_SENSORS * 4)))
+        if (self.method == 'antialias'):
+            data = self._filter(data)
+        data = np.concatenate((self.tail,data))
+        if (self.start is None):
+            self.start = data[0,:,3].max()
+
+        # Rows are given out up to the last time that every sensor has reached
+        end = data[-1,:,3].min()
+        last = int(np.floor((end - self.start) * self.rate)) if (end >= self.start) else -1
+        times = self.start + (np.arange(self.count,last + 1) / self.rate)
+        self.count = max(self.count,last + 1)
+
+        # Keep the rows needed to interpolate the next time of every sensor
+        nextTime = self.start + (self.count / self.rate)
+        first = min([np.searchsorted(data[:,i,3],nextTime,side='right') - 1 for i in range(0,self.NO_SENSORS)])
+        resampled = interpolate_columns(data,self.NO_SENSORS,times) if (times.size > 0) else np.empty((0,self.NO_SENSORS * 4))
+        self.tail = data[max(first,0):].copy()
+        return(resampled)
+
+
+def resample(data,NO_SENSORS,rate,method='linear',blockSize=65536,**options):
+    """ Resamples the whole of data(numpy array) of the form [X1,Y1,Z1,Time,X2,Y2,Z2,Time.....XN,YN,ZN,Time] to rate(float) Hz using a Resampler, reading it blockSize(int) rows at a time. method(string) and options are passed to Resampler.
+    """
+    resampler = Resampler(NO_SENSORS,rate,method,**options)
+    blocks = [resampler.feed(data[start:start + blockSize]) for start in range(0,data.shape[0],blockSize)]
+    return(np.concatenate(blocks) if blocks else np.empty((0,NO_SENSORS * 4)))
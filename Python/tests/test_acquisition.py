@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import serial
+from Arduino_Emulator import ArduinoEmulator
+from Serial_Acquisition import AcquisitionThread, Subscription
+
+
+def block(rows):
+    return((np.zeros((rows,2,3),dtype=np.int64),np.zeros((rows,2))))
+
+
+def test_dropping_subscription_drops_newest_blocks():
+    subscription = Subscription(2)
+    for i in range(0,5):
+        subscription.put(block(10))
+    assert subscription.depth() == 2
+    assert subscription.overruns == 3 and subscription.droppedSamples == 30
+
+    # The end marker makes room for itself by dropping the oldest block
+    subscription.close()
+    assert subscription.queue.get()[0].shape[0] == 10
+    assert subscription.queue.get() is None
+    assert subscription.overruns == 4
+
+
+def test_storage_subscription_keeps_every_block():
+    subscription = Subscription(2,drop=False)
+    for i in range(0,5):
+        subscription.put(block(10))
+    subscription.close()
+    assert subscription.overruns == 0 and subscription.maxDepth == 5
+    blocks = [subscription.queue.get() for i in range(0,6)]
+    assert blocks[-1] is None and all(b[0].shape[0] == 10 for b in blocks[:-1])
+
+
+def test_stop_before_start():
+    emulator = ArduinoEmulator(2,50,'ascii').start()
+    serialPort = serial.Serial(emulator.port,timeout=5.0)
+    try:
+        acquisition = AcquisitionThread(serialPort,2,50,cycles=100)
+        subscription = acquisition.subscribe(drop=False)
+        acquisition.stop()
+        acquisition.start()
+        acquisition.join(10)
+        assert not acquisition.is_alive()
+        assert acquisition.blocks == 0
+        assert subscription.queue.get() is None
+    finally:
+        serialPort.close()
+        emulator.stop()
+
+
+@pytest.mark.parametrize('protocol',['ascii','binary'])
+def test_times_increase_across_cycles(protocol):
+    emulator = ArduinoEmulator(3,50,protocol).start()
+    serialPort = serial.Serial(emulator.port,timeout=5.0)
+    try:
+        acquisition = AcquisitionThread(serialPort,3,50,binary=(protocol == 'binary'),cycles=2)
+        subscription = acquisition.subscribe(drop=False)
+        acquisition.start()
+        acquisition.join(10)
+        blocks = [subscription.queue.get() for i in range(0,2)]
+    finally:
+        serialPort.close()
+        emulator.stop()
+
+    assert [readings.shape[0] for readings,timeStamps in blocks] == [50,50]
+    timeStamps = np.concatenate([timeStamps for readings,timeStamps in blocks])
+    # Every reading is later than the one before it, across sensors and across the cycles
+    assert np.all(np.diff(timeStamps.ravel()) > 0)
@@ -0,0 +1,103 @@
+import datetime
+import os
+import numpy as np
+import pytest
+from Calibration import CalibrationStore, load_calibration, fit_calibration, orientation_means
+from Serial_Test_MultiV5 import ADC_to_g
+
+NO_SENSORS = 2
+
+
+def write_store(path):
+    store = CalibrationStore(path)
+    store.add('A',[100.0,101.0,102.0],[-5.0,-4.9,-4.8],datetime.date(2020,1,1))
+    store.add('A',[110.0,111.0,112.0],[-5.5,-5.4,-5.3],datetime.date(2021,1,1))
+    store.add('B',[90.0,91.0,92.0],[-4.0,-4.1,-4.2],datetime.date(2019,1,1))
+    store.save()
+    return(store)
+
+
+def test_store_round_trip_and_dates(tmp_path):
+    path = str(tmp_path / 'Calibration.csv')
+    write_store(path)
+    store = CalibrationStore(path)
+
+    newest = store.profile(['A','B'])
+    assert newest.m.tolist() == [[110.0,111.0,112.0],[90.0,91.0,92.0]]
+    assert newest.name == 'A@2021-01-01;B@2019-01-01'
+    # A capture from 2020 is converted with the calibration current at the time
+    archived = store.profile(['A','B'],datetime.date(2020,6,1))
+    assert archived.b[0].tolist() == [-5.0,-4.9,-4.8]
+    assert store.profile(['A','B']) is newest
+
+
+def test_load_calibration_cached_until_changed(tmp_path):
+    path = str(tmp_path / 'Calibration.csv')
+    write_store(path)
+    store = load_calibration(path)
+    assert load_calibration(path) is store
+
+    other = CalibrationStore(path)
+    other.add('C',[1.0,1.0,1.0],[0.0,0.0,0.0])
+    other.save()
+    os.utime(path,(0,0))    # The modification time must change even within the file system's resolution
+    assert 'C' in load_calibration(path).calibrations
+
+
+def test_ADC_to_g_matches_formula(tmp_path):
+    path = str(tmp_path / 'Calibration.csv')
+    profile = write_store(path).profile(['A','B'])
+    rng = np.random.default_rng(0)
+    adc = rng.integers(0,1024,size=(100,NO_SENSORS,3)).astype(np.int16)
+    times = np.arange(100 * NO_SENSORS,dtype=np.float64).reshape(100,NO_SENSORS)
+    expected = (adc / profile.m) + profile.b
+
+    # The readings of a CaptureStore
+    g = ADC_to_g(adc,NO_SENSORS,profile=profile)
+    assert g.dtype == np.float32 and np.allclose(g,expected,atol=1e-5)
+
+    # The column layout keeps its time columns, also when converted in place
+    columns = np.concatenate((adc,times[:,:,None]),axis=2).reshape(100,NO_SENSORS * 4).astype(np.float64)
+    g = ADC_to_g(columns,NO_SENSORS,profile=profile)
+    assert np.allclose(g.reshape(100,NO_SENSORS,4)[:,:,:3],expected)
+    assert np.array_equal(g.reshape(100,NO_SENSORS,4)[:,:,3],times)
+    assert ADC_to_g(columns,NO_SENSORS,out=columns,profile=profile) is columns
+    assert np.array_equal(columns,g)
+
+
+def write_orientation(path,readings):
+    # Serial_Test_MultiCal saves two header rows then X, Y and Z for each sensor
+    with open(path,'w') as csv_file:
+        csv_file.write('Sensor 1\nX,Y,Z\n')
+        for row in readings:
+            csv_file.write(','.join(str(v) for v in row) + '\n')
+
+
+def test_fit_calibration_recovers_coefficients(tmp_path):
+    m = np.array([100.0,102.0,104.0])
+    b = np.array([-5.0,-5.1,-4.9])
+    paths = []
+    for gValues,name in (([1,0,0],'X-1g,Y-0g,Z-0g'),([-1,0,0],'X--1g,Y-0g,Z-0g'),([0,1,-1],'X-0g,Y-1g,Z--1g'),([0,-1,1],'X-0g,Y--1g,Z-1g')):
+        path = str(tmp_path / ('Sensor6(' + name + ').csv'))
+        adc = (np.array(gValues) - b) * m
+        write_orientation(path,np.tile(adc,(50,1)))
+        paths.append(path)
+
+    store = CalibrationStore(str(tmp_path / 'Calibration.csv'))
+    results = fit_calibration(paths,store,datetime.date(2022,1,1))
+    fittedM,fittedB,residual = results['6']
+    assert np.allclose(fittedM,m) and np.allclose(fittedB,b) and np.allclose(residual,0,atol=1e-9)
+    assert np.allclose(store.profile(['6']).m,m)
+
+
+def test_orientation_means_layout(tmp_path):
+    path = str(tmp_path / 'orientation.csv')
+    write_orientation(path,[[1,2,3,10,20,30]] * 10)
+    assert orientation_means(path,2).tolist() == [10,20,30]
+    assert orientation_means(path,1,width=6).tolist() == [1,2,3]
+    with pytest.raises(ValueError):
+        orientation_means(path)         # Two sensors and no position
+    with pytest.raises(ValueError):
+        orientation_means(path,3)       # No third sensor in the file
+    with pytest.raises(ValueError):
+        orientation_means(path,1,width=4)
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from Benchmark_Pipeline import synthetic_capture
+from Capture_File import CapturePyramid, PYRAMID_FACTOR, open_capture, read_capture_header, read_capture_times, save_capture, save_pyramid
+
+NO_SENSORS = 3
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'run.cap')
+    data = synthetic_capture(NO_SENSORS,1000)
+    # Exact times well past the 16s a float32 holds to the us, with an uneven step between readings
+    timeStamps = 60000000 + (np.arange(1000)[:,None] * 1250) + (np.arange(NO_SENSORS) * 17) + (np.arange(1000)[:,None] % 3)
+    save_capture(path,data,NO_SENSORS,calibration='1B@-;2@-;3B@-',timeStamps=timeStamps,pyramid=False)
+
+    saved,header = open_capture(path)
+    assert np.array_equal(saved,data)
+    assert header['sensors'] == NO_SENSORS and header['rows'] == 1000
+    assert header['calibration'] == '1B@-;2@-;3B@-' and header['units'] == 'g'
+    assert header['samplingPeriod'] == pytest.approx(float(data[-1,3] - data[0,3]) / 999)
+    assert np.array_equal(read_capture_times(path),timeStamps)
+    assert np.dtype(header['timeDtype']).itemsize == 2
+
+
+def test_capture_without_times(tmp_path):
+    path = str(tmp_path / 'run.cap')
+    save_capture(path,synthetic_capture(NO_SENSORS,10),NO_SENSORS,units='ADC',dtype='<f8',pyramid=False)
+    saved,header = open_capture(path)
+    assert saved.dtype == np.float64 and header['units'] == 'ADC'
+    assert read_capture_times(path) is None
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'run.cap'
+    path.write_bytes(b'X,Y,Z,Time\r\n')
+    with pytest.raises(ValueError):
+        read_capture_header(str(path))
+
+
+def test_pyramid_levels(tmp_path):
+    path = str(tmp_path / 'run.cap')
+    data = synthetic_capture(NO_SENSORS,100000)
+    data[5000,1] = np.nan    # A lost reading kept as NaN
+    save_capture(path,data,NO_SENSORS)
+    pyramid = CapturePyramid(path)
+
+    assert pyramid.binSizes == [PYRAMID_FACTOR ** (k + 1) for k in range(0,len(pyramid.binSizes))]
+    assert -(-100000 // pyramid.binSizes[-1]) <= 1024
+    for binSize,level in zip(pyramid.binSizes,pyramid.levels):
+        bins = -(-100000 // binSize)
+        padded = np.full((bins * binSize,NO_SENSORS * 4),np.nan,dtype=np.float32)
+        padded[:100000] = data
+        padded = padded.reshape(bins,binSize,NO_SENSORS * 4)
+        assert np.array_equal(level[:,:,0],np.nanmin(padded,axis=1))
+        assert np.array_equal(level[:,:,1],np.nanmax(padded,axis=1))
+
+
+def test_envelope(tmp_path):
+    path = str(tmp_path / 'run.cap')
+    data = synthetic_capture(NO_SENSORS,100000)
+    data[54321,0] = 50.0    # A single spike
+    save_capture(path,data,NO_SENSORS)
+    pyramid = CapturePyramid(path)
+    start,end = pyramid.time_range()
+    assert (start,end) == (float(data[0,3]),float(data[-1,3]))
+
+    # Zoomed out, two rows of each bin hold the minimum then the maximum and the spike is kept
+    envelope = pyramid.envelope(start,end,500,[0,3])
+    assert 1000 <= envelope.shape[0] <= 2 * 500 * 2 * PYRAMID_FACTOR
+    assert envelope[:,0].max() == 50.0 and envelope[:,0].min() == data[:,0].min()
+    assert np.all(envelope[0::2,0] <= envelope[1::2,0])
+    assert np.all(np.diff(envelope[1::2,1]) > 0)
+
+    # Zoomed in further than the finest level, the samples themselves are returned with a row either side
+    first,last = 2000,2100
+    samples = pyramid.envelope(float(data[first,7]),float(data[last,7]),500,[4,5,7])
+    assert np.array_equal(samples,data[first - 1:last + 2][:,[4,5,7]])
+
+
+def test_pyramid_of_empty_capture(tmp_path):
+    path = str(tmp_path / 'run.cap')
+    save_capture(path,np.empty((0,NO_SENSORS * 4),dtype=np.float32),NO_SENSORS)
+    pyramid = CapturePyramid(path)
+    assert pyramid.levels == []
+
+
+def test_pyramid_from_blocks_matches_whole(tmp_path):
+    data = synthetic_capture(NO_SENSORS,20000)
+    save_pyramid(str(tmp_path / 'whole.pyr'),data)
+    save_pyramid(str(tmp_path / 'blocks.pyr'),data,blockSize=7)
+    assert (tmp_path / 'whole.pyr').read_bytes() == (tmp_path / 'blocks.pyr').read_bytes()
@@ -0,0 +1,71 @@
+import numpy as np
+from Capture_Store import CaptureStore
+
+NO_SENSORS = 3
+
+
+def make_block(first,rows,NO_SENSORS=NO_SENSORS):
+    """ Returns rows(int) samples numbered from first(int) as (readings, timeStamps), every reading holding its sample number so the order can be checked.
+    """
+    numbers = np.arange(first,first + rows)
+    readings = np.repeat(numbers,NO_SENSORS * 3).reshape(rows,NO_SENSORS,3)
+    timeStamps = np.repeat(numbers * 10.0,NO_SENSORS).reshape(rows,NO_SENSORS)
+    return(readings,timeStamps)
+
+
+def test_append_keeps_every_block_in_order():
+    store = CaptureStore(NO_SENSORS,10,3)
+    for i in range(0,3):
+        store.append(*make_block(i * 10,10))
+    readings,timeStamps = make_block(0,30)
+    assert len(store) == 30 and store.dropped == 0
+    assert np.array_equal(store.readings(),readings)
+    assert np.array_equal(store.times(),timeStamps)
+
+
+def test_fixed_store_drops_samples_beyond_capacity():
+    store = CaptureStore(NO_SENSORS,10,2)
+    store.append(*make_block(0,15))
+    store.append(*make_block(15,15))
+    assert len(store) == 20 and store.dropped == 10
+    assert np.array_equal(store.readings(),make_block(0,20)[0])
+
+
+def test_ring_keeps_newest_samples_after_wrapping():
+    store = CaptureStore(NO_SENSORS,10,2,ring=True)
+    for i in range(0,5):
+        store.append(*make_block(i * 7,7))
+    readings,timeStamps = make_block(15,20)
+    assert len(store) == 20 and store.written == 35
+    assert np.array_equal(store.readings(),readings)
+    assert np.array_equal(store.times(),timeStamps)
+
+    # A block larger than the whole ring leaves only its newest samples
+    store.append(*make_block(35,50))
+    assert np.array_equal(store.readings(),make_block(65,20)[0])
+
+
+def test_as_columns_layout():
+    store = CaptureStore(NO_SENSORS,10,1)
+    readings,timeStamps = make_block(0,10)
+    store.append(readings.reshape(10,-1),timeStamps)
+    columns = store.as_columns(np.float32).reshape(10,NO_SENSORS,4)
+    assert np.array_equal(columns[:,:,:3],readings)
+    assert np.array_equal(columns[:,:,3],timeStamps)
+
+
+def test_as_columns_view_and_copy():
+    store = CaptureStore(NO_SENSORS,10,2,dtype=np.float32,columns=True)
+    store.append(*make_block(0,15))
+    view = store.as_columns(np.float32)
+    assert view.shape == (15,NO_SENSORS * 4) and np.shares_memory(view,store.data)
+    view[0,0] = -1
+    assert store.readings()[0,0,0] == -1
+
+    # Another type, or a ring buffer that has wrapped, is copied
+    assert not np.shares_memory(store.as_columns(np.float64),store.data)
+    ring = CaptureStore(NO_SENSORS,10,1,ring=True,dtype=np.float32,columns=True)
+    ring.append(*make_block(0,15))
+    columns = ring.as_columns(np.float32)
+    assert not np.shares_memory(columns,ring.data)
+    assert np.array_equal(columns.reshape(10,NO_SENSORS,4)[:,:,:3],make_block(5,10)[0])
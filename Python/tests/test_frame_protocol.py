@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+import serial
+from Arduino_Emulator import ArduinoEmulator, synthetic_readings
+from Serial_Protocol import FrameDecoder, FrameReader, ROWS_PER_FRAME, TIME_TICK, encode_frame, frame_size
+
+NO_SENSORS = 3
+
+
+def make_frames(count,NO_SENSORS=NO_SENSORS,first=0):
+    """ Returns a list of count(int) encoded frames starting at sequence number first(int), with the readings and the micros() time of every reading used to build them.
+    """
+    readings = synthetic_readings(NO_SENSORS,count * ROWS_PER_FRAME,0)
+    # Rows 1000us apart with the sensors read 100us after one another, a whole number of TIME_TICKs
+    times = 5000 + (np.arange(count * ROWS_PER_FRAME)[:,None] * 1000) + (np.arange(NO_SENSORS) * 25 * TIME_TICK)
+    frames = []
+    for i in range(0,count):
+        rows = slice(i * ROWS_PER_FRAME,(i + 1) * ROWS_PER_FRAME)
+        frames.append(encode_frame(first + i,readings[rows].tolist(),times[rows].tolist()))
+    return(frames,readings,times)
+
+
+def test_round_trip():
+    frames,readings,times = make_frames(4)
+    assert all(len(frame) == frame_size(NO_SENSORS) for frame in frames)
+
+    decoder = FrameDecoder(NO_SENSORS)
+    decodedReadings,decodedTimes,sequence = decoder.feed(b''.join(frames))
+    assert np.array_equal(decodedReadings.reshape(-1,NO_SENSORS * 3),readings)
+    assert np.allclose(decodedTimes,(times - times[0,0]) / 1000)
+    assert sequence.tolist() == [0,1,2,3]
+    assert decoder.crcErrors == 0 and decoder.skippedBytes == 0
+
+
+def test_partial_feeds_match_one_feed():
+    frames,readings,times = make_frames(5)
+    data = b''.join(frames)
+    decoder = FrameDecoder(NO_SENSORS)
+    blocks = [decoder.feed(data[i:i + 7]) for i in range(0,len(data),7)]
+    assert np.array_equal(np.concatenate([b[0] for b in blocks]).reshape(-1,NO_SENSORS * 3),readings)
+    assert np.concatenate([b[2] for b in blocks]).tolist() == [0,1,2,3,4]
+
+
+def test_empty_feed():
+    readings,times,sequence = FrameDecoder(NO_SENSORS).feed(b'')
+    assert readings.shape == (0,NO_SENSORS,3) and times.shape == (0,NO_SENSORS) and sequence.size == 0
+
+
+def test_crc_error_drops_only_that_frame():
+    frames,readings,times = make_frames(3)
+    corrupt = bytearray(frames[1])
+    corrupt[20] ^= 0x01
+    decoder = FrameDecoder(NO_SENSORS)
+    decodedReadings,decodedTimes,sequence = decoder.feed(frames[0] + bytes(corrupt) + frames[2])
+    assert sequence.tolist() == [0,2]
+    assert decoder.crcErrors == 1
+    assert decoder.skippedBytes == len(corrupt)
+    assert np.array_equal(decodedReadings[ROWS_PER_FRAME:].reshape(-1,NO_SENSORS * 3),readings[2 * ROWS_PER_FRAME:])
+
+
+def test_resync_after_noise():
+    frames,readings,times = make_frames(3)
+    # Noise holding a false sync word and a frame cut short by a reset
+    noise = b'\x00\xa5\x5a\x01' + frames[0][:11]
+    decoder = FrameDecoder(NO_SENSORS)
+    decodedReadings,decodedTimes,sequence = decoder.feed(noise + frames[1] + b'\xff' * 5 + frames[2])
+    assert sequence.tolist() == [1,2]
+    assert np.array_equal(decodedReadings.reshape(-1,NO_SENSORS * 3),readings[ROWS_PER_FRAME:])
+    assert decoder.skippedBytes == len(noise) + 5
+
+
+class Port:
+    """ A serial port that gives out the bytes given by data(bytes).
+    """
+
+    def __init__(self,data):
+        self.data = data
+        self.in_waiting = len(data)
+
+    def read(self,size):
+        data,self.data = self.data[:size],self.data[size:]
+        self.in_waiting = len(self.data)
+        return(data)
+
+
+def test_lost_frames_counted():
+    frames,readings,times = make_frames(6)
+    reader = FrameReader(Port(b''.join(frames[:2] + frames[4:])),NO_SENSORS)
+    decodedReadings,decodedTimes,sequence = reader.read_frames(4)
+    assert sequence.tolist() == [0,1,4,5]
+    assert reader.lostFrames == 2
+    assert reader.loss.lost.tolist() == [2 * ROWS_PER_FRAME] * NO_SENSORS
+    assert reader.loss.received.tolist() == [4 * ROWS_PER_FRAME] * NO_SENSORS
+    # The gap starts one row period after the last row before it
+    assert list(reader.loss.gaps)[0][:2] == ((times[2 * ROWS_PER_FRAME,0] - times[0,0]) / 1000,2 * ROWS_PER_FRAME)
+
+
+@pytest.mark.parametrize('fill',['nan','interpolate'])
+def test_lost_frames_filled(fill):
+    frames,readings,times = make_frames(6)
+    reader = FrameReader(Port(b''.join(frames[:1] + frames[3:])),NO_SENSORS,fill=fill)
+    first = reader.read_frames(2)
+    second = reader.read_frames(2)
+    filledReadings = np.concatenate((first[0],second[0])).reshape(-1,NO_SENSORS * 3)
+    filledTimes = np.concatenate((first[1],second[1]))
+
+    # The rows of the lost frames are put back with their times evenly spaced, as the rows were sent
+    assert filledReadings.shape[0] == 6 * ROWS_PER_FRAME
+    assert np.allclose(filledTimes,(times - times[0,0]) / 1000)
+    lost = slice(ROWS_PER_FRAME,3 * ROWS_PER_FRAME)
+    kept = np.r_[0:ROWS_PER_FRAME,3 * ROWS_PER_FRAME:6 * ROWS_PER_FRAME]
+    assert np.array_equal(filledReadings[kept],readings[kept])
+    if (fill == 'nan'):
+        assert np.all(np.isnan(filledReadings[lost]))
+    else:
+        # Filled from the rows either side of the gap, in the same type
+        assert np.issubdtype(filledReadings.dtype,np.integer)
+        before = readings[ROWS_PER_FRAME - 1]
+        after = readings[3 * ROWS_PER_FRAME]
+        weight = np.arange(1,2 * ROWS_PER_FRAME + 1)[:,None] / (2 * ROWS_PER_FRAME + 1)
+        assert np.array_equal(filledReadings[lost],np.rint(before + ((after - before) * weight)))
+
+
+def test_emulator_stream():
+    emulator = ArduinoEmulator(5,250,'binary').start()
+    serialPort = serial.Serial(emulator.port,timeout=5.0)
+    try:
+        reader = FrameReader(serialPort,5)
+        serialPort.write(b'S')
+        for cycle in range(0,3):
+            readings,times,sequence = reader.read_frames(250 // ROWS_PER_FRAME)
+            assert np.array_equal(readings.reshape(-1,15),synthetic_readings(5,250,cycle))
+            assert np.all(np.diff(times[:,0]) > 0)
+        serialPort.write(b'S')
+        assert reader.lostFrames == 0
+        assert reader.decoder.crcErrors == 0
+    finally:
+        serialPort.close()
+        emulator.stop()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from Serial_Protocol import LossStats, fill_gaps
+
+
+def block():
+    # 6 rows of 2 sensors where each reading is 10 times its time, with sensor 2 losing rows 1-2 and sensor 1 row 4
+    times = np.arange(6)[:,None] + np.array([0.0,0.5])
+    readings = np.repeat((times * 10)[:,:,None],3,axis=2).astype(np.int64)
+    present = np.ones((6,2),dtype=bool)
+    present[1:3,1] = False
+    present[4,0] = False
+    return(readings,times,present)
+
+
+def test_drop_removes_rows_with_a_lost_reading():
+    readings,times,present = block()
+    kept,keptTimes = fill_gaps(readings,times,present,'drop')
+    assert keptTimes[:,0].tolist() == [0,3,5]
+    assert np.array_equal(kept,readings[[0,3,5]])
+
+
+def test_nan_keeps_every_row():
+    readings,times,present = block()
+    filled,filledTimes = fill_gaps(readings,times,present,'nan')
+    assert filled.dtype.kind == 'f' and np.array_equal(filledTimes,times)
+    assert np.array_equal(np.isnan(filled[:,:,0]),~present)
+    assert np.array_equal(filled[present],readings[present])
+
+
+def test_interpolate_fills_from_either_side():
+    readings,times,present = block()
+    filled,filledTimes = fill_gaps(readings,times,present,'interpolate')
+    assert filled.dtype == readings.dtype
+    assert np.array_equal(filled,np.rint(times * 10)[:,:,None].repeat(3,axis=2))
+
+    # A gap at the start of a block is filled from the last row of the block before
+    present[0,1] = False
+    anchor = (np.full((2,3),-5),np.array([-1.0,-0.5]))
+    filled,filledTimes = fill_gaps(readings,times,present,'interpolate',anchor)
+    assert filled[0,1].tolist() == [5,5,5]
+    # Without an anchor it takes the first reading received
+    filled,filledTimes = fill_gaps(readings,times,present,'interpolate')
+    assert filled[0,1].tolist() == [35,35,35]
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        fill_gaps(*block(),'zero')
+
+
+def test_loss_stats():
+    readings,times,present = block()
+    loss = LossStats(2)
+    loss.add(present,times)
+    loss.add_lost(6.0,4)
+    assert loss.received.tolist() == [5,4]
+    assert loss.lost.tolist() == [5,6]
+    assert np.allclose(loss.loss_rate(),[0.5,0.6])
+    gaps = list(loss.gaps)
+    assert [(t,rows) for t,rows,sensors in gaps] == [(1.0,2),(4.0,1),(6.0,4)]
+    assert [sensors.tolist() for t,rows,sensors in gaps] == [[False,True],[True,False],[True,True]]
+    assert loss.summary()['longestGap'] == 4
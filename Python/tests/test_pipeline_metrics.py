@@ -0,0 +1,50 @@
+import json
+import threading
+import urllib.request
+from Pipeline_Metrics import PipelineMetrics
+
+
+def test_snapshot_while_threads_add_keys():
+    metrics = PipelineMetrics()
+    finished = threading.Event()
+
+    def add():
+        for i in range(0,20000):
+            metrics.fail('decode','reason ' + str(i))
+            metrics.high_water('queue ' + str(i),i)
+        finished.set()
+
+    thread = threading.Thread(target=add)
+    thread.start()
+    snapshots = 0
+    while (not finished.is_set()):
+        metrics.snapshot()
+        snapshots += 1
+    thread.join()
+
+    snapshot = metrics.snapshot()
+    assert len(snapshot['stages']['decode']['failures']) == 20000
+    assert len(snapshot['highWater']) == 20000 and snapshots > 0
+
+
+def test_counters_and_serve():
+    metrics = PipelineMetrics()
+    metrics.record('parse',0.002,items=250,nbytes=4000)
+    metrics.record('parse',0.004,items=250,nbytes=4000)
+    metrics.fail('parse','malformed line',3)
+    metrics.fail('parse','malformed line',0)
+    metrics.high_water('queue',5)
+    metrics.high_water('queue',2)
+
+    server = metrics.serve(0)
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:' + str(server.server_address[1])) as response:
+            snapshot = json.load(response)
+    finally:
+        metrics.stop_serving()
+    parse = snapshot['stages']['parse']
+    assert (parse['runs'],parse['items'],parse['bytes']) == (2,500,8000)
+    assert parse['failures'] == { 'malformed line': 3 }
+    assert parse['latency']['max'] == 0.004
+    assert snapshot['highWater'] == { 'queue': 5 }
+    assert 'parse' in metrics.report()
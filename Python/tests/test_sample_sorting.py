@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import Serial_Test_MultiV4
+import Serial_Test_MultiV5
+from Benchmark_Pipeline import equalise_sample_numbers_legacy, synthetic_log
+
+MODULES = [Serial_Test_MultiV4,Serial_Test_MultiV5]
+
+
+def sort_samples_legacy(np_data,NO_SENSORS):
+    # The original implementation, which sort_samples must match
+    np_data_sorted = np_data[:,[1,2,3,4]][np_data[:,0] == 1 ]
+    for i in range(2,NO_SENSORS+1):
+        np_temp = np_data[:,[1,2,3,4]][np_data[:,0] == i ]
+        np_data_sorted = np.concatenate((np_data_sorted,np_temp), axis=1)
+    return (np_data_sorted)
+
+
+@pytest.mark.parametrize('module',MODULES)
+@pytest.mark.parametrize('NO_SENSORS',[1,2,5,16])
+@pytest.mark.parametrize('lossRate',[0.0,0.01,0.2])
+def test_matches_original(module,NO_SENSORS,lossRate):
+    log = synthetic_log(NO_SENSORS,5000,lossRate,seed=NO_SENSORS)
+    equalised = module.equalise_sample_numbers(log,NO_SENSORS)
+    assert np.array_equal(equalised,equalise_sample_numbers_legacy(log,NO_SENSORS))
+    assert np.array_equal(module.sort_samples(equalised,NO_SENSORS),sort_samples_legacy(equalised,NO_SENSORS))
+
+
+@pytest.mark.parametrize('module',MODULES)
+def test_uneven_losses_at_the_end(module):
+    # Sensor 2 loses a run of samples and sensor 3 a scattered few, all near the end of the log
+    log = synthetic_log(3,300,0.0)
+    lost = np.zeros(300,dtype=bool)
+    lost[[286,289,292,295,298]] = True
+    lost[[277,283,295]] = True
+    log = log[~lost]
+    equalised = module.equalise_sample_numbers(log,3)
+    assert np.array_equal(equalised,equalise_sample_numbers_legacy(log,3))
+    counts = np.bincount(equalised[:,0].astype(int))[1:]
+    assert np.all(counts == counts[0])
+
+
+@pytest.mark.parametrize('module',MODULES)
+def test_sensor_with_no_samples(module):
+    # Every sample of the other sensors has to go, which the original fails to do with an IndexError
+    log = synthetic_log(3,30,0.0)
+    log = log[log[:,0] != 2]
+    with pytest.raises(IndexError):
+        equalise_sample_numbers_legacy(log,3)
+    with pytest.raises(IndexError):
+        module.equalise_sample_numbers(log,3)
+
+
+@pytest.mark.parametrize('module',MODULES)
+def test_empty_log(module):
+    log = np.empty((0,5))
+    equalised = module.equalise_sample_numbers(log,3)
+    assert equalised.shape == (0,5)
+    assert module.sort_samples(equalised,3).shape == sort_samples_legacy(equalised,3).shape == (0,12)
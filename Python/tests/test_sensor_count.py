@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from Calibration import CalibrationProfile, RIG_SENSORS
+from Capture_File import csv_header, time_columns, read_csv_array
+from Live_Plot import subplot_grid
+from Serial_Test_MultiV5 import ADC_to_g, save_as_csv
+from Signal_Processing import fft_magnitude
+
+
+def profile(NO_SENSORS):
+    m = 100 + np.arange(NO_SENSORS * 3,dtype=np.float64).reshape(NO_SENSORS,3)
+    b = np.full((NO_SENSORS,3),-5.0)
+    return(CalibrationProfile([str(i + 1) for i in range(0,NO_SENSORS)],m,b,[None] * NO_SENSORS))
+
+
+def columns(NO_SENSORS,NO_ROWS=64):
+    # ADC readings that name their own sensor and axis, with the time in ms
+    data = np.empty((NO_ROWS,NO_SENSORS,4))
+    data[:,:,:3] = 512 + np.arange(NO_SENSORS * 3).reshape(NO_SENSORS,3)
+    data[:,:,3] = (np.arange(NO_ROWS)[:,None] * 1.25) + (np.arange(NO_SENSORS) * 0.05)
+    return(data.reshape(NO_ROWS,NO_SENSORS * 4))
+
+
+@pytest.mark.parametrize('NO_SENSORS',[1,5,16,32])
+def test_header_and_time_columns(NO_SENSORS):
+    sensorRow,columnRow = csv_header(NO_SENSORS)
+    assert len(columnRow) == NO_SENSORS * 4
+    assert len(sensorRow) == (NO_SENSORS * 4) - 3
+    assert [sensorRow[i * 4] for i in range(0,NO_SENSORS)] == ['Sensor ' + str(i + 1) for i in range(0,NO_SENSORS)]
+    assert [columnRow[i] for i in time_columns(NO_SENSORS)] == ['Time/ms'] * NO_SENSORS
+    rows,gridColumns = subplot_grid(NO_SENSORS)
+    assert rows * gridColumns >= NO_SENSORS and (rows - 1) * gridColumns < NO_SENSORS
+
+
+def test_five_sensor_header_unchanged():
+    # The header of the original five sensor scripts
+    assert csv_header(5) == [ ['Sensor 1',' ',' ',' ','Sensor 2',' ',' ',' ','Sensor 3',' ',' ',' ','Sensor 4',' ',' ',' ','Sensor 5'],
+                              ['X','Y','Z','Time/ms'] * 5 ]
+
+
+@pytest.mark.parametrize('NO_SENSORS',[16,32])
+def test_many_sensors_through_the_pipeline(tmp_path,NO_SENSORS):
+    data = columns(NO_SENSORS)
+    g = ADC_to_g(data,NO_SENSORS,profile=profile(NO_SENSORS)).reshape(-1,NO_SENSORS,4)
+    expected = (data.reshape(-1,NO_SENSORS,4)[:,:,:3] / profile(NO_SENSORS).m) - 5.0
+    assert np.allclose(g[:,:,:3],expected)
+    assert np.array_equal(g[:,:,3],data.reshape(-1,NO_SENSORS,4)[:,:,3])
+
+    path = str(tmp_path / 'capture.csv')
+    save_as_csv(path,data,NO_SENSORS)
+    assert np.allclose(read_csv_array(path),data)
+    assert np.allclose(read_csv_array(path,sensors=[NO_SENSORS]),data[:,-4:])
+
+    seconds = data.copy()
+    seconds[:,time_columns(NO_SENSORS)] /= 1000
+    assert fft_magnitude(seconds,NO_SENSORS).shape == (32,NO_SENSORS * 4)
+
+
+def test_missing_calibration_named():
+    NO_SENSORS = len(RIG_SENSORS) + 2
+    with pytest.raises(ValueError,match='sensors 6, 7 of 7'):
+        ADC_to_g(columns(NO_SENSORS),NO_SENSORS,profile=profile(len(RIG_SENSORS)))
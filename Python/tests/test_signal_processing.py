@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from scipy import signal
+from Benchmark_Pipeline import synthetic_capture
+from Signal_Processing import STFT, WelchPSD, welch_psd, interpolate_columns, resample
+
+NO_SENSORS = 3
+RATE = 800.0
+
+
+def capture(NO_ROWS):
+    # A synthetic capture with exact float64 times. The float32 times of a saved capture are uneven by their
+    # rounding, which moves the sampling period the anti-alias filter is designed from by whether it is found from
+    # the first block or the whole capture.
+    data = synthetic_capture(NO_SENSORS,NO_ROWS,RATE).astype(np.float64).reshape(NO_ROWS,NO_SENSORS,4)
+    data[:,:,3] = (np.arange(NO_ROWS)[:,None] + (np.arange(NO_SENSORS) / NO_SENSORS)) / RATE
+    return(data.reshape(NO_ROWS,NO_SENSORS * 4))
+
+
+def test_welch_matches_scipy():
+    data = synthetic_capture(NO_SENSORS,5000,RATE).astype(np.float64)
+    psd = welch_psd(data,NO_SENSORS,blockSize=777,segmentSize=256,overlap=0.5).reshape(-1,NO_SENSORS,4)
+    signals = data.reshape(-1,NO_SENSORS,4)
+    for i in range(0,NO_SENSORS):
+        fs = 1 / (signals[1,i,3] - signals[0,i,3])
+        frequencies,expected = signal.welch(signals[:,i,:3],fs,nperseg=256,noverlap=128,axis=0)
+        assert np.allclose(psd[:,i,3],frequencies)
+        assert np.allclose(psd[:,i,:3],expected)
+
+
+def test_welch_blocks_match_whole():
+    data = synthetic_capture(NO_SENSORS,3000,RATE)
+    whole = welch_psd(data,NO_SENSORS,blockSize=data.shape[0],averaging='peak')
+    assert np.allclose(welch_psd(data,NO_SENSORS,blockSize=100,averaging='peak'),whole)
+
+
+def test_welch_needs_a_segment():
+    welch = WelchPSD(NO_SENSORS,segmentSize=256)
+    welch.feed(synthetic_capture(NO_SENSORS,255,RATE))
+    with pytest.raises(ValueError):
+        welch.result()
+
+
+def test_stft_peak_of_a_sine():
+    # A 100Hz sine of amplitude 2 falls on a frequency bin of a 256 sample segment at 800Hz
+    t = np.arange(2048) / RATE
+    data = np.zeros((2048,1,4))
+    data[:,0,0] = 2 * np.sin(2 * np.pi * 100 * t)
+    data[:,0,3] = t
+    stft = STFT(1,segmentSize=256,overlap=0.5)
+    blocks = [stft.feed(data[start:start + 300].reshape(-1,4)) for start in range(0,2048,300)]
+    times = np.concatenate([b[0] for b in blocks])
+    frames = np.concatenate([b[1] for b in blocks])
+    assert frames.shape == (15,129,4)
+    assert np.allclose(times[:,0],t[128:128 + (15 * 128):128])
+    peak = frames[:,:,0].argmax(axis=1)
+    assert np.all(frames[0,peak,3] == 100)
+    assert np.allclose(frames[:,32,0],1.0)
+
+
+def test_interpolate_columns_matches_interp():
+    data = synthetic_capture(NO_SENSORS,500,RATE).astype(np.float64)
+    times = np.linspace(0.01,0.6,333)
+    resampled = interpolate_columns(data,NO_SENSORS,times).reshape(-1,NO_SENSORS,4)
+    signals = data.reshape(-1,NO_SENSORS,4)
+    for i in range(0,NO_SENSORS):
+        for axis in range(0,3):
+            assert np.allclose(resampled[:,i,axis],np.interp(times,signals[:,i,3],signals[:,i,axis]),atol=1e-6)
+    assert np.array_equal(resampled[:,:,3],np.broadcast_to(times[:,None],(333,NO_SENSORS)))
+
+
+@pytest.mark.parametrize('method',['linear','antialias'])
+@pytest.mark.parametrize('rate',[300.0,2000.0])
+def test_resample_blocks_match_whole(method,rate):
+    data = capture(4000)
+    whole = resample(data,NO_SENSORS,rate,method,blockSize=data.shape[0])
+    blocks = resample(data,NO_SENSORS,rate,method,blockSize=123)
+    assert whole.shape == blocks.shape
+    assert np.allclose(blocks,whole,atol=1e-9)
+
+    # Every sensor is given the same uniform times from the first time all sensors have a sample
+    times = whole.reshape(-1,NO_SENSORS,4)[:,:,3]
+    assert np.all(times == times[:,:1])
+    assert np.allclose(np.diff(times[:,0]),1 / rate)
+
+
+def test_antialias_removes_content_above_new_nyquist():
+    # 50Hz passes and 300Hz, above the 100Hz Nyquist frequency of the new rate, is removed rather than aliased
+    t = np.arange(8000) / RATE
+    data = np.zeros((8000,1,4))
+    data[:,0,0] = np.sin(2 * np.pi * 50 * t)
+    data[:,0,1] = np.sin(2 * np.pi * 300 * t)
+    data[:,0,3] = t
+    resampled = resample(data.reshape(-1,4),1,200.0,'antialias',numtaps=127)[200:]
+    assert np.abs(resampled[:,0]).max() > 0.9
+    assert np.abs(resampled[:,1]).max() < 0.05
@@ -0,0 +1,72 @@
+import asyncio
+import numpy as np
+import serial
+from Arduino_Emulator import ArduinoEmulator, synthetic_readings
+from Serial_Acquisition import SerialStream, open_streams
+from Serial_Protocol import ROWS_PER_FRAME, encode_frame
+
+
+async def take(stream,NO_BLOCKS,timeout=10.0):
+    """ Returns the first NO_BLOCKS(int) blocks given out by stream(SerialStream or MergedStream).
+    """
+    blocks = []
+    async def read():
+        async for block in stream:
+            blocks.append(block)
+            if (len(blocks) == NO_BLOCKS):
+                return
+    await asyncio.wait_for(read(),timeout)
+    return(blocks)
+
+
+def test_loop_url_stream():
+    # loop:// has no file descriptor, so the stream polls it. The 'S' it sends is echoed back and skipped as noise.
+    NO_SENSORS = 2
+    NO_SAMPLES = 20
+    readings = synthetic_readings(NO_SENSORS,NO_SAMPLES * 2,0)
+    times = (np.arange(NO_SAMPLES * 2)[:,None] * 1000) + (np.arange(NO_SENSORS) * 100)
+    frames = b''.join(encode_frame(i,readings[i * ROWS_PER_FRAME:(i + 1) * ROWS_PER_FRAME].tolist(),
+                                   times[i * ROWS_PER_FRAME:(i + 1) * ROWS_PER_FRAME].tolist()) for i in range(0,4))
+
+    async def run():
+        serialPort = serial.serial_for_url('loop://',timeout=0)
+        stream = SerialStream(serialPort,NO_SENSORS,NO_SAMPLES,binary=True,name='loop')
+        async with stream:
+            serialPort.write(frames)
+            return(await take(stream,2),stream)
+
+    blocks,stream = asyncio.run(run())
+    assert [name for name,r,t in blocks] == ['loop','loop']
+    assert np.array_equal(np.concatenate([r for name,r,t in blocks]).reshape(-1,NO_SENSORS * 3),readings)
+    assert stream.overruns == 0
+    assert stream.decoder.crcErrors == 0
+
+
+def test_open_streams_merges_by_time():
+    emulators = [ArduinoEmulator(5,250,protocol).start() for protocol in ('ascii','ascii','binary')]
+    ports = [emulator.port for emulator in emulators]
+    try:
+        async def run():
+            text = open_streams(ports[:2],5,250)
+            async with text as merged:
+                textBlocks = await take(merged,8)
+            binary = open_streams(ports[2:],5,250,binary=True)
+            async with binary as merged:
+                binaryBlocks = await take(merged,2)
+            return(textBlocks,binaryBlocks)
+
+        textBlocks,binaryBlocks = asyncio.run(run())
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+
+    # Blocks come out in order of their first reading, taking turns between ports sending at the same rate
+    firstTimes = [float(t[0,0]) for name,r,t in textBlocks]
+    assert firstTimes == sorted(firstTimes)
+    assert {name for name,r,t in textBlocks} == set(ports[:2])
+    for name in ports[:2]:
+        cycles = [r for n,r,t in textBlocks if n == name]
+        assert np.array_equal(cycles[0].reshape(-1,15),synthetic_readings(5,250,0))
+        assert np.array_equal(cycles[1].reshape(-1,15),synthetic_readings(5,250,1))
+    assert all(r.shape == (250,5,3) for name,r,t in binaryBlocks)
+    assert np.array_equal(binaryBlocks[0][1].reshape(-1,15),synthetic_readings(5,250,0))